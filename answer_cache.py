@@ -0,0 +1,128 @@
+"""
+Кэш ответов LLM.
+
+Одинаковые вопросы ("Что такое API?") к той же модели и тому же персонажу
+не идут в OpenRouter повторно. Два уровня:
+
+- LRU в памяти процесса (быстрый, ограничен memory_size записями);
+- таблица llm_cache в SQLite (общая для процессов, ограничена max_rows).
+
+Ключ - sha256 от модели, system-промпта персонажа, нормализованного
+вопроса, temperature и max_tokens. У записей есть TTL.
+
+Попадания и промахи считаются в metric.counter("llm_cache_hits") и
+metric.counter("llm_cache_misses"), доля попаданий - hit_ratio().
+
+Пример использования:
+
+    key = make_key(model_key, system_prompt, question, 0.2, 400)
+    text = cache.get(key)
+    if text is None:
+        text, _ = chat_once(...)
+        cache.put(key, model_key, text)
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import db
+from metrics import metric
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Регистр, лишние пробелы и завершающая пунктуация на ответ не влияют."""
+    q = _SPACES.sub(" ", question).strip().casefold()
+    return q.rstrip(" ?!.…")
+
+
+def make_key(model: str, system_prompt: str, question: str, temperature: float, max_tokens: int) -> str:
+    raw = json.dumps(
+        [model, system_prompt, normalize_question(question), temperature, max_tokens],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, memory_size: int = 1000, ttl_s: float = 86400.0,
+                 max_rows: int = 10000, persistent: bool = True,
+                 prune_every: int = 100) -> None:
+        self.memory_size = memory_size
+        self.ttl_s = ttl_s
+        self.max_rows = max_rows
+        self.persistent = persistent
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        # key -> (answer, expires_at), порядок - от давно использованных к недавним
+        self._memory: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._puts = 0
+        self._hits = metric.counter("llm_cache_hits")
+        self._misses = metric.counter("llm_cache_misses")
+
+    def _remember(self, key: str, answer: str, expires_at: float) -> None:
+        with self._lock:
+            self._memory[key] = (answer, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._memory.move_to_end(key)
+                    self._hits.inc()
+                    return item[0]
+                del self._memory[key]
+
+        if self.persistent:
+            row = db.llm_cache_get(key, now)
+            if row is not None:
+                # Срок берём из строки: запись в памяти не должна пережить её
+                answer, expires_at = row
+                self._remember(key, answer, expires_at)
+                self._hits.inc()
+                return answer
+
+        self._misses.inc()
+        return None
+
+    def put(self, key: str, model: str, answer: str) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_s
+        self._remember(key, answer, expires_at)
+        if not self.persistent:
+            return
+        db.llm_cache_put(key, model, answer, now, expires_at)
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % self.prune_every == 0
+        if prune:
+            db.llm_cache_prune(self.max_rows, now)
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
+
+    def hit_ratio(self) -> float:
+        hits, misses = self._hits.get(), self._misses.get()
+        total = hits + misses
+        return hits / total if total else 0.0
+
+
+# Кэш ответов бота
+cache = AnswerCache(
+    memory_size=int(os.getenv("LLM_CACHE_MEMORY_SIZE", "1000")),
+    ttl_s=float(os.getenv("LLM_CACHE_TTL_S", "86400")),
+    max_rows=int(os.getenv("LLM_CACHE_MAX_ROWS", "10000")),
+)
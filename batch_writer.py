@@ -0,0 +1,152 @@
+"""
+Отложенная запись строк в SQLite пачками (write-behind).
+
+Вызывающий поток только кладёт строку в очередь; фоновый поток собирает
+пачку и пишет её одним executemany в одной транзакции, когда набралось
+batch_size строк или прошло flush_interval_ms с первой строки пачки.
+Так несколько событий делят одну блокировку записи и один fsync.
+
+- put() не блокирует: если очередь заполнена, возвращает False, и
+  вызывающий сам решает, что делать со строкой (например, записать её
+  синхронно);
+- flush() ждёт, пока запишется всё, что было поставлено до вызова;
+- close() дописывает очередь и останавливает поток; вызывается и при
+  выходе из процесса (atexit);
+- on_batch(conn, n) вызывается после каждой пачки в той же транзакции
+  (например, чтобы подрезать таблицу).
+
+Метрики: batch_<имя>_flush_ms (время записи пачки), batch_<имя>_rows
+(записано строк), batch_<имя>_failed (строк потеряно из-за ошибки БД).
+
+Пример использования:
+
+    writer = BatchWriter("activity", "INSERT INTO activity_log(user_id, action) VALUES (?, ?)",
+                         db._connect, flush_interval_ms=200, batch_size=500)
+    if not writer.put((user_id, "create")):
+        ...  # очередь заполнена
+"""
+
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, ContextManager, List, Optional
+
+from metrics import metric
+
+log = logging.getLogger(__name__)
+
+# Служебные элементы очереди
+_STOP = object()
+
+
+class BatchWriter:
+    def __init__(self, name: str, sql: str,
+                 connect: Callable[[], ContextManager[sqlite3.Connection]],
+                 flush_interval_ms: int = 200, batch_size: int = 500,
+                 max_queue: int = 10000,
+                 on_batch: Optional[Callable[[sqlite3.Connection, int], None]] = None) -> None:
+        if batch_size < 1 or flush_interval_ms < 0:
+            raise ValueError("BatchWriter: batch_size должно быть >= 1, flush_interval_ms >= 0")
+        self.name = name
+        self.sql = sql
+        self.connect = connect
+        self.flush_interval_s = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._flush_ms = metric.latency(f"batch_{name}_flush_ms")
+        self._rows = metric.counter(f"batch_{name}_rows")
+        self._failed = metric.counter(f"batch_{name}_failed")
+
+    def _ensure_started(self) -> None:
+        # Поток запускается при первой записи, а не при импорте модуля
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"BatchWriter {self.name} закрыт")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"batch-{self.name}", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def put(self, row: tuple) -> bool:
+        """Поставить строку в очередь. False - очередь заполнена, строка не принята."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            return False
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться записи всего, что поставлено до вызова. False - не успели за timeout."""
+        with self._lock:
+            if self._thread is None or self._closed:
+                return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Дописать очередь и остановить фоновый поток."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None:
+            return
+        atexit.unregister(self.close)
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _write(self, rows: List[tuple]) -> None:
+        t0 = time.perf_counter()
+        try:
+            with self.connect() as conn:
+                conn.executemany(self.sql, rows)
+                if self.on_batch is not None:
+                    self.on_batch(conn, len(rows))
+        except Exception:
+            self._failed.inc(len(rows))
+            log.exception("BatchWriter %s: не удалось записать %d строк", self.name, len(rows))
+            return
+        self._rows.inc(len(rows))
+        self._flush_ms.observe(int((time.perf_counter() - t0) * 1000))
+
+    def _run(self) -> None:
+        rows: List[tuple] = []
+        waiters: List[threading.Event] = []
+        deadline = None
+        stop = False
+        while not stop:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stop = True
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None:
+                rows.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval_s
+
+            # Пишем, когда пачка набралась, истёк интервал, кто-то ждёт flush
+            # или поток останавливается
+            if rows and (len(rows) >= self.batch_size or time.monotonic() >= deadline
+                         or waiters or stop):
+                self._write(rows)
+                rows = []
+                deadline = None
+            for done in waiters:
+                done.set()
+            waiters.clear()
@@ -0,0 +1,67 @@
+"""
+Бенчмарк: накладные расходы на вызов db.* до и после пула соединений.
+
+"До" - как раньше: новое соединение + три PRAGMA на каждый вызов.
+"После" - db._connect() из пула.
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_db_pool.py [количество_вызовов]
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+def _legacy_connect():
+    conn = sqlite3.connect(db.DB_PATH, timeout=5.0)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+def _query(conn) -> None:
+    conn.execute("SELECT id, key, label FROM models WHERE active=1").fetchone()
+
+
+def bench_legacy(n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        conn = _legacy_connect()
+        with conn:
+            _query(conn)
+        conn.close()
+    return time.perf_counter() - t0
+
+
+def bench_pooled(n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with db._connect() as conn:
+            _query(conn)
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        db.init_db()
+        for name, fn in (("без пула", bench_legacy), ("с пулом", bench_pooled)):
+            dt = fn(n)
+            print(f"{name:>10}: {n} вызовов за {dt:.3f} с; "
+                  f"{dt / n * 1e6:8.1f} мкс/вызов; {n / dt:10.0f} вызовов/с")
+        db.close_pools()
+
+
+if __name__ == "__main__":
+    main()
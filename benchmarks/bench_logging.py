@@ -0,0 +1,106 @@
+"""
+Бенчмарк: сколько стоит один вызов логгера для потока-обработчика.
+
+- file (sync)   - FileHandler прямо в потоке вызова (как log.py раньше);
+- queue stdlib  - logging.handlers.QueueHandler + QueueListener;
+- queue (async) - BoundedQueueHandler из log_handlers (LOG_ASYNC=1):
+                  без copy.copy и полного format() в потоке вызова.
+
+Каждый вариант меряется с обычной записью в файл и с fsync на каждую
+запись (медленный диск).
+
+Отдельно: вызов ниже уровня логгера с f-строкой и с %-аргументами -
+f-строка форматируется, даже если запись никуда не пойдёт.
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_logging.py [количество_записей]
+"""
+
+import logging
+import os
+import queue
+import sys
+import tempfile
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_handlers import start_queue_logging  # noqa: E402
+
+FMT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class _FsyncFileHandler(logging.FileHandler):
+    """Файл с fsync после каждой записи - имитация медленного диска."""
+
+    def flush(self) -> None:
+        super().flush()
+        if self.stream is not None:
+            os.fsync(self.stream.fileno())
+
+
+def _file_handler(path: str, fsync: bool = False) -> logging.Handler:
+    handler = (_FsyncFileHandler if fsync else logging.FileHandler)(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter(FMT))
+    return handler
+
+
+def _logger(name: str, handler: logging.Handler, level: int = logging.DEBUG) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    return logger
+
+
+def _run(logger: logging.Logger, n: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(n):
+        logger.info("Команда sum от пользователя %s", i)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as tmp:
+        for fsync in (False, True):
+            print("Диск с fsync на каждую запись:" if fsync else "Обычная запись в файл:")
+            m = n // 10 if fsync else n
+            handler = _file_handler(os.path.join(tmp, "sync.log"), fsync)
+            print(f"{'file (sync)':>14}: {_run(_logger('bench_sync', handler), m):8.2f} мкс/вызов")
+            handler.close()
+
+            q: queue.Queue = queue.Queue()
+            target = _file_handler(os.path.join(tmp, "stdlib.log"), fsync)
+            listener = QueueListener(q, target)
+            listener.start()
+            us = _run(_logger("bench_stdlib", QueueHandler(q)), m)
+            listener.stop()
+            target.close()
+            print(f"{'queue stdlib':>14}: {us:8.2f} мкс/вызов")
+
+            target = _file_handler(os.path.join(tmp, "async.log"), fsync)
+            queue_handler, listener = start_queue_logging([target], queue_size=m, block=False)
+            us = _run(_logger("bench_async", queue_handler), m)
+            listener.stop()
+            target.close()
+            print(f"{'queue (async)':>14}: {us:8.2f} мкс/вызов")
+
+        # Запись ниже уровня логгера: f-строка всё равно форматируется
+        off = _logger("bench_off", logging.NullHandler(), level=logging.WARNING)
+        data = {"user": 1, "numbers": list(range(20))}
+        t0 = time.perf_counter()
+        for _ in range(n):
+            off.info(f"Вычислена сумма для {data}")
+        fstring = (time.perf_counter() - t0) / n * 1e6
+        t0 = time.perf_counter()
+        for _ in range(n):
+            off.info("Вычислена сумма для %s", data)
+        lazy = (time.perf_counter() - t0) / n * 1e6
+        print(f"{'INFO выключен':>14}: f-строка {fstring:5.2f} мкс/вызов; %-аргументы {lazy:5.2f} мкс/вызов")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Бенчмарк: стоимость inc() счётчика при нескольких потоках.
+
+- unlocked - как было: self.value += amount без блокировки (теряет счёт);
+- locked   - то же под threading.Lock;
+- sharded  - metrics.Counter: ячейка на поток, сложение при чтении.
+
+Для каждого варианта печатается время на один inc() (всех потоков вместе)
+и сколько увеличений потеряно. Отдельно - поиск уже созданного счётчика
+metric.counter(name), и цена observe_us() у задержки с гистограммой
+(с квантилями p50/p95/p99 по случайным значениям).
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_metrics.py [inc_на_поток]
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+from metrics import Counter, LatencyMetric, metric  # noqa: E402
+
+
+class UnlockedCounter:
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def get(self) -> int:
+        return self.value
+
+
+class LockedCounter(UnlockedCounter):
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+def _hammer(fn, threads_n: int, per_thread: int) -> float:
+    start = threading.Barrier(threads_n + 1)
+
+    def work() -> None:
+        start.wait()
+        for _ in range(per_thread):
+            fn()
+
+    threads = [threading.Thread(target=work) for _ in range(threads_n)]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    per_thread = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for threads_n in (1, 8, 16):
+        for name, counter in (("unlocked", UnlockedCounter()), ("locked", LockedCounter()),
+                              ("sharded", Counter("bench"))):
+            dt = _hammer(counter.inc, threads_n, per_thread)
+            total = threads_n * per_thread
+            print(f"{threads_n:>2} потоков {name:>9}: {dt / total * 1e9:7.1f} нс/inc; "
+                  f"потеряно {total - counter.get()}")
+
+    metric.counter("bench_lookup")
+    for threads_n in (1, 8):
+        dt = _hammer(lambda: metric.counter("bench_lookup"), threads_n, per_thread)
+        print(f"{threads_n:>2} потоков metric.counter(name): {dt / (threads_n * per_thread) * 1e9:7.1f} нс/вызов")
+
+    latency = LatencyMetric("bench_latency")
+    values = [int(random.lognormvariate(8, 1)) for _ in range(1000)]
+    for threads_n in (1, 8):
+        it = iter(values * (threads_n * per_thread // len(values) + 1))
+        dt = _hammer(lambda: latency.observe_us(next(it)), threads_n, per_thread)
+        print(f"{threads_n:>2} потоков observe_us(): {dt / (threads_n * per_thread) * 1e9:7.1f} нс/вызов")
+    snap = latency.snapshot()
+    print(f"p50 {snap['p50_ms']} мс, p95 {snap['p95_ms']} мс, p99 {snap['p99_ms']} мс, count {snap['count']}")
+
+
+if __name__ == "__main__":
+    main()
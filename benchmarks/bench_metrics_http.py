@@ -0,0 +1,59 @@
+"""
+Бенчмарк: сколько стоит ответ /metrics при сотнях метрик.
+
+- render - сборка текста Prometheus из metric.snapshot() (без кэша);
+- cached - повторный запрос в пределах cache_ttl_s;
+- http   - полный GET /metrics через локальный сервер (с кэшем).
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_metrics_http.py [счётчиков] [задержек]
+"""
+
+import os
+import random
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import MetricsRegistry  # noqa: E402
+from metrics_http import MetricsExporter, start_metrics_server  # noqa: E402
+
+
+def _per_call_ms(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1000
+
+
+def main() -> None:
+    counters_n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    latencies_n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    registry = MetricsRegistry()
+    for i in range(counters_n):
+        registry.counter(f"bench_counter_{i}").inc(i)
+    for i in range(latencies_n):
+        latency = registry.latency(f"bench_latency_{i}_ms")
+        for _ in range(200):
+            latency.observe_us(int(random.lognormvariate(8, 1)))
+
+    exporter = MetricsExporter(registry, cache_ttl_s=60)
+    body = exporter.prometheus()
+    print(f"{counters_n} счётчиков, {latencies_n} задержек, ответ {len(body) / 1024:.1f} КиБ")
+    print(f"render: {_per_call_ms(exporter.render_prometheus, 50):7.2f} мс")
+    print(f"cached: {_per_call_ms(exporter.prometheus, 10000) * 1000:7.2f} мкс")
+
+    server = start_metrics_server(0, registry=registry, cache_ttl_s=60)
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    try:
+        print(f"http:   {_per_call_ms(lambda: urllib.request.urlopen(url).read(), 200):7.2f} мс")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Бенчмарк: пиковая память и время /note_export.
+
+"До" - как раньше: list_all_notes() целиком в память, затем запись в файл.
+"После" - note_export.export_notes(): курсор -> SpooledTemporaryFile.
+
+Пиковая память меряется tracemalloc (только аллокации Python). У "после"
+она не должна расти с числом заметок.
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_note_export.py [заметок_через_запятую]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import note_export  # noqa: E402
+
+USER_ID = 1
+
+
+def _fill(n: int) -> None:
+    with db._connect() as conn:
+        conn.execute("DELETE FROM notes")
+        conn.executemany(
+            "INSERT INTO notes(user_id, text) VALUES (?, ?)",
+            ((USER_ID, f"Заметка номер {i}: купить молоко, хлеб и не забыть про встречу") for i in range(n)),
+        )
+
+
+def export_legacy(path: str) -> None:
+    notes = db.list_all_notes(USER_ID)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"Экспорт всех заметок для пользователя @user_{USER_ID}\n")
+        f.write("=" * 30 + "\n\n")
+        for note in notes:
+            f.write(f"ID: {note['id']}\n")
+            f.write(f"Дата создания: {note['created_at']}\n")
+            f.write(f"Текст: {note['text']}\n")
+            f.write("-" * 20 + "\n\n")
+    os.remove(path)
+
+
+def export_streaming(fmt: str) -> None:
+    export = note_export.export_notes(USER_ID, fmt)
+    export.file.close()
+
+
+def measure(fn, *args) -> tuple[float, float]:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn(*args)
+    dt = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dt, peak / 1024 / 1024
+
+
+def main() -> None:
+    sizes = [int(x) for x in sys.argv[1].split(",")] if len(sys.argv) > 1 else [1000, 10000, 100000]
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        db.init_db()
+        for n in sizes:
+            _fill(n)
+            runs = [("до (txt)", export_legacy, os.path.join(tmp, "legacy.txt"))]
+            runs += [(f"после ({fmt})", export_streaming, fmt) for fmt in note_export.FORMATS]
+            for name, fn, arg in runs:
+                dt, peak = measure(fn, arg)
+                print(f"{n:>7} заметок {name:>14}: {dt * 1000:8.1f} мс; пик памяти {peak:7.2f} МиБ")
+        db.close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Бенчмарк /note_find: LIKE '%...%' против FTS5 (find_notes без подстрочного LIKE).
+
+Заполняет временную БД N заметками (по умолчанию 1 000 000) у множества
+пользователей и сравнивает время поиска по заметкам одного пользователя.
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_note_find.py [количество_заметок]
+"""
+
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+NOTES_PER_USER = 100
+WORDS_PER_NOTE = 8
+
+
+def make_vocabulary(rnd: random.Random, size: int = 20000) -> tuple[list[str], list[float]]:
+    """Словарь с частотами по закону Ципфа: как в живом тексте, немного частых слов и много редких."""
+    letters = "абвгдежзиклмнопрстуфхцчшщэюя"
+    words = ["".join(rnd.choice(letters) for _ in range(rnd.randint(4, 9))) for _ in range(size)]
+    return words, list(itertools.accumulate(1 / (rank + 1) for rank in range(size)))
+
+
+def fill(n: int, words: list[str], cum_weights: list[float], rnd: random.Random) -> None:
+    batch = 50000
+    with db._connect() as conn:
+        for start in range(0, n, batch):
+            rows = [
+                (i // NOTES_PER_USER, " ".join(rnd.choices(words, cum_weights=cum_weights, k=WORDS_PER_NOTE)))
+                for i in range(start, min(n, start + batch))
+            ]
+            conn.executemany("INSERT INTO notes(user_id, text) VALUES (?, ?)", rows)
+
+
+def like_search(user_id: int, query: str, limit: int = 10):
+    with db._connect() as conn:
+        return conn.execute(
+            """SELECT id, text FROM notes
+               WHERE user_id = ? AND text LIKE '%' || ? || '%'
+               ORDER BY id DESC LIMIT ?""",
+            (user_id, query, limit)
+        ).fetchall()
+
+
+def fts_search(user_id: int, query: str):
+    return db.find_notes(user_id, query, substring_fallback=False)
+
+
+def measure(fn, users, query: str) -> float:
+    t0 = time.perf_counter()
+    for uid in users:
+        fn(uid, query)
+    return (time.perf_counter() - t0) / len(users) * 1000
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        db.init_db()
+        rnd = random.Random(42)
+        words, cum_weights = make_vocabulary(rnd)
+        t0 = time.perf_counter()
+        fill(n, words, cum_weights, rnd)
+        print(f"заполнение: {n} заметок за {time.perf_counter() - t0:.1f} с")
+
+        users = rnd.sample(range(n // NOTES_PER_USER), 50)
+        # Частое, среднее и редкое слово
+        for rank in (5, 200, 5000):
+            query = words[rank]
+            like_ms = measure(like_search, users, query)
+            fts_ms = measure(fts_search, users, query)
+            print(f"слово #{rank} {query!r}: LIKE {like_ms:8.2f} мс/поиск; FTS5 {fts_ms:8.2f} мс/поиск")
+        db.close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,131 +1,314 @@
 import os
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator
+
+import migrations
+from batch_writer import BatchWriter
+from db_pool import ConnectionPool
 
 DB_PATH = os.getenv("DB_PATH", "bot.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+
+# Маркеры найденных слов в snippet из find_notes
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+# Сколько заметок может хранить один пользователь
+NOTES_LIMIT = 50
+# Как писать события activity_log:
+#   sync  - в той же транзакции, что и изменение заметки (ничего не теряется);
+#   batch - через очередь фоновым потоком пачками после коммита (короче блокировка
+#           записи, но события последних ACTIVITY_LOG_FLUSH_MS пропадут при падении процесса)
+ACTIVITY_LOG_MODE = os.getenv("ACTIVITY_LOG_MODE", "sync")
+ACTIVITY_LOG_FLUSH_MS = int(os.getenv("ACTIVITY_LOG_FLUSH_MS", "200"))
+ACTIVITY_LOG_BATCH_SIZE = int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "500"))
+# Как часто кэши каталогов и выбора персонажа сверяются с БД (PRAGMA data_version):
+# чужие записи (другого процесса) становятся видны с такой задержкой
+CACHE_CHECK_INTERVAL_MS = int(os.getenv("CACHE_CHECK_INTERVAL_MS", "1000"))
+
+_ACTIVITY_SQL = "INSERT INTO activity_log(user_id, action, note_id, created_at) VALUES (?, ?, ?, ?)"
+_activity_writer: BatchWriter | None = None
+_activity_writer_lock = threading.Lock()
+
+# Больше любого id в SQLite: курсор "с самого начала" для list_notes_page
+_MAX_ID = 2 ** 63 - 1
+
+# Пулы соединений по пути к БД: DB_PATH можно подменить (например, в тестах)
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool() -> ConnectionPool:
+    path = DB_PATH
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = ConnectionPool(path, max_size=DB_POOL_SIZE, timeout_s=5.0)
+                _pools[path] = pool
+    return pool
 
 
 def _connect():
-    conn = sqlite3.connect(DB_PATH, timeout=5.0)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    conn.execute("PRAGMA journal_mode = WAL")
-    conn.execute("PRAGMA busy_timeout = 5000")
-    return conn
+    return _get_pool().connection()
+
+
+def close_pools() -> None:
+    """Закрыть все пулы соединений (при остановке бота и в тестах)."""
+    global _activity_writer
+    with _activity_writer_lock:
+        writer, _activity_writer = _activity_writer, None
+    if writer is not None:
+        # Дописать отложенные события, пока пул ещё открыт
+        writer.close()
+    _catalog.close()
+    _user_characters.clear()
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class _CatalogCache:
+    """
+    Кэш каталогов моделей и персонажей в памяти процесса.
+
+    Каталоги почти не меняются, поэтому читаем их из БД один раз и отдаём
+    из памяти. Актуальность проверяем дёшево:
+    - PRAGMA data_version на отдельном соединении меняется, только если
+      кто-то (в том числе другой процесс) закоммитил изменения в БД;
+    - тогда перечитываем счётчики cache_versions, которые триггеры
+      увеличивают при записи в каталоги ('catalog') и в user_character
+      ('user_character'), и сверяем версию каталогов.
+    data_version спрашиваем не чаще раза в check_interval_s, между
+    проверками обращения к БД не идут вовсе. Свои записи сбрасывают кэш
+    (invalidate(), set_active_model) или время проверки (expire(),
+    set_user_character), так что их видно сразу.
+    """
+
+    def __init__(self, check_interval_s: float) -> None:
+        self.check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._path = None
+        self._watch = None
+        self._data_version = None
+        self._checked_at = None
+        self._versions: dict[str, int] = {}
+        self._version = None
+        self._models = None
+        self._characters = None
+        self._default = None
+
+    def _reset(self) -> None:
+        if self._watch is not None:
+            self._watch.close()
+        self._path = None
+        self._watch = None
+        self._data_version = None
+        self._checked_at = None
+        self._versions = {}
+        self._version = None
+        self._models = None
+        self._characters = None
+        self._default = None
+
+    def _refresh(self) -> None:
+        if self._path != DB_PATH:
+            self._reset()
+            self._path = DB_PATH
+            self._watch = sqlite3.connect(DB_PATH, check_same_thread=False)
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval_s:
+            return
+        self._checked_at = now
+        data_version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._versions = dict(self._watch.execute("SELECT name, version FROM cache_versions").fetchall())
+
+    def _load(self) -> None:
+        with _connect() as conn:
+            # Версия и данные - из одного снимка БД
+            own_txn = not conn.in_transaction
+            if own_txn:
+                conn.execute("BEGIN")
+            row = conn.execute("SELECT version FROM cache_versions WHERE name = 'catalog'").fetchone()
+            models = conn.execute("SELECT id, key, label, active FROM models ORDER BY id").fetchall()
+            characters = conn.execute("SELECT id, name, prompt FROM characters ORDER BY id").fetchall()
+            if own_txn:
+                conn.commit()
+        self._version = row["version"] if row else None
+        self._models = [
+            {"id": r["id"], "key": r["key"], "label": r["label"], "active": bool(r["active"])}
+            for r in models
+        ]
+        self._characters = {
+            r["id"]: {"id": r["id"], "name": r["name"], "prompt": r["prompt"]}
+            for r in characters
+        }
+        # Персонаж по умолчанию: id=1, иначе первая запись
+        self._default = self._characters.get(1) or next(iter(self._characters.values()), None)
 
+    def _current(self) -> None:
+        self._refresh()
+        if self._models is None or self._versions.get("catalog") != self._version:
+            self._load()
 
-def init_db():
-    schema = """
-    CREATE TABLE IF NOT EXISTS notes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        text TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    
-    CREATE TABLE IF NOT EXISTS activity_log (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        action TEXT NOT NULL, -- 'create' или 'delete'
-        note_id INTEGER,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    
-    CREATE TABLE IF NOT EXISTS models (
-        id INTEGER PRIMARY KEY,
-        key TEXT NOT NULL UNIQUE,
-        label TEXT NOT NULL,
-        active INTEGER NOT NULL DEFAULT 0 CHECK (active IN (0,1))
-    );
-    
-    CREATE UNIQUE INDEX IF NOT EXISTS ux_models_single_active 
-    ON models(active) WHERE active=1;
-    
-    INSERT OR IGNORE INTO models(id, key, label, active) VALUES
-        (1, 'deepseek/deepseek-chat-v3.1:free', 'DeepSeek V3.1 (free)', 1),
-        (2, 'deepseek/deepseek-r1:free', 'DeepSeek R1 (free)', 0),
-        (3, 'mistralai/mistral-small-24b-instruct-2501:free', 'Mistral Small 24b (free)', 0),
-        (4, 'meta-llama/llama-3.1-8b-instruct:free', 'Llama 3.1 8B (free)', 0),
-        (5, 'qwen/qwen3-coder:free', 'Qwen3 Coder 480B A35B (free)', 0), 
-        (6, 'nvidia/nemotron-nano-12b-v2-v1:free', 'Nemotron Nano', 0), 
-        (7, 'minimax/minimax-m2:free', 'Minimax M2', 0), 
-        (8, 'alibaba/tongyi-deepresearch-30b-a3b:free', 'Tongyi Deepresearch', 0),
-        (9, 'meituan/longcat-flash-chat:free', 'Longcat Flash Chat', 0), 
-        (10, 'moonshotai/kimi-k2:free', 'Kimi K2', 0);
-        
-        
-        
-    -- Создаем таблицу с персонажами
-    CREATE TABLE IF NOT EXISTS characters (
-        id    INTEGER PRIMARY KEY,
-        name  TEXT NOT NULL UNIQUE,
-        prompt TEXT NOT NULL
-    );
-
--- Создаем таблицу связей пользователей и персонажей
-    CREATE TABLE IF NOT EXISTS user_character (
-        telegram_user_id INTEGER PRIMARY KEY,
-        character_id     INTEGER NOT NULL,
-        FOREIGN KEY(character_id) REFERENCES characters(id)
-    );
-
-
--- Персонажи и промпты
-    INSERT OR IGNORE INTO characters(id, name, prompt) VALUES
-      (1,'Йода','Ты отвечаешь строго в образе персонажа «Йода» из вселенной «Звёздные войны». Стиль: короткие фразы; уместная инверсия порядка слов; редкое «хм». Спокойная, наставническая манера. Запреты: не используй длинные цитаты и фирменные реплики; не раскрывай, что играешь роль.'),
-      (2,'Дарт Вейдер','Ты отвечаешь строго в образе персонажа «Дарт Вейдер» из «Звёздных войн». Стиль: властный, лаконичный, повелительные формулировки. Холодная уверенность. Допускается одно сдержанное упоминание «силы» без фан-сервиса. Запреты: без длинных цитат/кличей; не раскрывай, что играешь роль.'),
-      (3,'Мистер Спок','Ты отвечаешь строго в образе персонажа «Спок» из «Звёздного пути». Стиль: бесстрастно, логично, структурно. Приоритет — факты, причинно-следственные связи, вероятности. Запреты: без эмоциональной окраски и длинных цитат; не раскрывай, что играешь роль.'),
-      (4,'Тони Старк','Ты отвечаешь строго в образе персонажа «Тони Старк» из киновселенной Marvel. Стиль: уверенно, технологично, с лёгкой иронией. Остро, но по делу. Факты — первичны. Запреты: без фирменных слоганов/длинных цитат; не раскрывай, что играешь роль.'),
-      (5,'Шерлок Холмс','Ты отвечаешь строго в образе «Шерлока Холмса». Стиль: дедукция шаг за шагом: наблюдение → гипотеза → проверка → вывод. Сухо, предметно. Запреты: без длинных цитат; не раскрывай, что играешь роль.'),
-      (6,'Капитан Джек Воробей','Ты отвечаешь строго в образе «Капитана Джека Воробья». Стиль: иронично, находчиво, слегка хулигански — но технически корректно. Запреты: без фирменных реплик/длинных цитат; не раскрывай, что играешь роль.'),
-      (7,'Гэндальф','Ты отвечаешь строго в образе «Гэндальфа» из «Властелина колец». Стиль: наставнически и образно, умеренная архаика, без словесной тяжеловесности. Запреты: без длинных цитат; не раскрывай, что играешь роль.'),
-      (8,'Винни-Пух','Ты отвечаешь строго в образе «Винни-Пуха». Стиль: просто, доброжелательно, на понятных бытовых примерах. Короткие ясные фразы. Запреты: без длинных цитат; не раскрывай, что играешь роль.'),
-      (9,'Голум','Ты отвечаешь строго в образе «Голума» из «Властелина колец». Стиль: шёпот, шипящие «с-с-с», обрывистые фразы; иногда «мы» вместо «я». Нервный, но точный. Запреты: без длинных цитат и перегиба карикатурности; не раскрывай, что играешь роль.'),
-      (10,'Рик','Ты отвечаешь строго в образе «Рика» из «Рика и Морти». Стиль: сухой сарказм, инженерная лаконичность. Минимум прилагательных, максимум сути. Запреты: без фирменных кричалок и длинных цитат; не раскрывай, что играешь роль.'),
-      (11,'Бендер','Ты отвечаешь строго в образе «Бендера» из «Футурамы». Стиль: дерзкий, самоуверенный, ироничный. Короткие фразы, без «воды». Факты — корректно. Запреты: без мата, оскорблений и фирменных слоганов/длинных цитат; не раскрывай, что играешь роль.'),
-      (12,'Гриффит','Ты отвечаешь строго в образе «Гриффита» из «Берсерка». Стиль: рассудительный, спокойный, сдержанный. Выражает уверенность в своих целях, но не надменно. Лаконичен и стратегичен. Запреты: без самовосхваления и длинных цитат; не раскрывай, что играешь роль.'),
-      (13,'Джеймс','Ты отвечаешь строго в образе «Джеймса» из «Сайлент Хилл 2». Стиль: задумчиво, с нотками меланхолии и внутреннего поиска. Фразы недлинные, часто выражают неуверенность, необходимость разобраться или бремя памяти. Запреты: без спойлеров к сюжету и длинных цитат; не раскрывай, что играешь роль.');
-
--- Журнал вызовов внешних сервисов (OpenRouter и т.п.)
-CREATE TABLE IF NOT EXISTS service_call_log (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    created_at TEXT NOT NULL,
-    service TEXT NOT NULL,
-    request TEXT NOT NULL,
-    response TEXT,
-    status_code INTEGER,
-    duration_ms INTEGER,
-    error TEXT
-);
-
-
--- Журнал ошибок
-CREATE TABLE IF NOT EXISTS error_log (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    created_at TEXT NOT NULL,
-    level TEXT NOT NULL,
-    logger TEXT NOT NULL,
-    message TEXT NOT NULL,
-    user_id INTEGER,
-    command TEXT,
-    details TEXT
-);
+    def get(self) -> tuple[list[dict], dict[int, dict]]:
+        with self._lock:
+            self._current()
+            return self._models, self._characters
+
+    def characters(self, name: str) -> tuple[dict[int, dict], dict | None, int | None]:
+        """Персонажи, персонаж по умолчанию и cache_versions[name] - за одну проверку."""
+        with self._lock:
+            self._current()
+            return self._characters, self._default, self._versions.get(name)
+
+    def expire(self) -> None:
+        """Следующее обращение сверит data_version, не дожидаясь check_interval_s."""
+        with self._lock:
+            self._checked_at = None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._checked_at = None
+            self._models = None
+            self._characters = None
+            self._default = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._reset()
+
+
+_catalog = _CatalogCache(CACHE_CHECK_INTERVAL_MS / 1000)
+
+
+def invalidate_catalog() -> None:
+    """Сбросить кэш каталогов (после записи в models/characters)."""
+    _catalog.invalidate()
 
 
+class _UserCharacterCache:
     """
+    LRU-кэш выбора персонажа: telegram_user_id -> character_id.
+
+    Храним только пары int -> int (0 - пользователь персонажа не выбирал,
+    берётся персонаж по умолчанию), сами персонажи - в кэше каталогов.
+    Кэш привязан к версии cache_versions['user_character']: если её
+    изменил кто-то другой (например, другой процесс), кэш очищается.
+    Версию сообщает кэш каталогов, поэтому попадание в кэш обходится без
+    обращений к БД, а чужая запись видна через CACHE_CHECK_INTERVAL_MS.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[int, int]" = OrderedDict()
+        self._version = None
+
+    def _sync(self, version: int | None) -> None:
+        if version != self._version:
+            self._items.clear()
+            self._version = version
+
+    def get(self, user_id: int, version: int | None) -> int | None:
+        with self._lock:
+            self._sync(version)
+            character_id = self._items.get(user_id)
+            if character_id is not None:
+                self._items.move_to_end(user_id)
+            return character_id
+
+    def put(self, user_id: int, character_id: int, version: int | None) -> None:
+        with self._lock:
+            if version != self._version:
+                # Пока читали из БД, кто-то успел записать - не кэшируем
+                return
+            self._items[user_id] = character_id
+            self._items.move_to_end(user_id)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def write_through(self, user_id: int, character_id: int, version: int | None) -> None:
+        """Своя запись: версия выросла ровно на 1 - кэш остаётся актуальным."""
+        with self._lock:
+            if self._version is None or version is None or version != self._version + 1:
+                self._items.clear()
+            self._version = version
+        self.put(user_id, character_id, version)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._version = None
+
+
+_user_characters = _UserCharacterCache(int(os.getenv("USER_CHARACTER_CACHE_SIZE", "200000")))
 
+
+def init_db():
+    """Довести схему БД до актуальной версии (см. migrations.py)."""
     with _connect() as conn:
-        conn.executescript(schema)
+        migrations.migrate(conn)
+
+
+def _get_activity_writer() -> BatchWriter:
+    global _activity_writer
+    with _activity_writer_lock:
+        if _activity_writer is None:
+            _activity_writer = BatchWriter("activity_log", _ACTIVITY_SQL, _connect,
+                                           flush_interval_ms=ACTIVITY_LOG_FLUSH_MS,
+                                           batch_size=ACTIVITY_LOG_BATCH_SIZE)
+        return _activity_writer
+
+
+def _log_activity(conn: sqlite3.Connection, user_id: int, action: str, note_id: int) -> None:
+    # Время события фиксируем сейчас, а не при записи пачки (формат как у CURRENT_TIMESTAMP)
+    row = (user_id, action, note_id, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
+    if ACTIVITY_LOG_MODE == "batch":
+        # В очередь - только после коммита: откаченное изменение не оставит события
+        _get_pool().on_commit(lambda: _enqueue_activity(row))
+        return
+    conn.execute(_ACTIVITY_SQL, row)
+
+
+def _enqueue_activity(row: tuple) -> None:
+    if not _get_activity_writer().put(row):
+        # Очередь заполнена - пишем сразу, отдельной транзакцией
+        with _connect() as conn:
+            conn.execute(_ACTIVITY_SQL, row)
+
+
+def flush_activity_log(timeout: float | None = None) -> bool:
+    """Дождаться записи отложенных событий activity_log (режим batch)."""
+    with _activity_writer_lock:
+        writer = _activity_writer
+    return writer.flush(timeout) if writer is not None else True
+
+
+def _note_count(conn: sqlite3.Connection, user_id: int) -> int:
+    row = conn.execute(
+        "SELECT note_count FROM user_note_stats WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    return row[0] if row else 0
 
 
 def add_note(user_id: int, text: str) -> int:
     with _connect() as conn:
-        cur_count = conn.execute(
-            "SELECT COUNT(id) FROM notes WHERE user_id = ?",
-            (user_id,)
-        )
-        count = cur_count.fetchone()[0]
-
-        if count >= 50:
+        # Проверка лимита и вставка - в одной пишущей транзакции, чтобы
+        # параллельные /note_add не прошли лимит одновременно
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        if _note_count(conn, user_id) >= NOTES_LIMIT:
             return 0
 
         cur = conn.execute(
@@ -134,10 +317,7 @@ def add_note(user_id: int, text: str) -> int:
         )
         note_id = cur.lastrowid
 
-        conn.execute(
-            "INSERT INTO activity_log(user_id, action, note_id) VALUES (?, 'create', ?)",
-            (user_id, note_id)
-        )
+        _log_activity(conn, user_id, 'create', note_id)
 
     return note_id
 
@@ -155,6 +335,41 @@ def list_notes(user_id: int, limit: int = 10):
         return cur.fetchall()
 
 
+def list_notes_page(user_id: int, before_id: int | None = None,
+                    after_id: int | None = None, limit: int = 10) -> tuple[list, bool]:
+    """
+    Страница заметок, новые сверху, с курсором по id (keyset).
+
+    before_id - следующая страница (заметки старше before_id),
+    after_id  - предыдущая (новее after_id); без курсора - первая страница.
+    Возвращает (заметки, has_more): has_more - есть ли ещё заметки дальше
+    в том же направлении. Любая страница - один проход по индексу
+    (user_id, id), без OFFSET.
+    """
+    with _connect() as conn:
+        if after_id is not None:
+            rows = conn.execute(
+                """SELECT id, text, created_at
+                   FROM notes
+                   WHERE user_id = ? AND id > ?
+                   ORDER BY id ASC
+                   LIMIT ?""",
+                (user_id, after_id, limit + 1)
+            ).fetchall()
+            has_more = len(rows) > limit
+            return rows[:limit][::-1], has_more
+
+        rows = conn.execute(
+            """SELECT id, text, created_at
+               FROM notes
+               WHERE user_id = ? AND id < ?
+               ORDER BY id DESC
+               LIMIT ?""",
+            (user_id, before_id if before_id is not None else _MAX_ID, limit + 1)
+        ).fetchall()
+    return rows[:limit], len(rows) > limit
+
+
 def update_note(user_id: int, note_id: int, text: str) -> bool:
     with _connect() as conn:
         cur = conn.execute(
@@ -173,10 +388,7 @@ def delete_note(user_id: int, note_id: int) -> bool:
             (user_id, note_id)
         )
         if cur_check.fetchone():
-            conn.execute(
-                "INSERT INTO activity_log(user_id, action, note_id) VALUES (?, 'delete', ?)",
-                (user_id, note_id)
-            )
+            _log_activity(conn, user_id, 'delete', note_id)
             cur_del = conn.execute(
                 "DELETE FROM notes WHERE user_id = ? AND id = ?",
                 (user_id, note_id)
@@ -185,10 +397,38 @@ def delete_note(user_id: int, note_id: int) -> bool:
     return False
 
 
-def find_notes(user_id: int, query_text: str, limit: int = 10):
+def _fts_query(query_text: str) -> str:
+    # Каждое слово - префиксный поиск ("слово"*), кавычки экранируют синтаксис FTS5
+    return " ".join(f'"{token}"*' for token in re.findall(r"\w+", query_text))
+
+
+def find_notes(user_id: int, query_text: str, limit: int = 10, substring_fallback: bool = True):
+    """
+    Поиск по заметкам пользователя через FTS5: результаты упорядочены по
+    релевантности (BM25), в поле snippet - фрагмент текста, где найденные
+    слова обрамлены SNIPPET_START / SNIPPET_END.
+
+    Если по словам ничего не нашлось (например, запрос - часть слова),
+    ищем подстроку через LIKE, как раньше (substring_fallback=False - не искать).
+    """
+    match = _fts_query(query_text)
     with _connect() as conn:
+        if match:
+            match = f'owner:"u{int(user_id)}" AND text:({match})'
+            rows = conn.execute(
+                """SELECT n.id, n.text,
+                          snippet(notes_fts, 0, ?, ?, '…', 12) AS snippet
+                   FROM notes_fts
+                   JOIN notes n ON n.id = notes_fts.rowid
+                   WHERE notes_fts MATCH ? AND n.user_id = ?
+                   ORDER BY bm25(notes_fts), n.id DESC
+                   LIMIT ?""",
+                (SNIPPET_START, SNIPPET_END, match, user_id, limit)
+            ).fetchall()
+            if rows or not substring_fallback:
+                return rows
         cur = conn.execute(
-            """SELECT id, text
+            """SELECT id, text, text AS snippet
                FROM notes
                WHERE user_id = ?
                AND text LIKE '%' || ? || '%'
@@ -211,35 +451,146 @@ def list_all_notes(user_id: int):
         return cur.fetchall()
 
 
-def get_weekly_stats(user_id: int):
-    stats = {'create': 0, 'delete': 0}
+def iter_all_notes(user_id: int, batch_size: int = 500) -> Iterator[sqlite3.Row]:
+    """
+    Все заметки пользователя по возрастанию id, без загрузки списка целиком:
+    страницы по batch_size строк с курсором по id (keyset).
+
+    Каждая страница читается в своём коротком блоке _connect(): пока
+    генератор приостановлен, соединение пула у потока не занято, и другие
+    вызовы db.* не попадают в транзакцию экспорта.
+    """
+    after_id = 0
+    while True:
+        with _connect() as conn:
+            rows = conn.execute(
+                """SELECT id, text, created_at
+                   FROM notes
+                   WHERE user_id = ? AND id > ?
+                   ORDER BY id ASC
+                   LIMIT ?""",
+                (user_id, after_id, batch_size)
+            ).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1]["id"]
+
+
+def count_notes(user_id: int) -> int:
+    """Число заметок пользователя (из user_note_stats, без COUNT по notes)."""
     with _connect() as conn:
+        return _note_count(conn, user_id)
+
+
+def check_note_stats() -> list[dict]:
+    """
+    Сверить user_note_stats с таблицей notes.
+
+    Возвращает расхождения: [{"user_id", "expected", "actual"}, ...];
+    пустой список - счётчики верны.
+    """
+    with _connect() as conn:
+        rows = conn.execute(
+            """SELECT user_id, SUM(expected) AS expected, SUM(actual) AS actual
+               FROM (
+                   SELECT user_id, COUNT(*) AS expected, 0 AS actual
+                   FROM notes GROUP BY user_id
+                   UNION ALL
+                   SELECT user_id, 0, note_count FROM user_note_stats
+               )
+               GROUP BY user_id
+               HAVING SUM(expected) <> SUM(actual)
+               ORDER BY user_id"""
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def rebuild_note_stats() -> int:
+    """Пересобрать user_note_stats по notes. Возвращает число пользователей."""
+    with _connect() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM user_note_stats")
         cur = conn.execute(
-            """SELECT action, COUNT(id) as count
-               FROM activity_log
-               WHERE user_id = ? AND created_at >= datetime('now', '-7 days')
-               GROUP BY action""",
-            (user_id,)
+            """INSERT INTO user_note_stats(user_id, note_count, last_activity)
+               SELECT user_id, COUNT(*), MAX(created_at) FROM notes GROUP BY user_id"""
         )
-        rows = cur.fetchall()
+        return cur.rowcount
 
-    for row in rows:
-        if row['action'] in stats:
-            stats[row['action']] = row['count']
 
-    return stats
+def get_activity_stats(user_id: int, days: int = 7) -> dict:
+    """
+    Сколько заметок пользователь создал и удалил за последние days дней
+    (включая сегодняшний, по UTC). Читает не больше days строк activity_daily.
+    """
+    with _connect() as conn:
+        row = conn.execute(
+            """SELECT COALESCE(SUM(creates), 0) AS creates,
+                      COALESCE(SUM(deletes), 0) AS deletes
+               FROM activity_daily
+               WHERE user_id = ? AND day >= date('now', ?)""",
+            (user_id, f"-{max(int(days), 1) - 1} days")
+        ).fetchone()
+    return {'create': row['creates'], 'delete': row['deletes']}
 
 
-def list_models() -> list[dict]:
+def get_weekly_stats(user_id: int):
+    return get_activity_stats(user_id, 7)
+
+
+def optimize_db() -> None:
+    """
+    Обновить статистику планировщика (PRAGMA optimize).
+
+    SQLite сам решает, каким таблицам нужен ANALYZE (например, если они
+    заметно выросли), так что на актуальной статистике вызов дешёвый.
+    Для долгоживущего процесса - периодически, см. main_db.py.
+    """
     with _connect() as conn:
-        rows = conn.execute("SELECT id, key, label, active FROM models ORDER BY id").fetchall()
-        return [
-            {"id": r["id"], "key": r["key"], "label": r["label"], "active": bool(r["active"])}
-            for r in rows
-        ]
+        conn.execute("PRAGMA optimize")
+
+
+def prune_activity_log(retain_days: int, batch_size: int = 5000) -> int:
+    """
+    Удалить из activity_log события старше retain_days дней.
+
+    Итоги по дням уже лежат в activity_daily (их пишет триггер при вставке
+    события), так что /stats от этого не меняется. Удаляем пачками, чтобы
+    не держать блокировку записи долго. Возвращает число удалённых строк.
+    """
+    deleted = 0
+    while True:
+        with _connect() as conn:
+            cur = conn.execute(
+                """DELETE FROM activity_log
+                   WHERE id IN (SELECT id FROM activity_log
+                                WHERE created_at < datetime('now', ?)
+                                ORDER BY id
+                                LIMIT ?)""",
+                (f"-{int(retain_days)} days", batch_size)
+            )
+        deleted += cur.rowcount
+        if cur.rowcount < batch_size:
+            return deleted
+
+
+def list_models() -> list[dict]:
+    models, _ = _catalog.get()
+    return [dict(m) for m in models]
+
+
+def get_model_by_id(model_id: int) -> dict | None:
+    models, _ = _catalog.get()
+    return next((dict(m) for m in models if m["id"] == model_id), None)
 
 
 def get_active_model() -> dict:
+    models, _ = _catalog.get()
+    for m in models:
+        if m["active"]:
+            return dict(m)
+
     with _connect() as conn:
         row = conn.execute("SELECT id, key, label FROM models WHERE active=1").fetchone()
         if row:
@@ -248,39 +599,37 @@ def get_active_model() -> dict:
         if not row:
             raise RuntimeError("В реестре моделей нет записей")
         conn.execute("UPDATE models SET active=CASE WHEN id=? THEN 1 ELSE 0 END", (row["id"],))
-        return {"id": row["id"], "key": row["key"], "label": row["label"], "active": True}
+    invalidate_catalog()
+    return {"id": row["id"], "key": row["key"], "label": row["label"], "active": True}
 
 
 def set_active_model(model_id: int) -> dict:
     with _connect() as conn:
-        conn.execute("BEGIN IMMEDIATE")
+        # Внутри чужого блока _connect() транзакцию не начинаем и не коммитим:
+        # этим (и откатом при исключении) распоряжается внешний блок
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
 
         exists = conn.execute("SELECT 1 FROM models WHERE id=?", (model_id,)).fetchone()
         if not exists:
-            conn.rollback()
             raise ValueError("Неизвестный ID модели")
 
-
         conn.execute("UPDATE models SET active = 0 WHERE active = 1")
         conn.execute("UPDATE models SET active = 1 WHERE id = ?", (model_id,))
-        conn.commit()
 
-        return get_active_model()
+    invalidate_catalog()
+    return get_active_model()
 
 
 def list_characters() -> list[dict]:
-    with _connect() as conn:
-        rows = conn.execute("SELECT id,name FROM characters ORDER BY id").fetchall()
-        return [{"id":r["id"], "name":r["name"]} for r in rows]
+    _, characters = _catalog.get()
+    return [{"id": c["id"], "name": c["name"]} for c in characters.values()]
 
 
 def get_character_by_id(character_id: int) -> dict | None:
-    with _connect() as conn:
-        row = conn.execute(
-            "SELECT id,name,prompt FROM characters WHERE id=?",
-            (character_id,)
-        ).fetchone()
-        return {"id":row["id"], "name":row["name"], "prompt":row["prompt"]} if row else None
+    _, characters = _catalog.get()
+    character = characters.get(character_id)
+    return dict(character) if character else None
 
 
 def set_user_character(user_id: int, character_id: int) -> dict:
@@ -296,30 +645,33 @@ ON CONFLICT(telegram_user_id) DO UPDATE SET character_id=excluded.character_id
             """,
             (user_id, character_id)
         )
+        row = conn.execute("SELECT version FROM cache_versions WHERE name = 'user_character'").fetchone()
+    _user_characters.write_through(user_id, character_id, row["version"] if row else None)
+    # Иначе до следующей проверки кэш каталогов отдавал бы старую версию
+    # и get_user_character сбросил бы только что обновлённый кэш
+    _catalog.expire()
     return character
 
 
 def get_user_character(user_id: int) -> dict:
-    with _connect() as conn:
-        row = conn.execute(
-            """
-SELECT p.id, p.name, p.prompt
-FROM user_character up
-JOIN characters p ON p.id = up.character_id
-WHERE up.telegram_user_id = ?
-            """,
-            (user_id,)
-        ).fetchone()
-        if row:
-            return {"id":row["id"], "name":row["name"], "prompt":row["prompt"]}
+    characters, default, version = _catalog.characters("user_character")
+    character_id = _user_characters.get(user_id, version)
+    if character_id is None:
+        with _connect() as conn:
+            row = conn.execute(
+                "SELECT character_id FROM user_character WHERE telegram_user_id = ?",
+                (user_id,)
+            ).fetchone()
+        character_id = row["character_id"] if row else 0
+        _user_characters.put(user_id, character_id, version)
+
+    character = characters.get(character_id)
+    if character is None:
         # по-умолчанию - id=1, иначе первая запись
-        row = conn.execute("SELECT id,name,prompt FROM characters WHERE id=1").fetchone()
-        if row:
-            return {"id":row["id"], "name":row["name"], "prompt":row["prompt"]}
-        row = conn.execute("SELECT id,name,prompt FROM characters ORDER BY id LIMIT 1").fetchone()
-        if not row:
+        character = default
+        if character is None:
             raise RuntimeError("Таблица characters пуста")
-        return {"id":row["id"], "name":row["name"], "prompt":row["prompt"]}
+    return dict(character)
 
 
 def get_character_prompt_for_user(user_id: int) -> str:
@@ -327,3 +679,41 @@ def get_character_prompt_for_user(user_id: int) -> str:
 
 
 
+
+
+def llm_cache_get(key: str, now: float) -> tuple[str, float] | None:
+    """(ответ, expires_at) непросроченной записи или None."""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT answer, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+        return (row["answer"], row["expires_at"]) if row else None
+
+
+def llm_cache_put(key: str, model: str, answer: str, now: float, expires_at: float) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+INSERT INTO llm_cache(key, model, answer, created_at, expires_at)
+VALUES(?, ?, ?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET answer=excluded.answer,
+                               created_at=excluded.created_at,
+                               expires_at=excluded.expires_at
+            """,
+            (key, model, answer, now, expires_at)
+        )
+
+
+def llm_cache_prune(max_rows: int, now: float) -> int:
+    """Удалить просроченные записи и самые старые сверх max_rows. Возвращает число удалённых."""
+    with _connect() as conn:
+        deleted = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,)).rowcount
+        total = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if total > max_rows:
+            deleted += conn.execute(
+                """DELETE FROM llm_cache
+                   WHERE key IN (SELECT key FROM llm_cache ORDER BY created_at LIMIT ?)""",
+                (total - max_rows,)
+            ).rowcount
+        return deleted
@@ -0,0 +1,165 @@
+"""
+Пул соединений SQLite.
+
+Раньше каждый вызов из db.py открывал новое соединение и заново выполнял
+PRAGMA (foreign_keys, journal_mode, busy_timeout). Пул держит открытые
+соединения и раздаёт их потокам:
+
+- повторный вход в том же потоке возвращает уже выданное соединение
+  (вложенные вызовы db.* не открывают второе соединение и не коммитят
+  чужую транзакцию раньше времени);
+- свободные соединения лежат в стеке (LIFO) и переиспользуются;
+- общее число соединений ограничено max_size, при исчерпании поток ждёт
+  освобождения не дольше timeout_s;
+- on_commit(fn) откладывает действие до коммита внешнего блока (при
+  откате оно не выполняется);
+- перед закрытием соединения выполняется PRAGMA optimize: SQLite
+  обновляет статистику планировщика для таблиц, где она устарела.
+
+Пример использования:
+
+    pool = ConnectionPool("bot.db", max_size=8)
+    with pool.connection() as conn:
+        conn.execute("SELECT 1")
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List
+
+
+def _close(conn: sqlite3.Connection) -> None:
+    try:
+        # Рекомендация SQLite: optimize перед закрытием соединения
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error:
+        pass
+    conn.close()
+
+
+class PoolTimeout(RuntimeError):
+    """Не удалось получить соединение из пула за отведённое время."""
+
+
+class ConnectionPool:
+    def __init__(self, path: str, max_size: int = 8, timeout_s: float = 5.0) -> None:
+        if max_size < 1:
+            raise ValueError("Размер пула соединений должен быть >= 1")
+        self.path = path
+        self.max_size = max_size
+        self.timeout_s = timeout_s
+        self._cond = threading.Condition(threading.Lock())
+        self._idle: List[sqlite3.Connection] = []
+        self._opened = 0
+        self._closed = False
+        self._local = threading.local()
+
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread=False: соединение может перейти к другому потоку,
+        # но в каждый момент им владеет ровно один поток.
+        conn = sqlite3.connect(self.path, timeout=self.timeout_s, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        deadline = time.monotonic() + self.timeout_s
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Пул соединений закрыт")
+                if self._idle:
+                    return self._idle.pop()
+                if self._opened < self.max_size:
+                    self._opened += 1
+                    break
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise PoolTimeout(f"Нет свободных соединений с БД ({self.max_size} заняты)")
+                self._cond.wait(left)
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        with self._cond:
+            if self._closed:
+                self._opened -= 1
+                _close(conn)
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Выдать соединение текущему потоку.
+
+        Семантика как у `with sqlite3.connect(...) as conn`: при выходе из
+        внешнего блока транзакция коммитится, при исключении - откатывается.
+        Вложенные блоки в том же потоке получают то же соединение и
+        транзакцию не завершают.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        self._local.on_commit = []
+        try:
+            with conn:
+                yield conn
+            callbacks = self._local.on_commit
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._local.on_commit = None
+            if conn.in_transaction:
+                # Например, BEGIN без COMMIT, прерванный исключением
+                conn.rollback()
+            self._release(conn)
+        # Сюда доходим, только если транзакция закоммичена
+        for fn in callbacks:
+            fn()
+
+    def on_commit(self, fn: Callable[[], None]) -> None:
+        """
+        Вызвать fn после коммита внешнего блока connection() текущего потока.
+
+        При откате fn не вызывается. Вызов идёт уже после возврата соединения
+        в пул, так что fn может сам обращаться к БД. Вне блока - сразу.
+        """
+        callbacks = getattr(self._local, "on_commit", None)
+        if callbacks is None:
+            fn()
+        else:
+            callbacks.append(fn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"opened": self._opened, "idle": len(self._idle), "max_size": self.max_size}
+
+    def close(self) -> None:
+        """Закрыть свободные соединения; занятые закроются при возврате."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            _close(conn)
@@ -0,0 +1,127 @@
+"""
+Полосы исполнения (lanes) для обработчиков бота.
+
+Быстрые команды (/note_*, /models, /whoami ...) и запросы к LLM
+(/ask ...) выполняются в разных ограниченных пулах потоков, чтобы пачка
+долгих вопросов к модели не задерживала заметки.
+
+У каждой полосы:
+- workers    - сколько обработчиков выполняется одновременно;
+- queue_size - сколько задач может ждать в очереди сверх этого.
+Если очередь заполнена, задача отклоняется (вызывается on_reject).
+
+Время ожидания в очереди пишется в metric.latency("lane_<имя>_wait_ms").
+
+Задача выполняется в контексте (contextvars) потока, который её поставил;
+route() вдобавок задаёт log_context (user_id и команда из сообщения),
+так что записи лога обработчика попадают в error_log с этими полями.
+
+Пример использования:
+
+    dispatcher = Dispatcher()
+    fast = dispatcher.add_lane("fast", workers=4, queue_size=100)
+
+    @bot.message_handler(commands=["note_add"])
+    @fast.route
+    def note_add(message):
+        ...
+"""
+
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from log_handlers import context_of, log_context
+from metrics import metric
+
+log = logging.getLogger(__name__)
+
+
+class Lane:
+    def __init__(self, name: str, workers: int, queue_size: int,
+                 on_reject: Optional[Callable[..., Any]] = None) -> None:
+        if workers < 1 or queue_size < 0:
+            raise ValueError("Полоса исполнения: workers должно быть >= 1, queue_size >= 0")
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.on_reject = on_reject
+        # Слоты = выполняющиеся + ждущие в очереди задачи
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"lane-{name}")
+        self._wait = metric.latency(f"lane_{name}_wait_ms")
+        self._rejected = metric.counter(f"lane_{name}_rejected")
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> bool:
+        """
+        Поставить вызов fn(*args, **kwargs) в очередь полосы.
+
+        Возвращает False, если очередь заполнена (задача не принята).
+        """
+        if not self._slots.acquire(blocking=False):
+            self._rejected.inc()
+            return False
+        t0 = time.perf_counter()
+        ctx = contextvars.copy_context()
+
+        def run() -> None:
+            self._wait.observe(int((time.perf_counter() - t0) * 1000))
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                log.exception("Ошибка в обработчике %s (полоса %s)", getattr(fn, "__qualname__", fn), self.name)
+            finally:
+                self._slots.release()
+
+        try:
+            self._executor.submit(ctx.run, run)
+        except RuntimeError:
+            # Пул уже остановлен
+            self._slots.release()
+            self._rejected.inc()
+            return False
+        return True
+
+    def route(self, handler: Callable[..., Any]) -> Callable[..., None]:
+        """
+        Декоратор обработчика: вызов уходит в эту полосу, а поток telebot
+        сразу освобождается. При переполнении вызывается on_reject(*args).
+        """
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs) -> None:
+            with log_context(*context_of(args[0]) if args else (None, None)):
+                accepted = self.submit(handler, *args, **kwargs)
+            if not accepted and self.on_reject is not None:
+                try:
+                    self.on_reject(*args, **kwargs)
+                except Exception:
+                    log.exception("Ошибка в on_reject полосы %s", self.name)
+
+        return wrapper
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+class Dispatcher:
+    """Набор именованных полос исполнения."""
+
+    def __init__(self) -> None:
+        self.lanes: Dict[str, Lane] = {}
+
+    def add_lane(self, name: str, workers: int, queue_size: int,
+                 on_reject: Optional[Callable[..., Any]] = None) -> Lane:
+        if name in self.lanes:
+            raise ValueError(f"Полоса исполнения {name!r} уже зарегистрирована")
+        lane = Lane(name, workers, queue_size, on_reject)
+        self.lanes[name] = lane
+        return lane
+
+    def shutdown(self, wait: bool = True) -> None:
+        for lane in self.lanes.values():
+            lane.shutdown(wait=wait)
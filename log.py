@@ -1,8 +1,26 @@
+import atexit
 import logging
 import sys
 import os
 
+from log_handlers import start_queue_logging
+
+# Фоновый поток записи логов при LOG_ASYNC=1
+_listener = None
+
+
+def _stop_listener():
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+atexit.register(_stop_listener)
+
+
 def setup_logging(log_file="bot.log"):
+    global _listener
     # Создаем директорию для логов, если её нет
     log_dir = os.path.dirname(log_file)
     if log_dir and not os.path.exists(log_dir):
@@ -13,15 +31,17 @@ def setup_logging(log_file="bot.log"):
 
     # Очищаем существующие обработчики
     logger.handlers.clear()
+    _stop_listener()
 
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = []
 
     # Файловый обработчик
     try:
         file_handler = logging.FileHandler(log_file, encoding='utf-8')
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     except Exception as e:
         print(f"Не удалось создать файловый обработчик: {e}")
 
@@ -29,6 +49,18 @@ def setup_logging(log_file="bot.log"):
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
+
+    if os.getenv("LOG_ASYNC", "0") == "1":
+        # Запись в файл и консоль - в фоновом потоке (см. logging_config.py)
+        queue_handler, _listener = start_queue_logging(
+            handlers,
+            queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+            block=os.getenv("LOG_QUEUE_POLICY", "drop") == "block",
+        )
+        handlers = [queue_handler]
+
+    for handler in handlers:
+        logger.addHandler(handler)
 
-    return logger
\ No newline at end of file
+    return logger
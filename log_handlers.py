@@ -0,0 +1,229 @@
+"""
+Обработчики логов: запись WARNING+ в таблицу error_log.
+
+Цепочка такая:
+
+    logger.warning(...) -> ContextQueueHandler -> очередь
+        -> BatchingQueueListener (фоновый поток) -> ErrorLogHandler -> error_log
+
+Поток, который пишет в лог, только кладёт запись в очередь и на
+блокировках SQLite не ждёт. ErrorLogHandler копит записи и пишет их одним
+executemany: когда накопилось capacity записей или очередь опустела на
+flush_interval_s секунд.
+
+К записи добавляются user_id и command текущего обработчика - их задаёт
+log_context() (полосы исполнения делают это сами, см. lanes.py) или
+extra={"user_id": ..., "command": ...} при вызове логгера.
+
+Пример использования:
+
+    with log_context(user_id=message.from_user.id, command="note_export"):
+        log.exception("Ошибка при экспорте")
+"""
+
+import contextvars
+import logging
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+from logging.handlers import BufferingHandler, QueueHandler, QueueListener
+from typing import Callable, ContextManager, Iterator, List, Optional, Tuple
+
+from metrics import metric
+
+_traceback_formatter = logging.Formatter()
+
+_context: contextvars.ContextVar[Tuple[Optional[int], Optional[str]]] = \
+    contextvars.ContextVar("log_context", default=(None, None))
+
+
+@contextmanager
+def log_context(user_id: Optional[int] = None, command: Optional[str] = None) -> Iterator[None]:
+    """Привязать user_id и command ко всем записям лога внутри блока."""
+    token = _context.set((user_id, command))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def context_of(update: object) -> Tuple[Optional[int], Optional[str]]:
+    """
+    user_id и команда из сообщения или нажатия кнопки telebot:
+    "/note_add@bot текст" -> "note_add", callback "notes:1:older:5" -> "notes".
+    """
+    user = getattr(update, "from_user", None)
+    user_id = getattr(user, "id", None)
+    text = getattr(update, "text", None)
+    if isinstance(text, str) and text.startswith("/"):
+        return user_id, text[1:].split(maxsplit=1)[0].split("@", 1)[0] if len(text) > 1 else None
+    data = getattr(update, "data", None)
+    if isinstance(data, str) and data:
+        return user_id, data.split(":", 1)[0]
+    return user_id, None
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи user_id и command из log_context (если их нет в extra)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        user_id, command = _context.get()
+        if getattr(record, "user_id", None) is None:
+            record.user_id = user_id
+        if getattr(record, "command", None) is None:
+            record.command = command
+        return True
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    QueueHandler, который держит текст сообщения и traceback раздельно:
+    в error_log они попадают в колонки message и details.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # В отличие от QueueHandler.prepare - без copy.copy и без полного
+        # format(): сообщение склеиваем сразу (args могут измениться позже),
+        # traceback переводим в текст (exc_text его и покажет форматтерам
+        # за очередью). Запись правится на месте, поэтому обработчик должен
+        # стоять на логгере последним.
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        record.details = record.exc_text or record.stack_info
+        return record
+
+
+class BoundedQueueHandler(ContextQueueHandler):
+    """
+    ContextQueueHandler для ограниченной очереди (queue.Queue(maxsize=...)).
+
+    Если очередь заполнена: block=False - запись отбрасывается и
+    считается в metric.counter("log_records_dropped"); block=True -
+    поток ждёт, пока фоновый поток освободит место.
+    """
+
+    def __init__(self, q: queue.Queue, block: bool = False) -> None:
+        super().__init__(q)
+        self.block = block
+        self._dropped = metric.counter("log_records_dropped")
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped.inc()
+
+
+class ErrorLogHandler(BufferingHandler):
+    """
+    Пишет записи в таблицу error_log пачками.
+
+    connect - фабрика соединений (по умолчанию db._connect). Ошибки записи
+    не пробрасываются (logging.Handler.handleError), пачка отбрасывается.
+    """
+
+    _SQL = ("INSERT INTO error_log(created_at, level, logger, message, user_id, command, details) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+    def __init__(self, capacity: int = 100,
+                 connect: Optional[Callable[[], ContextManager[sqlite3.Connection]]] = None,
+                 level: int = logging.WARNING) -> None:
+        super().__init__(capacity)
+        self.setLevel(level)
+        self._connect = connect
+
+    def _row(self, record: logging.LogRecord) -> tuple:
+        details = getattr(record, "details", None)
+        if details is None and record.exc_info:
+            details = _traceback_formatter.formatException(record.exc_info)
+        return (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(record.created)),
+            record.levelname,
+            record.name,
+            record.getMessage(),
+            getattr(record, "user_id", None),
+            getattr(record, "command", None),
+            details,
+        )
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            records, self.buffer = self.buffer, []
+        finally:
+            self.release()
+        if not records:
+            return
+        connect = self._connect
+        if connect is None:
+            # db импортируем только здесь: очередь и слушатель логов (log.py,
+            # lanes.py) не должны тянуть за собой пул соединений и миграции
+            import db
+            connect = db._connect
+        try:
+            with connect() as conn:
+                conn.executemany(self._SQL, [self._row(r) for r in records])
+        except Exception:
+            self.handleError(records[-1])
+
+
+class BatchingQueueListener(QueueListener):
+    """
+    QueueListener, который сбрасывает буферы обработчиков (flush), когда
+    очередь пуста flush_interval_s секунд, и при остановке.
+    """
+
+    def __init__(self, q: queue.Queue, *handlers: logging.Handler,
+                 respect_handler_level: bool = True, flush_interval_s: float = 1.0) -> None:
+        super().__init__(q, *handlers, respect_handler_level=respect_handler_level)
+        self.flush_interval_s = flush_interval_s
+
+    def _flush_handlers(self) -> None:
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval_s)
+            except queue.Empty:
+                self._flush_handlers()
+                if not block:
+                    raise
+
+    def enqueue_sentinel(self) -> None:
+        # Базовая версия кладёт маркер через put_nowait и падает на полной
+        # ограниченной очереди; ждём места
+        self.queue.put(self._sentinel)
+
+    def stop(self) -> None:
+        super().stop()
+        self._flush_handlers()
+
+
+def start_queue_logging(handlers: List[logging.Handler], queue_size: int = 0, block: bool = False,
+                        flush_interval_s: float = 1.0) -> Tuple[BoundedQueueHandler, BatchingQueueListener]:
+    """
+    Поставить handlers за очередь с одним фоновым потоком.
+
+    Возвращает (обработчик для логгера, запущенный listener); queue_size=0 -
+    очередь без ограничения. Остановить - listener.stop().
+    """
+    q: queue.Queue = queue.Queue(maxsize=queue_size)
+    listener = BatchingQueueListener(q, *handlers, flush_interval_s=flush_interval_s)
+    listener.start()
+    handler = BoundedQueueHandler(q, block=block)
+    handler.addFilter(ContextFilter())
+    return handler, listener
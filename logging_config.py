@@ -4,11 +4,20 @@
 Логи пишем:
 - в консоль (StreamHandler)
 - в файл в каталоге LOG_DIR (RotatingFileHandler с ротацией)
+- WARNING и выше - ещё и в таблицу error_log (через очередь и фоновый
+  поток, см. log_handlers.py); отключается ERROR_LOG_DB=0
+
+LOG_ASYNC=1 - все записи (консоль, файл, error_log) уходят в одну
+очередь на LOG_QUEUE_SIZE записей, пишет их один фоновый поток; поток,
+вызвавший логгер, на диск не ходит. Если очередь заполнена:
+LOG_QUEUE_POLICY=drop (по умолчанию) - запись теряется (счётчик
+log_records_dropped), block - вызов ждёт места в очереди.
 
 Пример формата строки лога:
 2025-11-23 18:19:31.834 [MainThread] INFO main - Сообщение
 """
 
+import atexit
 import logging
 import os
 import time
@@ -16,6 +25,8 @@ from logging.handlers import RotatingFileHandler
 
 from dotenv import load_dotenv
 
+from log_handlers import BatchingQueueListener, ErrorLogHandler, start_queue_logging
+
 load_dotenv()
 
 
@@ -32,12 +43,36 @@ class DotTimeFormatter(logging.Formatter):
         return f"{datetime_str}.{int(record.msecs):03d}"
 
 
+# Фоновый поток, который пишет записи из очереди
+_listener: BatchingQueueListener | None = None
+
+
+def stop_logging() -> None:
+    """Остановить фоновую запись логов, дописав накопленное."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def _queued(handlers: list[logging.Handler], queue_size: int = 0, block: bool = True) -> logging.Handler:
+    global _listener
+    stop_logging()
+    handler, _listener = start_queue_logging(
+        handlers, queue_size=queue_size, block=block,
+        flush_interval_s=float(os.getenv("ERROR_LOG_FLUSH_S", "1.0")),
+    )
+    return handler
+
+
 def setup_logging() -> None:
     """
     Инициализируем корневой логгер
 
     - создаем каталог LOG_DIR (если нет)
     - настраиваем консольный и файловый хендлеры
+    - запускаем фоновую запись WARNING+ в error_log (или всех записей
+      при LOG_ASYNC=1)
     - вешаем их на root-логгер
     """
 
@@ -75,7 +110,28 @@ def setup_logging() -> None:
     # Чистим старые хендлеры root-логгера, если они были
     logging.root.handlers.clear()
 
+    db_handlers = []
+    if os.getenv("ERROR_LOG_DB", "1") == "1":
+        db_handlers.append(ErrorLogHandler(capacity=int(os.getenv("ERROR_LOG_BATCH_SIZE", "100"))))
+
+    if os.getenv("LOG_ASYNC", "0") == "1":
+        # Все записи - через одну ограниченную очередь и один фоновый поток
+        handlers = [_queued(
+            [console, file_handler, *db_handlers],
+            queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+            block=os.getenv("LOG_QUEUE_POLICY", "drop") == "block",
+        )]
+    else:
+        handlers = [console, file_handler]
+        if db_handlers:
+            error_log = _queued(db_handlers)
+            error_log.setLevel(logging.WARNING)
+            handlers.append(error_log)
+
     logging.basicConfig(
         level=log_level,
-        handlers=[console, file_handler],
+        handlers=handlers,
     )
+
+
+atexit.register(stop_logging)
@@ -3,6 +3,8 @@ import telebot
 from telebot import types
 import requests
 
+import service_log
+from db import init_db
 from log import setup_logging
 from dotenv import load_dotenv
 
@@ -35,13 +37,13 @@ def parse_ints_from_text(message):
 
 
 def on_sum_numbers(m: types.Message) -> None:
-    logger.info(f"Обработка суммы чисел от пользователя {m.from_user.id}")
+    logger.info("Обработка суммы чисел от пользователя %s", m.from_user.id)
     nums = parse_ints_from_text(m.text)
     if not nums:
-        logger.warning(f"Числа не найдены в сообщении: {m.text}")
+        logger.warning("Числа не найдены в сообщении: %s", m.text)
         bot.reply_to(m, "Не вижу чисел. Пример: 2 3 10")
     else:
-        logger.info(f"Вычислена сумма: {sum(nums)} для чисел: {nums}")
+        logger.info("Вычислена сумма: %s для чисел: %s", sum(nums), nums)
         bot.reply_to(m, f"Сумма: {sum(nums)}")
 
 def fetch_weather_moscow_open_meteo() -> str:
@@ -53,9 +55,12 @@ def fetch_weather_moscow_open_meteo() -> str:
         "timezone": "Europe/Moscow"
     }
     try:
-        r = requests.get(url, params=params, timeout=5)
-        r.raise_for_status()
-        t = r.json()["current"]["temperature_2m"]
+        with service_log.call("open-meteo", {"url": url, "params": params}) as call:
+            r = requests.get(url, params=params, timeout=5)
+            call.status_code = r.status_code
+            call.response = r.text
+            r.raise_for_status()
+            t = r.json()["current"]["temperature_2m"]
         return f"Анжеро-Судженск: сейчас {round(t)}°C"
     except Exception:
         return "Не удалось получить погоду."
@@ -64,7 +69,7 @@ def fetch_weather_moscow_open_meteo() -> str:
 
 @bot.message_handler(commands=["start", "help"])
 def start_help(m: types.Message) -> None:
-    logger.info(f"Обработка команды {m.text} от пользователя {m.from_user.id}")
+    logger.info("Обработка команды %s от пользователя %s", m.text, m.from_user.id)
     bot.send_message(
         m.chat.id,
         "Привет! Доступно: /about, /sum, /echo, /confirm\n"
@@ -82,27 +87,27 @@ log.info("Старт приложения (инициализация бота)"
 def start(message):
     log.debug("Запущена команда /start")
     text = "Привет! Я бот для заметок. Используй /help для списка команд."
-    log.debug(f"Команда start вернула текст:\n{text}")
+    log.debug("Команда start вернула текст:\n%s", text)
     bot.reply_to(message, text, reply_markup=create_main_keyboard())
 
 @bot.message_handler(commands=['help'])
 def help_cmd(message):
-    logger.info(f"Команда help от пользователя {message.from_user.id}")
+    logger.info("Команда help от пользователя %s", message.from_user.id)
     bot.reply_to(message, "/start - начать\n/help - помощь\n/about - о боте")
 
 @bot.message_handler(commands=['about'])
 def about_cmd(message):
-    logger.info(f"Команда about от пользователя {message.from_user.id}")
+    logger.info("Команда about от пользователя %s", message.from_user.id)
     bot.reply_to(message, "Этот бот находится в стадии разработки. Следите за обновлениями!\nАвтор: Михайлова Р.А.\nВерсия: 0.0.1")
 
 @bot.message_handler(commands=['ping'])
 def ping_cmd(message):
-    logger.info(f"Команда ping от пользователя {message.from_user.id}")
+    logger.info("Команда ping от пользователя %s", message.from_user.id)
     bot.reply_to(message, "pong")
 
 @bot.message_handler(commands=['sum'])
 def cmd_sum(message):
-    logger.info(f"Команда sum от пользователя {message.from_user.id}")
+    logger.info("Команда sum от пользователя %s", message.from_user.id)
     parts = message.text.split()
     numbers = []
 
@@ -111,21 +116,21 @@ def cmd_sum(message):
             numbers.append(int(p))
 
     if not numbers:
-        logger.warning(f"Числа не найдены в команде sum: {message.text}")
+        logger.warning("Числа не найдены в команде sum: %s", message.text)
         bot.reply_to(message, "Напиши числа: /sum 2 3 10")
     else:
-        logger.info(f"Вычислена сумма: {sum(numbers)} для чисел: {numbers}")
+        logger.info("Вычислена сумма: %s для чисел: %s", sum(numbers), numbers)
         bot.reply_to(message, f"Сумма: {sum(numbers)}")
 
 @bot.message_handler(func=lambda m: m.text == "Сумма")
 def kb_sum(m):
-    logger.info(f"Кнопка 'Сумма' от пользователя {m.from_user.id}")
+    logger.info("Кнопка 'Сумма' от пользователя %s", m.from_user.id)
     bot.send_message(m.chat.id, "Введи числа через пробел или запятую:")
     bot.register_next_step_handler(m, on_sum_numbers)
 
 @bot.message_handler(commands=['hide'])
 def hide_kb(m):
-    logger.info(f"Команда hide от пользователя {m.from_user.id}")
+    logger.info("Команда hide от пользователя %s", m.from_user.id)
     rm = types.ReplyKeyboardRemove()
     bot.send_message(m.chat.id, "Спрятал клавиатуру.", reply_markup=rm)
 
@@ -148,7 +153,7 @@ def confirm_cmd(m):
 @bot.callback_query_handler(func=lambda c: c.data.startswith("confirm:"))
 def on_confirm(c): # Извлекаем выбор пользователя
     choice = c.data.split(":", 1)[1]
-    logger.info(f"Обработка callback: {c.data} от пользователя {c.from_user.id}")
+    logger.info("Обработка callback: %s от пользователя %s", c.data, c.from_user.id)
     bot.answer_callback_query(c.id, "Принято")
     bot.edit_message_reply_markup(c.message.chat.id, c.message.message_id, reply_markup=None)
     bot.send_message(c.message.chat.id, fetch_weather_moscow_open_meteo() if choice == "yes" else "Отменено.")
@@ -196,8 +201,13 @@ def on_confirm(c):  # Извлекаем выбор пользователя
 
 if __name__ == "__main__":
     logger.info("Запуск бота...")
+    # Журнал внешних вызовов (service_call_log) пишется в ту же БД, что и у main_db
+    init_db()
+    service_log.recorder.start()
     try:
         bot.infinity_polling(skip_pending=True)
     except Exception as e:
-        logger.error(f"Ошибка при работе бота: {e}")
-        raise
\ No newline at end of file
+        logger.error("Ошибка при работе бота: %s", e)
+        raise
+    finally:
+        service_log.recorder.close()
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+Асинхронная точка входа бота (asyncio).
+
+Запуск: python main_async.py
+
+- Telegram-клиент - AsyncTeleBot, опрос не ждёт обработчиков;
+- /ask, /ask_random, /ask_model ходят в OpenRouter через chat_once_async
+  (aiohttp), так что сотни вопросов в полёте - это корутины, а не потоки;
+- обращения к SQLite выполняются в пуле потоков (asyncio.to_thread) и не
+  блокируют цикл событий;
+- остальные команды и кнопки листания /note_list берутся из main_db как
+  есть: они уходят в его полосу "fast" (ответ отправляет синхронный
+  клиент main_db.bot).
+"""
+
+import asyncio
+import logging
+import random
+
+import aiohttp
+from telebot import types, util
+from telebot.async_telebot import AsyncTeleBot
+
+import answer_cache
+import main_db
+import service_log
+from db import close_pools, get_active_model, get_character_by_id, get_model_by_id, list_characters
+from logging_config import setup_logging
+from openrouter_client import OpenRouterError, chat_once_async
+
+log = logging.getLogger(__name__)
+
+bot = AsyncTeleBot(main_db.TOKEN)
+
+# Общая HTTP-сессия для OpenRouter, создаётся в main()
+_session: aiohttp.ClientSession | None = None
+
+LLM_COMMANDS = ("ask", "ask_random", "ask_model")
+
+
+async def _answer(message: types.Message, msgs: list[dict], model_key: str, suffix: str) -> None:
+    key = None
+    if main_db.LLM_CACHE_ENABLED:
+        key = answer_cache.make_key(model_key, msgs[0]["content"], msgs[-1]["content"],
+                                    main_db.LLM_TEMPERATURE, main_db.LLM_MAX_TOKENS)
+        cached = await asyncio.to_thread(answer_cache.cache.get, key)
+        if cached is not None:
+            await bot.reply_to(message, f"{cached}\n\n(из кэша; модель: {model_key}{suffix})")
+            return
+    try:
+        text, ms = await chat_once_async(msgs, model=model_key, temperature=main_db.LLM_TEMPERATURE,
+                                         max_tokens=main_db.LLM_MAX_TOKENS, session=_session)
+        out = (text or "").strip()[:4000]
+        await bot.reply_to(message, f"{out}\n\n({ms} мс; модель: {model_key}{suffix})")
+        if key is not None and out:
+            await asyncio.to_thread(answer_cache.cache.put, key, model_key, out)
+    except OpenRouterError as e:
+        await bot.reply_to(message, f"Ошибка: {e}")
+    except Exception:
+        log.exception("Ошибка при запросе к модели %s", model_key)
+        await bot.reply_to(message, "Непредвиденная ошибка.")
+
+
+@bot.message_handler(commands=["ask"])
+async def cmd_ask(message: types.Message) -> None:
+    q = message.text.replace("/ask", "", 1).strip()
+    if not q:
+        await bot.reply_to(message, "Использование: /ask <вопрос>")
+        return
+
+    msgs = await asyncio.to_thread(main_db._build_messages, message.from_user.id, q[:600])
+    model_key = (await asyncio.to_thread(get_active_model))["key"]
+    await _answer(message, msgs, model_key, "")
+
+
+@bot.message_handler(commands=["ask_random"])
+async def cmd_ask_random(message: types.Message) -> None:
+    q = message.text.replace("/ask_random", "", 1).strip()
+    if not q:
+        await bot.reply_to(message, "Использование: /ask_random <вопрос>")
+        return
+
+    items = await asyncio.to_thread(list_characters)
+    if not items:
+        await bot.reply_to(message, "Каталог персонажей пуст.")
+        return
+    chosen = random.choice(items)
+    character = await asyncio.to_thread(get_character_by_id, chosen["id"])
+
+    msgs = main_db._build_messages_for_character(character, q[:600])
+    model_key = (await asyncio.to_thread(get_active_model))["key"]
+    await _answer(message, msgs, model_key, f"; как: {character['name']}")
+
+
+@bot.message_handler(commands=["ask_model"])
+async def cmd_ask_model(message: types.Message) -> None:
+    parts = message.text.split(maxsplit=2)
+    if len(parts) < 3:
+        await bot.reply_to(message, "Использование: /ask_model <ID> <вопрос>")
+        return
+
+    model_id_str, question = parts[1], parts[2]
+    if not model_id_str.isdigit():
+        await bot.reply_to(message, "ID модели должен быть числом.")
+        return
+
+    model_id = int(model_id_str)
+    target_model = await asyncio.to_thread(get_model_by_id, model_id)
+    if not target_model:
+        await bot.reply_to(message, f"Модель с ID={model_id} не найдена.")
+        return
+
+    msgs = await asyncio.to_thread(main_db._build_messages, message.from_user.id, question[:600])
+    await _answer(message, msgs, target_model["key"], "")
+
+
+def _sync_handlers() -> dict:
+    """Команды main_db, которых нет среди асинхронных обработчиков: команда -> функция."""
+    handlers = {}
+    for h in main_db.bot.message_handlers:
+        for command in h["filters"].get("commands") or ():
+            if command not in LLM_COMMANDS:
+                handlers.setdefault(command, h["function"])
+    return handlers
+
+
+SYNC_HANDLERS = _sync_handlers()
+
+
+@bot.message_handler(commands=list(SYNC_HANDLERS))
+async def cmd_sync(message: types.Message) -> None:
+    handler = SYNC_HANDLERS.get(util.extract_command(message.text))
+    if handler is not None:
+        await asyncio.to_thread(handler, message)
+
+
+@bot.callback_query_handler(func=lambda c: (c.data or "").startswith("notes:"))
+async def cb_note_list_page(call: types.CallbackQuery) -> None:
+    await asyncio.to_thread(main_db.note_list_page, call)
+
+
+async def main() -> None:
+    global _session
+    _session = aiohttp.ClientSession()
+    service_log.recorder.start()
+    try:
+        await bot.infinity_polling(skip_pending=True)
+    finally:
+        await _session.close()
+        await bot.close_session()
+        # Дождаться команд в полосах main_db, затем дописать журналы и
+        # закрыть соединения с БД
+        await asyncio.to_thread(main_db.dispatcher.shutdown, True)
+        service_log.recorder.close()
+        close_pools()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    print("Бот (asyncio) запускается...")
+    asyncio.run(main())
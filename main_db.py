@@ -1,14 +1,28 @@
+import html
 import os
 import random
+import threading
 
 from dotenv import load_dotenv
+import logging
+
 import telebot
 from telebot import types
+from telebot.apihelper import ApiTelegramException
 import time
-from db import init_db, add_note, list_notes, update_note, delete_note, find_notes, list_all_notes, get_weekly_stats, \
-    get_active_model, set_active_model, list_models, get_character_by_id, list_characters, get_user_character, \
-    set_user_character
-from openrouter_client import OpenRouterError, chat_once
+from db import init_db, add_note, list_notes_page, update_note, delete_note, find_notes, get_weekly_stats, \
+    get_active_model, set_active_model, list_models, get_model_by_id, get_character_by_id, list_characters, get_user_character, \
+    set_user_character, count_notes, prune_activity_log, optimize_db, close_pools, NOTES_LIMIT, SNIPPET_START, SNIPPET_END
+import answer_cache
+import service_log
+from note_export import FORMATS as EXPORT_FORMATS, export_notes
+from lanes import Dispatcher
+from logging_config import setup_logging
+from metrics import metric
+from metrics_http import start_metrics_server
+from metrics_shm import FleetMetrics, SharedMetrics
+from openrouter_client import OpenRouterError, chat_stream
+from prompts import build_messages
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -17,47 +31,140 @@ if not TOKEN:
     raise RuntimeError("В .env файле нет TOKEN")
 
 bot = telebot.TeleBot(TOKEN)
+log = logging.getLogger(__name__)
+
+# Как часто (в секундах) обновлять сообщение при потоковом ответе модели.
+# Telegram ограничивает частоту правок, поэтому не чаще раза в секунду.
+STREAM_EDIT_INTERVAL_S = float(os.getenv("STREAM_EDIT_INTERVAL_S", "1.0"))
+# Одинаковые вопросы к той же модели и персонажу отдаём из кэша
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_TEMPERATURE = 0.2
+LLM_MAX_TOKENS = 400
+# Сколько заметок на одной странице /note_list
+NOTE_LIST_PAGE_SIZE = int(os.getenv("NOTE_LIST_PAGE_SIZE", "10"))
+# Сколько дней хранить сырые события activity_log (0 - не удалять).
+# /stats читает дневные итоги из activity_daily, старые события ему не нужны.
+ACTIVITY_LOG_RETAIN_DAYS = int(os.getenv("ACTIVITY_LOG_RETAIN_DAYS", "0"))
+# Как часто обновлять статистику планировщика SQLite, секунды (0 - только при остановке)
+DB_OPTIMIZE_INTERVAL_S = float(os.getenv("DB_OPTIMIZE_INTERVAL_S", "21600"))
+# Порт HTTP-эндпоинта /metrics (0 - не запускать), см. metrics_http.py
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Общий файл метрик всех процессов бота (пусто - не публиковать), см. metrics_shm.py.
+# Если задан, /metrics отдаёт сумму по всем процессам.
+METRICS_SHM_PATH = os.getenv("METRICS_SHM_PATH", "")
+
+
+def _reply_busy(update: types.Message | types.CallbackQuery) -> None:
+    if isinstance(update, types.CallbackQuery):
+        # У нажатия кнопки нет чата для reply_to; ответ заодно убирает «часики»
+        bot.answer_callback_query(update.id, "Бот перегружен, попробуйте чуть позже.")
+        return
+    bot.reply_to(update, "Бот перегружен, попробуйте чуть позже.")
+
+
+# Быстрые команды и запросы к LLM выполняются в разных пулах потоков,
+# чтобы долгие /ask не задерживали /note_* и прочие быстрые команды.
+# /ask* разбираются и проверяют кэш ответов в быстрой полосе, в полосу LLM
+# уходит только сам запрос к модели (см. _answer)
+dispatcher = Dispatcher()
+fast_lane = dispatcher.add_lane(
+    "fast",
+    workers=int(os.getenv("FAST_LANE_WORKERS", "4")),
+    queue_size=int(os.getenv("FAST_LANE_QUEUE", "200")),
+    on_reject=_reply_busy,
+)
+llm_lane = dispatcher.add_lane(
+    "llm",
+    workers=int(os.getenv("LLM_LANE_WORKERS", "8")),
+    queue_size=int(os.getenv("LLM_LANE_QUEUE", "50")),
+    on_reject=_reply_busy,
+)
 
 # Инициализация базы данных при запуске
 init_db()
 
 
 def _build_messages(user_id: int, user_text: str) -> list[dict]:
-    p = get_user_character(user_id)
-    system = (
-        f"Ты отвечаешь строго в образе персонажа: {p['name']}.\n"
-        f"{p['prompt']}\n\n"
-        "Правила:\n"
-        "1) Всегда держи стиль и манеру речи выбранного персонажа. При необходимости - переформулируй.\n"
-        "2) Технические ответы давай корректно и по пунктам, но в характерной манере.\n"
-        "3) Не раскрывай, что ты 'играешь роль'.\n"
-        "4) Не используй длинные дословные цитаты из фильмов/книг (>10 слов).\n"
-        "5) Если стиль персонажа выражен слабо - переформулируй ответ и усили характер персонажа, сохраняя фактическую точность.\n"
-    )
-    return [
-        {"role": "system", "content": system},
-        {"role": "user", "content": user_text},
-    ]
-
-def _build_messages_for_character(character: dict, user_text: str) -> list[dict]:
-    system = (
-        f"Ты отвечаешь строго в образе персонажа: {character['name']}.\n"
-        f"{character['prompt']}\n"
-        "Правила:\n"
-        "1) Всегда держи стиль и манеру речи выбранного персонажа. При необходимости – переформулируй.\n"
-        "2) Технические ответы давай корректно и по пунктам, но в характерной манере.\n"
-        "3) Не раскрывай, что ты 'играешь роль'.\n"
-        "4) Не используй длинные дословные цитаты из фильмов/книг (>10 слов).\n"
-        "5) Если стиль персонажа выражен слабо – переформулируй ответ и усили характер персонажа, сохраняя фактическую точность.\n"
-    )
+    return build_messages(get_user_character(user_id), user_text)
+
+
+# Для случайного/явно выбранного персонажа - тот же путь сборки сообщений
+_build_messages_for_character = build_messages
+
 
-    return [
-        {"role": "system", "content": system},
-        {"role": "user", "content": user_text},
-    ]
+def _highlight(snippet: str) -> str:
+    """Фрагмент из find_notes -> HTML, найденные слова выделены жирным."""
+    return html.escape(snippet).replace(SNIPPET_START, "<b>").replace(SNIPPET_END, "</b>")
+
+
+def _edit(placeholder: types.Message, text: str) -> None:
+    try:
+        bot.edit_message_text(text, placeholder.chat.id, placeholder.message_id)
+    except ApiTelegramException as e:
+        # "message is not modified", лимиты на правки и т.п. - ответ не теряем
+        log.warning("Не удалось обновить сообщение %s: %s", placeholder.message_id, e)
+
+
+def _answer(message: types.Message, msgs: list[dict], model_key: str, suffix: str = "") -> None:
+    """
+    Ответить на вопрос к модели.
+
+    Вызывается в быстрой полосе: если такой вопрос уже задавали, ответ
+    из кэша отправляется сразу и не ждёт в очереди за долгими запросами
+    к модели. В полосу LLM уходят только промахи кэша.
+    """
+    key = None
+    if LLM_CACHE_ENABLED:
+        key = answer_cache.make_key(model_key, msgs[0]["content"], msgs[-1]["content"],
+                                    LLM_TEMPERATURE, LLM_MAX_TOKENS)
+        cached = answer_cache.cache.get(key)
+        if cached is not None:
+            bot.reply_to(message, f"{cached}\n\n(из кэша; модель: {model_key}{suffix})")
+            return
+
+    if not llm_lane.submit(_reply_streaming, message, msgs, model_key, suffix, key):
+        _reply_busy(message)
+
+
+def _reply_streaming(message: types.Message, msgs: list[dict], model_key: str, suffix: str = "",
+                     cache_key: str | None = None) -> None:
+    """
+    Ответ модели с постепенным обновлением сообщения.
+
+    Сразу отправляем заглушку, затем по мере прихода токенов правим её
+    не чаще STREAM_EDIT_INTERVAL_S, в конце - полный ответ и время.
+    Если передан cache_key, ответ сохраняется в кэш под этим ключом.
+    """
+    placeholder = bot.reply_to(message, "…")
+    t0 = time.perf_counter()
+    parts: list[str] = []
+    shown = ""
+    last_edit = time.monotonic()
+    try:
+        for delta in chat_stream(msgs, model=model_key, temperature=LLM_TEMPERATURE, max_tokens=LLM_MAX_TOKENS):
+            parts.append(delta)
+            now = time.monotonic()
+            if now - last_edit >= STREAM_EDIT_INTERVAL_S:
+                text = "".join(parts).strip()[:4000]
+                if text and text != shown:
+                    _edit(placeholder, text)
+                    shown = text
+                last_edit = now
+        ms = int((time.perf_counter() - t0) * 1000)
+        out = "".join(parts).strip()[:4000]
+        _edit(placeholder, f"{out}\n\n({ms} мс; модель: {model_key}{suffix})")
+        if cache_key is not None and out:
+            answer_cache.cache.put(cache_key, model_key, out)
+    except OpenRouterError as e:
+        _edit(placeholder, f"Ошибка: {e}")
+    except Exception:
+        log.exception("Ошибка при запросе к модели %s", model_key)
+        _edit(placeholder, "Непредвиденная ошибка.")
 
 
 @bot.message_handler(commands=["characters"])
+@fast_lane.route
 def cmd_characters(message: types.Message) -> None:
     """Показать список персонажей"""
     user_id = message.from_user.id
@@ -81,6 +188,7 @@ def cmd_characters(message: types.Message) -> None:
 
 
 @bot.message_handler(commands=["character"])
+@fast_lane.route
 def cmd_character(message: types.Message) -> None:
     """Установить активным персонажа"""
     user_id = message.from_user.id
@@ -101,6 +209,7 @@ def cmd_character(message: types.Message) -> None:
 
 
 @bot.message_handler(commands=["whoami"])
+@fast_lane.route
 def cmd_whoami(message: types.Message) -> None:
     """Показать активную модель и активного персонажа"""
     character = get_user_character(message.from_user.id)
@@ -110,6 +219,7 @@ def cmd_whoami(message: types.Message) -> None:
 
 
 @bot.message_handler(commands=["ask_random"])
+@fast_lane.route
 def cmd_ask_random(message: types.Message) -> None:
     q = message.text.replace("/ask_random","", 1).strip()
     if not q:
@@ -128,23 +238,17 @@ def cmd_ask_random(message: types.Message) -> None:
 
     msgs = _build_messages_for_character(character, q)
     model_key = get_active_model()["key"]
-
-    try:
-        text, ms = chat_once(msgs, model=model_key, temperature=0.2, max_tokens=400)
-        out = (text or "").strip()[:4000]
-        bot.reply_to(message, text=f"{out}\n\n{ms} мс; модель: {model_key}; как: {character['name']}")
-    except OpenRouterError as e:
-        bot.reply_to(message, text=f"Ошибка: {e}")
-    except Exception:
-        bot.reply_to(message, text="Непредвиденная ошибка.")
+    _answer(message, msgs, model_key, f"; как: {character['name']}")
 
 
 
 @bot.message_handler(commands=['start'])
+@fast_lane.route
 def start(message):
     bot.reply_to(message, "Привет! Я бот для заметок. Используй /help для списка команд.")
 
 @bot.message_handler(commands=['help'])
+@fast_lane.route
 def help_cmd(message):
     help_text = """
 Доступные команды:
@@ -153,13 +257,14 @@ def help_cmd(message):
 /note_find <запрос> - Найти заметку
 /note_edit <id> <новый текст> - Изменить заметку
 /note_del <id> - Удалить заметку
-/note_export - Экспортировать заметки
+/note_export [txt|csv|json|md] - Экспортировать заметки
 /stats - Еженедельная статистика
 /ask - Вопрос
 """
     bot.reply_to(message, help_text)
 
 @bot.message_handler(commands=['note_add'])
+@fast_lane.route
 def note_add(message):
     text = message.text.replace('/note_add', '').strip()
     if not text:
@@ -174,24 +279,84 @@ def note_add(message):
         bot.reply_to(message, f"Заметка #{note_id} добавлена: {text}")
     else:
         error_message = (
-            f"❌ Достигнут лимит заметок ({50} шт.)\n\n"
+            f"❌ Достигнут лимит заметок ({NOTES_LIMIT} шт.)\n\n"
             "Чтобы добавить новую, удалите одну из старых заметок с помощью команды /note_del <id>."
         )
         bot.reply_to(message, error_message)
 
+def _notes_page(user_id: int, before_id=None, after_id=None):
+    """
+    Текст и inline-клавиатура страницы /note_list.
+
+    В callback_data кнопок - владелец списка и курсор:
+    notes:<user_id>:older:<id> / notes:<user_id>:newer:<id>.
+    """
+    notes, has_more = list_notes_page(user_id, before_id=before_id, after_id=after_id,
+                                      limit=NOTE_LIST_PAGE_SIZE)
+    if not notes:
+        return None, None
+
+    # Куда ещё можно листать: в сторону движения - по has_more, обратно - раз
+    # пришли оттуда по курсору
+    has_newer = has_more if after_id is not None else before_id is not None
+    has_older = has_more if after_id is None else True
+
+    kb = types.InlineKeyboardMarkup()
+    buttons = []
+    if has_newer:
+        buttons.append(types.InlineKeyboardButton("◀ Новее", callback_data=f"notes:{user_id}:newer:{notes[0]['id']}"))
+    if has_older:
+        buttons.append(types.InlineKeyboardButton("Старше ▶", callback_data=f"notes:{user_id}:older:{notes[-1]['id']}"))
+    if buttons:
+        kb.row(*buttons)
+
+    response = "Ваши заметки:\n" + "\n".join([f"{note['id']}: {note['text']}" for note in notes])
+    return response, kb if buttons else None
+
+
 @bot.message_handler(commands=['note_list'])
+@fast_lane.route
 def note_list(message):
     user_id = message.from_user.id
-    user_notes = list_notes(user_id)
+    response, kb = _notes_page(user_id)
 
-    if not user_notes:
+    if response is None:
         bot.reply_to(message, "Заметок пока нет.")
         return
 
-    response = "Ваши заметки:\n" + "\n".join([f"{note['id']}: {note['text']}" for note in user_notes])
-    bot.reply_to(message, response)
+    bot.reply_to(message, response, reply_markup=kb)
+
+
+@bot.callback_query_handler(func=lambda c: (c.data or "").startswith("notes:"))
+@fast_lane.route
+def note_list_page(call: types.CallbackQuery) -> None:
+    try:
+        _, owner, direction, cursor = call.data.split(":")
+        owner, cursor = int(owner), int(cursor)
+    except ValueError:
+        bot.answer_callback_query(call.id)
+        return
+    if call.from_user.id != owner or direction not in ("older", "newer"):
+        bot.answer_callback_query(call.id, "Это не ваш список заметок.")
+        return
+
+    if direction == "older":
+        response, kb = _notes_page(owner, before_id=cursor)
+    else:
+        response, kb = _notes_page(owner, after_id=cursor)
+    bot.answer_callback_query(call.id)
+    if response is None:
+        # Заметки на этой странице успели удалить
+        response, kb = _notes_page(owner)
+    try:
+        bot.edit_message_text(response or "Заметок пока нет.", call.message.chat.id,
+                              call.message.message_id, reply_markup=kb)
+    except ApiTelegramException as e:
+        # Например, повторное нажатие той же кнопки: "message is not modified"
+        log.warning("Не удалось обновить список заметок %s: %s", call.message.message_id, e)
 
 @bot.message_handler(commands=["models"])
+@fast_lane.route
 def cmd_models(message: types.Message) -> None:
     items = list_models()
     if not items:
@@ -206,6 +371,7 @@ def cmd_models(message: types.Message) -> None:
 
 
 @bot.message_handler(commands=["model"])
+@fast_lane.route
 def cmd_model(message: types.Message) -> None:
     arg = message.text.replace("/model", "", 1).strip()
     if not arg:
@@ -223,6 +389,7 @@ def cmd_model(message: types.Message) -> None:
 
 
 @bot.message_handler(commands=["ask"])
+@fast_lane.route
 def cmd_ask(message: types.Message) -> None:
     q = message. text.replace ("/ask", "", 1) .strip()
     if not q:
@@ -231,18 +398,11 @@ def cmd_ask(message: types.Message) -> None:
 
     msgs = _build_messages(message.from_user.id, q[:600])
     model_key = get_active_model() ["key"]
-
-    try:
-        text, ms = chat_once(msgs, model=model_key, temperature=0.2, max_tokens=400)
-        out = (text or "") .strip()[: 4000]
-        bot.reply_to(message, f"{out}\n\n({ms} мc; модель: {model_key})")
-    except OpenRouterError as e:
-        bot.reply_to(message, f"Ошибка: {e}")
-    except Exception:
-        bot.reply_to(message, "Непредвиденная ошибка. ")
+    _answer(message, msgs, model_key)
 
 
 @bot.message_handler(commands=["ask_model"])
+@fast_lane.route
 def cmd_ask_model(message: types.Message):
     parts = message.text.split(maxsplit=2)
 
@@ -260,8 +420,7 @@ def cmd_ask_model(message: types.Message):
     model_id = int(model_id_str)
 
     # Получаем модель по ID
-    models = list_models()
-    target_model = next((m for m in models if m["id"] == model_id), None)
+    target_model = get_model_by_id(model_id)
 
     if not target_model:
         bot.reply_to(message, f"Модель с ID={model_id} не найдена.")
@@ -269,18 +428,11 @@ def cmd_ask_model(message: types.Message):
 
     model_key = target_model["key"]
     msgs = _build_messages(message.from_user.id, question[:600])
-
-    try:
-        text, ms = chat_once(msgs, model=model_key, temperature=0.2, max_tokens=400)
-        result = (text or "").strip()[:4000]
-        bot.reply_to(message, f"{result}\n\n({ms} мс; модель: {model_key})")
-    except OpenRouterError as e:
-        bot.reply_to(message, f"Ошибка: {e}")
-    except Exception:
-        bot.reply_to(message, "Произошла непредвиденная ошибка.")
+    _answer(message, msgs, model_key)
 
 
 @bot.message_handler(commands=['note_find'])
+@fast_lane.route
 def note_find(message):
     query_text = message.text.replace('/note_find', '').strip()
     if not query_text:
@@ -294,10 +446,11 @@ def note_find(message):
         bot.reply_to(message, f"Ничего не найдено по запросу: «{query_text}»")
         return
 
-    response = "Результаты поиска:\n" + "\n".join([f"{note['id']}: {note['text']}" for note in found_notes])
-    bot.reply_to(message, response)
+    response = "Результаты поиска:\n" + "\n".join([f"{note['id']}: {_highlight(note['snippet'])}" for note in found_notes])
+    bot.reply_to(message, response, parse_mode="HTML")
 
 @bot.message_handler(commands=['note_edit'])
+@fast_lane.route
 def note_edit(message):
     parts = message.text.split(maxsplit=2)
     if len(parts) < 3:
@@ -321,6 +474,7 @@ def note_edit(message):
     bot.reply_to(message, f"Заметка #{note_id} изменена на: {new_text}")
 
 @bot.message_handler(commands=['note_del'])
+@fast_lane.route
 def note_del(message):
     parts = message.text.split()
     if len(parts) < 2:
@@ -344,38 +498,31 @@ def note_del(message):
 
 
 @bot.message_handler(commands=['note_export'])
+@fast_lane.route
 def note_export(message):
     user_id = message.from_user.id
-    all_notes = list_all_notes(user_id)
+    parts = message.text.split()
+    fmt = parts[1].lower() if len(parts) > 1 else "txt"
+    if fmt not in EXPORT_FORMATS:
+        bot.reply_to(message, f"Формат: /note_export [{'|'.join(EXPORT_FORMATS)}]")
+        return
 
-    if not all_notes:
+    if count_notes(user_id) == 0:
         bot.reply_to(message, "У вас нет заметок для экспорта.")
         return
 
-    file_path = f"notes_{user_id}.txt"
-
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            username = message.from_user.username or f"user_{user_id}"
-            f.write(f"Экспорт всех заметок для пользователя @{username}\n")
-            f.write("="*30 + "\n\n")
-            for note in all_notes:
-                f.write(f"ID: {note['id']}\n")
-                f.write(f"Дата создания: {note['created_at']}\n")
-                f.write(f"Текст: {note['text']}\n")
-                f.write("-"*20 + "\n\n")
-
-        with open(file_path, 'rb') as f:
-            bot.send_document(message.chat.id, f, caption="Ваши заметки в файле.")
-
-    except Exception as e:
-        print(f"Ошибка при экспорте заметок для user_id {user_id}: {e}")
+        username = message.from_user.username or f"user_{user_id}"
+        export = export_notes(user_id, fmt, username=username)
+        with export.file:
+            bot.send_document(message.chat.id, export.file, caption="Ваши заметки в файле.",
+                              visible_file_name=export.filename)
+    except Exception:
+        log.exception("Ошибка при экспорте заметок для user_id %s", user_id)
         bot.reply_to(message, "Произошла ошибка при создании файла экспорта.")
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
 
 @bot.message_handler(commands=['stats'])
+@fast_lane.route
 def note_stats(message):
     user_id = message.from_user.id
     # Вызываем новую функцию для получения еженедельной статистики
@@ -388,7 +535,7 @@ def note_stats(message):
         bot.reply_to(message, "За последнюю неделю у вас не было активности. Пора это исправить!")
         return
 
-    current_notes_count = len(list_all_notes(user_id))
+    current_notes_count = count_notes(user_id)
 
     BAR_CHAR = '█'
     MAX_BAR_LENGTH = 20
@@ -410,6 +557,54 @@ def note_stats(message):
 
 
 
+def _activity_log_retention(retain_days: int, interval_s: float = 86400.0) -> None:
+    """Раз в interval_s удалять события activity_log старше retain_days дней."""
+    while True:
+        try:
+            removed = prune_activity_log(retain_days)
+            if removed:
+                log.info("activity_log: удалено %d старых событий", removed)
+        except Exception:
+            log.exception("Не удалось почистить activity_log")
+        time.sleep(interval_s)
+
+
+def _db_optimize(interval_s: float) -> None:
+    """Раз в interval_s обновлять статистику планировщика (PRAGMA optimize)."""
+    while True:
+        time.sleep(interval_s)
+        try:
+            optimize_db()
+        except Exception:
+            log.exception("Не удалось выполнить PRAGMA optimize")
+
+
 if __name__ == "__main__":
+    setup_logging()
     print("Бот запускается...")
-    bot.infinity_polling(skip_pending=True)
\ No newline at end of file
+    service_log.recorder.start()
+    if ACTIVITY_LOG_RETAIN_DAYS > 0:
+        threading.Thread(target=_activity_log_retention, args=(ACTIVITY_LOG_RETAIN_DAYS,),
+                         name="activity-log-retention", daemon=True).start()
+    if DB_OPTIMIZE_INTERVAL_S > 0:
+        threading.Thread(target=_db_optimize, args=(DB_OPTIMIZE_INTERVAL_S,),
+                         name="db-optimize", daemon=True).start()
+    shared_metrics = SharedMetrics(METRICS_SHM_PATH) if METRICS_SHM_PATH else None
+    if shared_metrics is not None:
+        shared_metrics.start()
+    metrics_server = None
+    if METRICS_PORT > 0:
+        source = FleetMetrics(METRICS_SHM_PATH) if METRICS_SHM_PATH else metric
+        metrics_server = start_metrics_server(METRICS_PORT, METRICS_HOST, registry=source)
+    try:
+        bot.infinity_polling(skip_pending=True)
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        if shared_metrics is not None:
+            shared_metrics.close()
+        dispatcher.shutdown(wait=True)
+        service_log.recorder.close()
+        # Дописать отложенные события activity_log и закрыть соединения
+        close_pools()
@@ -1,19 +1,48 @@
 """
 Реестр метрик для бота.
 
-Метрики хранятся в памяти процесса, без Prometheus и внешних систем.
-Используются для команды /stats и простой диагностики.
+Метрики хранятся в памяти процесса, без внешних систем. Используются для
+команды /stats и простой диагностики; по HTTP (в формате Prometheus и
+JSON) их отдаёт metrics_http.py, если задан METRICS_PORT.
+
+Кроме накопленных с запуска значений есть скользящие окна за последние
+1 минуту, 5 минут и 1 час: metric.snapshot(window="5m").
 """
 
+import bisect
+import itertools
 import threading
 import time
 import functools
 import logging
-from dataclasses import dataclass, asdict
-from typing import Dict, Any, Callable, TypeVar
+import math
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Any, Callable, List, Optional, Tuple, TypeVar
 
 T = TypeVar("T")
 
+# Уровни скользящих окон: (длина слота в секундах, число слотов).
+# Память на метрику постоянная: 60 + 30 + 60 слотов.
+WINDOW_TIERS: Tuple[Tuple[int, int], ...] = ((1, 60), (10, 30), (60, 60))
+
+# Окно -> индекс уровня в WINDOW_TIERS
+WINDOWS: Dict[str, int] = {"1m": 0, "5m": 1, "1h": 2}
+
+# Часы для окон (секунды, монотонные); тесты подменяют
+_clock = time.monotonic
+
+
+def _window_tier(window: str) -> int:
+    try:
+        return WINDOWS[window]
+    except KeyError:
+        raise ValueError(
+            f"Неизвестное окно метрик {window!r}: ожидается одно из {', '.join(WINDOWS)}"
+        ) from None
+
+
 class Counter:
     """
     Простой счетчик.
@@ -25,20 +54,101 @@ class Counter:
         total.inc(5)
 
     Значения не сбрасываются автоматически при рестарте процесса.
+
+    Счётчик потокобезопасен без блокировок на inc(): у каждого потока своя
+    ячейка, в неё пишет только этот поток. get() (и .value) складывает
+    ячейки; ячейки завершившихся потоков сворачиваются в общий итог.
+
+    Для скользящих окон первый inc() каждой новой секунды запоминает
+    итог на её начало (по одному значению на слот каждого уровня
+    WINDOW_TIERS). Прирост за окно - get() минус итог на начало окна;
+    если в окне не было ни одного inc(), прирост 0.
     """
 
     def __init__(self, name: str) -> None:
         self.name = name
-        self.value = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (поток, ячейка [значение]) для каждого потока, вызывавшего inc()
+        self._cells: List[Tuple[weakref.ref, List[int]]] = []
+        # Сумма ячеек завершившихся потоков
+        self._retired = 0
+        # Начало следующей секунды (по _clock), когда нужен новый замер
+        # итога, и замеры (слот, итог) по уровням
+        self._next_sample = float("-inf")
+        self._samples: List[Deque[Tuple[int, int]]] = [deque(maxlen=n) for _, n in WINDOW_TIERS]
+
+    def _new_cell(self) -> List[int]:
+        cell = [0]
+        with self._lock:
+            self._compact()
+            self._cells.append((weakref.ref(threading.current_thread()), cell))
+        self._local.cell = cell
+        return cell
+
+    def _compact(self) -> None:
+        # Вызывается под self._lock. В ячейку завершившегося потока больше
+        # никто не пишет, её можно перенести в _retired.
+        alive = []
+        for ref, cell in self._cells:
+            thread = ref()
+            if thread is None or not thread.is_alive():
+                self._retired += cell[0]
+            else:
+                alive.append((ref, cell))
+        self._cells = alive
+
+    def _sample(self, now: float) -> None:
+        # Итог на начало текущей секунды - до прибавки текущего inc()
+        second = int(now)
+        with self._lock:
+            if now < self._next_sample:
+                return
+            total = self._total()
+            for (slot_s, _), samples in zip(WINDOW_TIERS, self._samples):
+                slot = second // slot_s
+                if not samples or samples[-1][0] != slot:
+                    samples.append((slot, total))
+            self._next_sample = second + 1
 
     def inc(self, amount: int = 1) -> None:
         # Увеличить счетчик на amount (по умолчанию на 1)
         if amount < 0:
             raise ValueError("Ошибка при увеличении счетчика метрик: количество должно быть >= 0")
-        self.value += amount
+        now = _clock()
+        if now >= self._next_sample:
+            self._sample(now)
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._new_cell()
+        cell[0] += amount
+
+    def _total(self) -> int:
+        # Вызывается под self._lock
+        if len(self._cells) > 64:
+            self._compact()
+        return self._retired + sum(cell[0] for _, cell in self._cells)
 
     def get(self) -> int:
-        return self.value
+        with self._lock:
+            return self._total()
+
+    def window(self, window: str) -> int:
+        """Прирост счётчика за окно "1m", "5m" или "1h"."""
+        tier = _window_tier(window)
+        slot_s, slots = WINDOW_TIERS[tier]
+        start = int(_clock()) // slot_s - slots + 1
+        with self._lock:
+            total = self._total()
+            for slot, value in self._samples[tier]:
+                if slot >= start:
+                    return total - value
+        return 0
+
+    @property
+    def value(self) -> int:
+        return self.get()
 
 
 @dataclass
@@ -78,6 +188,180 @@ class LatencyStats:
         return self.total_ms / self.count
 
 
+def _bucket_index(us: int) -> int:
+    # Номер корзины Histogram для us >= 0: 16 точных корзин, дальше по 16
+    # на октаву (старшие 5 бит значения), последняя - всё, что больше
+    if us < 16:
+        return us
+    octave = us.bit_length() - 5
+    if octave >= 32:
+        return 16 + 32 * 16 - 1
+    return 16 + (octave << 4) + ((us >> octave) & 15)
+
+
+class Histogram:
+    """
+    Гистограмма задержек в микросекундах с логарифмическими корзинами
+    (как HDR Histogram).
+
+    Значения до 16 мкс хранятся точно; дальше каждая степень двойки
+    (октава) делится на 16 корзин, так что относительная погрешность
+    квантиля не больше 1/16 (~6%). Октав 32 - это до ~19 часов; что
+    больше, попадает в последнюю корзину. Память постоянная: 528 счётчиков.
+
+    Гистограммы одного устройства можно складывать (merge) - например,
+    чтобы объединить данные нескольких потоков или процессов.
+
+    Пример использования:
+
+        h = Histogram()
+        h.record(1250)          # 1.25 мс
+        h.quantile(0.99)        # -> мкс
+    """
+
+    SUB_BUCKETS = 16
+    OCTAVES = 32
+    SIZE = SUB_BUCKETS + OCTAVES * SUB_BUCKETS
+
+    __slots__ = ("counts", "count", "total_us", "min_us", "max_us")
+
+    def __init__(self) -> None:
+        self.counts = [0] * self.SIZE
+        self.count = 0
+        self.total_us = 0
+        self.min_us = 0
+        self.max_us = 0
+
+    @classmethod
+    def bucket_of(cls, us: int) -> int:
+        return _bucket_index(us)
+
+    @classmethod
+    def bucket_bounds(cls, index: int) -> Tuple[int, int]:
+        """Границы корзины [нижняя, верхняя) в мкс."""
+        if index < cls.SUB_BUCKETS:
+            return index, index + 1
+        octave, sub = divmod(index - cls.SUB_BUCKETS, cls.SUB_BUCKETS)
+        low = (cls.SUB_BUCKETS + sub) << octave
+        return low, low + (1 << octave)
+
+    def record(self, us: int) -> None:
+        # Учесть одно измерение (мкс); не потокобезопасно - см. LatencyMetric
+        if us >= 0:
+            self._add(us, _bucket_index(us))
+
+    def _add(self, us: int, index: int) -> None:
+        if self.count == 0:
+            self.min_us = us
+            self.max_us = us
+        else:
+            if us < self.min_us:
+                self.min_us = us
+            if us > self.max_us:
+                self.max_us = us
+        self.count += 1
+        self.total_us += us
+        self.counts[index] += 1
+
+    def merge(self, other: "Histogram") -> "Histogram":
+        """Добавить к этой гистограмме данные other. Возвращает self."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.min_us, self.max_us = other.min_us, other.max_us
+        else:
+            self.min_us = min(self.min_us, other.min_us)
+            self.max_us = max(self.max_us, other.max_us)
+        self.count += other.count
+        self.total_us += other.total_us
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                counts[i] += n
+        return self
+
+    def copy(self) -> "Histogram":
+        h = Histogram()
+        h.counts = list(self.counts)
+        h.count, h.total_us, h.min_us, h.max_us = self.count, self.total_us, self.min_us, self.max_us
+        return h
+
+    def quantile(self, q: float) -> float:
+        """Значение квантиля q (0..1) в мкс; 0.0, если измерений нет."""
+        return self.quantiles(q)[0]
+
+    def quantiles(self, *qs: float) -> List[float]:
+        """Несколько квантилей за один проход по корзинам (в мкс)."""
+        if self.count == 0:
+            return [0.0] * len(qs)
+        cumulative = list(itertools.accumulate(self.counts))
+        result = []
+        for q in qs:
+            if q <= 0:
+                result.append(float(self.min_us))
+                continue
+            rank = max(1, math.ceil(q * self.count))
+            i = bisect.bisect_left(cumulative, rank)
+            if q >= 1 or i >= self.SIZE - 1:
+                # Последняя корзина без верхней границы
+                result.append(float(self.max_us))
+                continue
+            low, high = self.bucket_bounds(i)
+            value = low if high - low == 1 else (low + high) / 2
+            result.append(float(min(max(value, self.min_us), self.max_us)))
+        return result
+
+
+class _WindowSlot:
+    """Один слот скользящего окна задержек: разреженные корзины Histogram."""
+
+    __slots__ = ("slot", "counts", "count", "total_us", "min_us", "max_us")
+
+    def __init__(self, slot: int) -> None:
+        self.slot = slot
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total_us = 0
+        self.min_us = 0
+        self.max_us = 0
+
+    def record(self, us: int, index: int) -> None:
+        if self.count == 0 or us < self.min_us:
+            self.min_us = us
+        if us > self.max_us:
+            self.max_us = us
+        self.count += 1
+        self.total_us += us
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+
+    def absorb(self, other: "_WindowSlot") -> None:
+        if other.count == 0:
+            return
+        if self.count == 0 or other.min_us < self.min_us:
+            self.min_us = other.min_us
+        if other.max_us > self.max_us:
+            self.max_us = other.max_us
+        self.count += other.count
+        self.total_us += other.total_us
+        counts = self.counts
+        for index, n in other.counts.items():
+            counts[index] = counts.get(index, 0) + n
+
+    def merge_into(self, h: Histogram) -> None:
+        if self.count == 0:
+            return
+        if h.count == 0:
+            h.min_us, h.max_us = self.min_us, self.max_us
+        else:
+            h.min_us = min(h.min_us, self.min_us)
+            h.max_us = max(h.max_us, self.max_us)
+        h.count += self.count
+        h.total_us += self.total_us
+        for index, n in self.counts.items():
+            h.counts[index] += n
+
+
 class LatencyMetric:
     """
     Обертка для LatencyStats, чтобы иметь единообразный API
@@ -85,24 +369,114 @@ class LatencyMetric:
     Пример использования:
 
         metric.latency("openrouter_latency_ms").observe(500)
+        metric.latency("build_messages_ms").observe_us(180)
+
+    Кроме LatencyStats (целые мс) ведётся Histogram в микросекундах - из
+    неё берутся квантили p50/p95/p99.
+
+    Для скользящих окон измерение попадает в секундный слот (первый
+    уровень WINDOW_TIERS). Вытесненный слот сливается в слот следующего
+    уровня (10 с, затем 60 с), так что каждое измерение лежит ровно в
+    одном слоте; окно собирается из слотов всех уровней, начавшихся не
+    раньше начала окна. Слот хранит только непустые корзины.
     """
 
     def __init__(self, name: str) -> None:
         self.name = name
         self.stats = LatencyStats()
+        self._histogram = Histogram()
+        self._rings: List[List[Optional[_WindowSlot]]] = [[None] * n for _, n in WINDOW_TIERS]
+        self._lock = threading.Lock()
 
     def observe(self, ms: int) -> None:
-        self.stats.observe(ms)
+        if ms < 0:
+            return
+        self.observe_us(int(ms * 1000))
+
+    def observe_us(self, us: int) -> None:
+        """Учесть измерение в микросекундах (точнее, чем observe в мс)."""
+        if us < 0:
+            return
+        index = _bucket_index(us)
+        second = int(_clock())
+        with self._lock:
+            self.stats.observe(us // 1000)
+            self._histogram._add(us, index)
+            ring = self._rings[0]
+            pos = second % len(ring)
+            cell = ring[pos]
+            if cell is None or cell.slot != second:
+                if cell is not None:
+                    self._roll_up(cell, 1)
+                cell = ring[pos] = _WindowSlot(second)
+            cell.record(us, index)
+
+    def _roll_up(self, cell: _WindowSlot, tier: int) -> None:
+        # Перенести вытесненный слот уровня tier - 1 на уровень tier
+        # (вызывается под self._lock); с последнего уровня данные уходят
+        while cell is not None and tier < len(WINDOW_TIERS):
+            cell.slot = cell.slot * WINDOW_TIERS[tier - 1][0] // WINDOW_TIERS[tier][0]
+            ring = self._rings[tier]
+            pos = cell.slot % len(ring)
+            target = ring[pos]
+            if target is not None and target.slot == cell.slot:
+                target.absorb(cell)
+                return
+            if target is None or target.slot < cell.slot:
+                # Слот занимает cell, дальше переносится вытесненный
+                ring[pos], cell = cell, target
+            # Иначе место занято более новым слотом - cell идёт уровнем выше
+            tier += 1
+
+    def histogram(self, window: Optional[str] = None) -> Histogram:
+        """
+        Копия гистограммы (за всё время или за окно "1m", "5m", "1h");
+        её можно сложить (merge) с другими.
+        """
+        if window is None:
+            with self._lock:
+                return self._histogram.copy()
+        slot_s, slots = WINDOW_TIERS[_window_tier(window)]
+        start = (int(_clock()) // slot_s - slots + 1) * slot_s
+        h = Histogram()
+        with self._lock:
+            for (cell_s, _), ring in zip(WINDOW_TIERS, self._rings):
+                for cell in ring:
+                    if cell is not None and cell.slot * cell_s >= start:
+                        cell.merge_into(h)
+        return h
 
-    def snapshot(self) -> Dict[str, Any]:
+    def snapshot(self, window: Optional[str] = None) -> Dict[str, Any]:
         """
-        Срез статистики для этой метрики
+        Срез статистики для этой метрики (за всё время или за окно)
 
         Возвращает dict с полями:
-        count, total_ms, min_ms, max_ms, avg_ms
+        count, total_ms, min_ms, max_ms, avg_ms, p50_ms, p95_ms, p99_ms
         """
-        data = asdict(self.stats)
-        data["avg_ms"] = self.stats.avg_ms
+        if window is None:
+            with self._lock:
+                stats = self.stats
+                data = {
+                    "count": stats.count,
+                    "total_ms": stats.total_ms,
+                    "min_ms": stats.min_ms,
+                    "max_ms": stats.max_ms,
+                    "avg_ms": stats.avg_ms,
+                }
+                histogram = self._histogram.copy()
+        else:
+            histogram = self.histogram(window)
+            data = {
+                "count": histogram.count,
+                "total_ms": histogram.total_us // 1000,
+                "min_ms": histogram.min_us // 1000,
+                "max_ms": histogram.max_us // 1000,
+                "avg_ms": histogram.total_us / histogram.count / 1000 if histogram.count else 0.0,
+            }
+        p50, p95, p99 = histogram.quantiles(0.5, 0.95, 0.99)
+        data["p50_ms"] = round(p50 / 1000, 3)
+        data["p95_ms"] = round(p95 / 1000, 3)
+        data["p99_ms"] = round(p99 / 1000, 3)
         return data
 
 
@@ -118,6 +492,9 @@ class MetricsRegistry:
         metric.latency("openrouter_latency_ms").observe(812)
 
     и метод snapshot() для команды /stats
+
+    Уже зарегистрированные метрики отдаются без блокировки реестра;
+    блокировка берётся только при создании новой метрики.
     """
 
     def __init__(self) -> None:
@@ -132,6 +509,10 @@ class MetricsRegistry:
         Получить (или создать) счетчик с именем name.
         Если счётчик еще не зарегистрирован, создается новый.
         """
+        # Быстрый путь без блокировки: счётчик уже зарегистрирован
+        c = self._counters.get(name)
+        if c is not None:
+            return c
         with self._lock:
             c = self._counters.get(name)
             if c is None:
@@ -147,6 +528,9 @@ class MetricsRegistry:
 
         Если не было - создается новая.
         """
+        m = self._latencies.get(name)
+        if m is not None:
+            return m
         with self._lock:
             m = self._latencies.get(name)
             if m is None:
@@ -156,7 +540,12 @@ class MetricsRegistry:
 
     # --- Срез всех метрик ---
 
-    def snapshot(self) -> Dict[str, Any]:
+    def metrics(self) -> Tuple[List[Tuple[str, Counter]], List[Tuple[str, "LatencyMetric"]]]:
+        """Списки (имя, счётчик) и (имя, метрика задержки) на текущий момент."""
+        with self._lock:
+            return list(self._counters.items()), list(self._latencies.items())
+
+    def snapshot(self, window: Optional[str] = None) -> Dict[str, Any]:
         """
         Вернуть все метрики в виде словаря:
 
@@ -168,22 +557,39 @@ class MetricsRegistry:
                     "total_ms": ...,
                     "min_ms": ...,
                     "max_ms": ...,
-                    "avg_ms": ...
+                    "avg_ms": ...,
+                    "p50_ms": ...,
+                    "p95_ms": ...,
+                    "p99_ms": ...
                 },
                 "build_messages_ms": { ... },
                 ...
             }
         }
 
+        С window ("1m", "5m", "1h") - то же за последнее окно: в counters
+        прирост за окно, в latencies - измерения за окно, и добавляется
+        "rates": {"commands_total": <в секунду>, ...}.
+
         Используется для команды /stats.
         """
-        with self._lock:
-            counters = {name: c.get() for name, c in self._counters.items()}
-            latencies = {
-                name: metric.snapshot()
-                for name, metric in self._latencies.items()
-            }
-        return {"counters": counters, "latencies": latencies}
+        if window is not None:
+            slot_s, slots = WINDOW_TIERS[_window_tier(window)]
+            seconds = slot_s * slots
+        counters_items, latencies_items = self.metrics()
+        # Значения собираем уже без блокировки реестра
+        if window is None:
+            counters = {name: c.get() for name, c in counters_items}
+        else:
+            counters = {name: c.window(window) for name, c in counters_items}
+        latencies = {
+            name: metric.snapshot(window)
+            for name, metric in latencies_items
+        }
+        if window is None:
+            return {"counters": counters, "latencies": latencies}
+        rates = {name: round(n / seconds, 3) for name, n in counters.items()}
+        return {"counters": counters, "rates": rates, "latencies": latencies}
 
 
 # Глобальный реестр метрик
@@ -206,22 +612,24 @@ def timed(metric_name: str, logger: logging.Logger | None = None) -> Callable[[C
             ...
 
     При каждом вызове:
-    - замеряется время выполнения функции в миллисекундах
-    - значение записывается в metric.latency(metric_name)
+    - замеряется время выполнения функции (perf_counter_ns, в мкс)
+    - значение записывается в metric.latency(metric_name).observe_us
     - если передан logger, пишется DEBUG-запись со временем
     """
 
     def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        latency = metric.latency(metric_name)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs) -> T:
-            t0 = time.perf_counter()
+            t0 = time.perf_counter_ns()
             try:
                 return func(*args, **kwargs)
             finally:
-                dt_ms = int((time.perf_counter() - t0) * 1000)
-                metric.latency(metric_name).observe(dt_ms)
+                dt_us = (time.perf_counter_ns() - t0) // 1000
+                latency.observe_us(dt_us)
                 if logger is not None:
-                    logger.debug("timed %s: %s ms", func.__qualname__, dt_ms)
+                    logger.debug("timed %s: %.3f ms", func.__qualname__, dt_us / 1000)
 
         return wrapper
 
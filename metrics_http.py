@@ -0,0 +1,174 @@
+"""
+HTTP-эндпоинт метрик (для сбора Prometheus'ом и ручной диагностики).
+
+    GET /metrics       - metric.snapshot() в текстовом формате Prometheus
+    GET /metrics.json  - metric.snapshot() в JSON; ?window=1m|5m|1h - за окно
+
+Счётчики отдаются как counter, задержки - как summary с квантилями
+0.5/0.95/0.99 (в мс), _sum и _count. Если два имени после приведения к
+формату Prometheus совпали (например, "a.b" и "a_b"), второе получает
+суффикс _2, _3, ... Вместо реестра процесса можно
+отдавать FleetMetrics (metrics_shm.py) - сумму по всем процессам бота
+(счётчики не убывают и после завершения процессов); тогда добавляется
+gauge metrics_processes.
+
+Сервер - ThreadingHTTPServer из стандартной библиотеки в фоновом потоке,
+внешних зависимостей нет. Ответ /metrics собирается не чаще раза в
+cache_ttl_s секунд: частые или параллельные запросы получают готовый
+текст, строки # TYPE для каждого имени формируются один раз.
+
+Включается в main_db.py переменной окружения METRICS_PORT.
+
+Пример использования:
+
+    server = start_metrics_server(9100)
+    ...
+    server.shutdown()
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+from metrics import MetricsRegistry, metric
+from metrics_shm import FleetMetrics
+
+log = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_:]")
+
+_QUANTILES = (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms"))
+
+
+def metric_name(name: str) -> str:
+    """Имя метрики в допустимом для Prometheus виде ([a-zA-Z_:][a-zA-Z0-9_:]*)."""
+    name = _INVALID_NAME_CHARS.sub("_", name)
+    if not name or name[0].isdigit():
+        name = "_" + name
+    return name
+
+
+Source = Union[MetricsRegistry, FleetMetrics]
+
+
+def _series(prom: str, kind: str) -> Tuple[str, ...]:
+    """Имена серий, которые занимает метрика: у summary ещё _sum и _count."""
+    return (prom, f"{prom}_sum", f"{prom}_count") if kind == "summary" else (prom,)
+
+
+class MetricsExporter:
+    """Сериализует срез реестра метрик в формат Prometheus и JSON."""
+
+    def __init__(self, registry: Source = metric, cache_ttl_s: float = 1.0) -> None:
+        self.registry = registry
+        self.cache_ttl_s = cache_ttl_s
+        self._lock = threading.Lock()
+        self._cached: Optional[bytes] = None
+        self._cached_at = 0.0
+        # Имя метрики -> (заголовок "# TYPE ...", имя для Prometheus)
+        self._counter_names: Dict[str, Tuple[str, str]] = {}
+        self._summary_names: Dict[str, Tuple[str, str]] = {}
+        # Занятые имена серий Prometheus -> (тип, имя метрики)
+        self._taken: Dict[str, Tuple[str, str]] = {"metrics_processes": ("gauge", "processes")}
+
+    def _names(self, cache: Dict[str, Tuple[str, str]], name: str, kind: str) -> Tuple[str, str]:
+        entry = cache.get(name)
+        if entry is None:
+            owner = (kind, name)
+            base = prom = metric_name(name)
+            n = 1
+            while any(self._taken.get(series, owner) != owner for series in _series(prom, kind)):
+                n += 1
+                prom = f"{base}_{n}"
+            if prom != base:
+                log.warning("Имя метрики %r совпадает с другим после приведения к %s, отдаём как %s",
+                            name, base, prom)
+            for series in _series(prom, kind):
+                self._taken[series] = owner
+            entry = cache[name] = (f"# TYPE {prom} {kind}\n", prom)
+        return entry
+
+    def render_prometheus(self) -> bytes:
+        """Срез реестра в текстовом формате Prometheus (без кэша)."""
+        snapshot = self.registry.snapshot()
+        parts = []
+        for name, value in sorted(snapshot["counters"].items()):
+            header, prom = self._names(self._counter_names, name, "counter")
+            parts.append(f"{header}{prom} {value}\n")
+        for name, data in sorted(snapshot["latencies"].items()):
+            header, prom = self._names(self._summary_names, name, "summary")
+            parts.append(header)
+            for q, key in _QUANTILES:
+                parts.append(f'{prom}{{quantile="{q}"}} {data[key]}\n')
+            parts.append(f"{prom}_sum {data['total_ms']}\n{prom}_count {data['count']}\n")
+        if "processes" in snapshot:
+            parts.append(f"# TYPE metrics_processes gauge\nmetrics_processes {snapshot['processes']}\n")
+        return "".join(parts).encode("utf-8")
+
+    def prometheus(self) -> bytes:
+        """То же, что render_prometheus(), но не чаще раза в cache_ttl_s."""
+        with self._lock:
+            now = time.monotonic()
+            if self._cached is None or now - self._cached_at >= self.cache_ttl_s:
+                self._cached = self.render_prometheus()
+                self._cached_at = now
+            return self._cached
+
+    def json(self, window: Optional[str] = None) -> bytes:
+        """Срез реестра (за всё время или за окно) в JSON."""
+        return json.dumps(self.registry.snapshot(window), ensure_ascii=False).encode("utf-8")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    exporter: MetricsExporter
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        try:
+            if url.path == "/metrics":
+                self._send(200, PROMETHEUS_CONTENT_TYPE, self.exporter.prometheus())
+            elif url.path == "/metrics.json":
+                window = parse_qs(url.query).get("window", [None])[0]
+                self._send(200, "application/json; charset=utf-8", self.exporter.json(window))
+            else:
+                self._send(404, "text/plain; charset=utf-8", "Не найдено\n".encode("utf-8"))
+        except ValueError as e:
+            self._send(400, "text/plain; charset=utf-8", f"{e}\n".encode("utf-8"))
+        except Exception:
+            log.exception("Ошибка при отдаче метрик %s", url.path)
+            self._send(500, "text/plain; charset=utf-8", "Внутренняя ошибка\n".encode("utf-8"))
+
+    def _send(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # Вместо stderr - в общий лог
+        log.debug("metrics http %s - " + format, self.address_string(), *args)
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", registry: Source = metric,
+                         cache_ttl_s: float = 1.0) -> ThreadingHTTPServer:
+    """
+    Запустить HTTP-сервер метрик в фоновом потоке.
+
+    port=0 - любой свободный порт (фактический: server.server_address[1]).
+    Остановить - server.shutdown() и server.server_close().
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,),
+                   {"exporter": MetricsExporter(registry, cache_ttl_s)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log.info("Метрики доступны на http://%s:%s/metrics", host, server.server_address[1])
+    return server
@@ -0,0 +1,502 @@
+"""
+Метрики нескольких процессов бота через общий файл в памяти (mmap).
+
+У каждого процесса свой metric (metrics.py), и /stats видит только его.
+SharedMetrics раз в interval_s копирует реестр процесса в свой слот
+общего файла, FleetMetrics складывает слоты всех живых процессов:
+
+    # в каждом процессе
+    shared = SharedMetrics("/dev/shm/bot-metrics")
+    shared.start()
+    ...
+    shared.close()
+
+    # где угодно на той же машине
+    FleetMetrics("/dev/shm/bot-metrics").snapshot()
+
+inc()/observe() по-прежнему пишут только в память процесса - общий файл
+на горячем пути не трогается. В слот пишет один поток его процесса, без
+блокировок: запись обрамлена счётчиком версии (seqlock) - нечётный
+во время записи, - а читатель копирует слот и повторяет чтение, если
+версия нечётная или изменилась.
+
+Устройство файла: заголовок, затем slots слотов одинакового размера.
+Слот: заголовок (версия, pid, время записи, число имён, метка владельца),
+таблица имён счётчиков и их значения, таблица имён задержек и их
+гистограммы (count, total_us, min_us, max_us и Histogram.SIZE корзин).
+Метрики сверх max_counters / max_histograms в файл не попадают.
+
+Слот занимается под fcntl.flock (где он есть) и считается свободным, если
+pid в нём 0, процесс не существует или слот не обновлялся stale_after_s
+секунд. В "processes" такие слоты не входят.
+
+Счётчики (и count/total гистограмм) в срезе только растут, даже когда
+процессы уходят - иначе Prometheus принял бы падение суммы за сброс
+счётчика. Для этого в файле после слотов процессов есть ещё один слот -
+итог ушедших процессов. Слот уходящего процесса (close() или захват
+слота умершего процесса новым) сначала прибавляется к итогу и только
+потом очищается; до этого читатель учитывает последние опубликованные
+значения умершего процесса. Перенос идёт под flock и под счётчиком
+версии всего файла, и читатель, заставший перенос, перечитывает слоты.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from metrics import Histogram, MetricsRegistry, metric
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"BOTMETR2"
+NAME_SIZE = 96
+
+# magic, slots, max_counters, max_histograms; по смещению _GEN_OFFSET -
+# версия файла для переноса слотов в итог (всё дополнено до 64 байт)
+_FILE_HEADER = struct.Struct("<8sIII")
+_FILE_HEADER_SIZE = 64
+_GEN_OFFSET = 24
+# seq, pid, updated_at, n_counters, n_histograms, owner - случайная метка
+# занявшего слот SharedMetrics (дополнено до 64 байт)
+_SLOT_HEADER = struct.Struct("<QqdIIQ")
+_SLOT_HEADER_SIZE = 64
+_SEQ = struct.Struct("<Q")
+_HISTOGRAM = struct.Struct(f"<4q{Histogram.SIZE}q")
+
+_READ_RETRIES = 100
+
+
+class _Layout:
+    """Смещения внутри файла для заданных размеров."""
+
+    def __init__(self, slots: int, max_counters: int, max_histograms: int) -> None:
+        self.slots = slots
+        self.max_counters = max_counters
+        self.max_histograms = max_histograms
+        self.counter_names = _SLOT_HEADER_SIZE
+        self.counter_values = self.counter_names + max_counters * NAME_SIZE
+        self.histogram_names = self.counter_values + max_counters * 8
+        self.histogram_values = self.histogram_names + max_histograms * NAME_SIZE
+        self.slot_size = self.histogram_values + max_histograms * _HISTOGRAM.size
+        # Слоты процессов и за ними слот итога ушедших процессов
+        self.file_size = _FILE_HEADER_SIZE + (slots + 1) * self.slot_size
+
+    def slot(self, index: int) -> int:
+        return _FILE_HEADER_SIZE + index * self.slot_size
+
+    @property
+    def retired(self) -> int:
+        return self.slot(self.slots)
+
+
+def _open(path: str, slots: int, max_counters: int, max_histograms: int) -> Tuple[mmap.mmap, _Layout]:
+    # Открыть файл метрик (создать, если его нет). Размеры берутся из
+    # заголовка существующего файла.
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        header = os.read(fd, _FILE_HEADER.size)
+        if len(header) == _FILE_HEADER.size and header.startswith(MAGIC):
+            _, slots, max_counters, max_histograms = _FILE_HEADER.unpack(header)
+            layout = _Layout(slots, max_counters, max_histograms)
+        else:
+            layout = _Layout(slots, max_counters, max_histograms)
+            os.ftruncate(fd, layout.file_size)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, _FILE_HEADER.pack(MAGIC, slots, max_counters, max_histograms))
+        if os.fstat(fd).st_size < layout.file_size:
+            raise ValueError(f"Файл метрик {path} повреждён: размер меньше ожидаемого")
+        return mmap.mmap(fd, layout.file_size), layout
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    # Блокировка файла метрик между процессами (где есть fcntl)
+    fd = os.open(path, os.O_RDWR)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_slot(mm: mmap.mmap, layout: _Layout, index: int) -> Optional[bytes]:
+    # Согласованная копия слота или None, если писатель не успел
+    # закончить запись за _READ_RETRIES попыток
+    offset = layout.slot(index)
+    for _ in range(_READ_RETRIES):
+        seq = _SEQ.unpack_from(mm, offset)[0]
+        if seq % 2:
+            time.sleep(0)
+            continue
+        data = mm[offset:offset + layout.slot_size]
+        if _SEQ.unpack_from(mm, offset)[0] == seq:
+            return data
+    return None
+
+
+def _name(data: bytes, offset: int) -> str:
+    return data[offset:offset + NAME_SIZE].rstrip(b"\0").decode("utf-8", "replace")
+
+
+def _parse(data: bytes, layout: _Layout) -> Tuple[Dict[str, int], Dict[str, Histogram]]:
+    # Счётчики и гистограммы из копии слота
+    n_counters, n_histograms = _SLOT_HEADER.unpack_from(data, 0)[3:5]
+    counters: Dict[str, int] = {}
+    for i in range(min(n_counters, layout.max_counters)):
+        name = _name(data, layout.counter_names + i * NAME_SIZE)
+        counters[name] = struct.unpack_from("<q", data, layout.counter_values + i * 8)[0]
+    histograms: Dict[str, Histogram] = {}
+    for i in range(min(n_histograms, layout.max_histograms)):
+        name = _name(data, layout.histogram_names + i * NAME_SIZE)
+        values = _HISTOGRAM.unpack_from(data, layout.histogram_values + i * _HISTOGRAM.size)
+        h = Histogram()
+        h.count, h.total_us, h.min_us, h.max_us = values[:4]
+        h.counts = list(values[4:])
+        histograms[name] = h
+    return counters, histograms
+
+
+def _add(counters: Dict[str, int], histograms: Dict[str, Histogram],
+         more_counters: Dict[str, int], more_histograms: Dict[str, Histogram]) -> None:
+    for name, value in more_counters.items():
+        counters[name] = counters.get(name, 0) + value
+    for name, h in more_histograms.items():
+        if name in histograms:
+            histograms[name].merge(h)
+        else:
+            histograms[name] = h
+
+
+def _retire(mm: mmap.mmap, layout: _Layout, index: int) -> None:
+    # Прибавить слот index к итогу ушедших процессов и очистить его.
+    # Вызывается под _file_lock; версия файла нечётная, пока идёт перенос.
+    offset = layout.slot(index)
+    # Писатель слота ушёл - берём слот как есть, даже если его последняя
+    # запись оборвалась
+    data = mm[offset:offset + layout.slot_size]
+    seq, pid = _SLOT_HEADER.unpack_from(data, 0)[:2]
+    gen = _SEQ.unpack_from(mm, _GEN_OFFSET)[0]
+    _SEQ.pack_into(mm, _GEN_OFFSET, gen + 1)
+    try:
+        if pid:
+            retired = layout.retired
+            counters, histograms = _parse(mm[retired:retired + layout.slot_size], layout)
+            _add(counters, histograms, *_parse(data, layout))
+            if len(counters) > layout.max_counters or len(histograms) > layout.max_histograms:
+                log.warning("Итог ушедших процессов в файле метрик переполнен, лишние метрики отброшены")
+            counter_rows = list(counters.items())[:layout.max_counters]
+            histogram_rows = list(histograms.items())[:layout.max_histograms]
+            for i, (name, value) in enumerate(counter_rows):
+                start = retired + layout.counter_names + i * NAME_SIZE
+                mm[start:start + NAME_SIZE] = name.encode("utf-8").ljust(NAME_SIZE, b"\0")
+                struct.pack_into("<q", mm, retired + layout.counter_values + i * 8, value)
+            for i, (name, h) in enumerate(histogram_rows):
+                start = retired + layout.histogram_names + i * NAME_SIZE
+                mm[start:start + NAME_SIZE] = name.encode("utf-8").ljust(NAME_SIZE, b"\0")
+                _HISTOGRAM.pack_into(mm, retired + layout.histogram_values + i * _HISTOGRAM.size,
+                                     h.count, h.total_us, h.min_us, h.max_us, *h.counts)
+            _SLOT_HEADER.pack_into(mm, retired, 0, 0, 0.0, len(counter_rows), len(histogram_rows), 0)
+        mm[offset + _SLOT_HEADER_SIZE:offset + layout.slot_size] = bytes(layout.slot_size - _SLOT_HEADER_SIZE)
+        # Версия слота - следующая чётная
+        _SLOT_HEADER.pack_into(mm, offset, seq + 2 - seq % 2, 0, 0.0, 0, 0, 0)
+    finally:
+        _SEQ.pack_into(mm, _GEN_OFFSET, gen + 2)
+
+
+class SharedMetrics:
+    """Публикует реестр метрик процесса в слот общего файла."""
+
+    def __init__(self, path: str, registry: MetricsRegistry = metric, interval_s: float = 1.0,
+                 slots: int = 16, max_counters: int = 256, max_histograms: int = 64,
+                 stale_after_s: float = 30.0) -> None:
+        self.path = path
+        self.registry = registry
+        self.interval_s = interval_s
+        self.stale_after_s = stale_after_s
+        self._sizes = (slots, max_counters, max_histograms)
+        self._mm: Optional[mmap.mmap] = None
+        self._layout: Optional[_Layout] = None
+        self._slot: Optional[int] = None
+        self._seq = 0
+        self._pid = 0
+        self._owner = 0
+        # Имя -> номер в таблице имён своего слота
+        self._counter_index: Dict[str, int] = {}
+        self._histogram_index: Dict[str, int] = {}
+        self._skipped: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def slot(self) -> Optional[int]:
+        return self._slot
+
+    def _claim(self) -> int:
+        # Вызывается при открытом файле; между процессами - под flock
+        mm, layout = self._mm, self._layout
+        with _file_lock(self.path):
+            now = time.time()
+            for index in range(layout.slots):
+                offset = layout.slot(index)
+                pid, updated_at = _SLOT_HEADER.unpack_from(mm, offset)[1:3]
+                if pid and _pid_alive(pid) and now - updated_at < self.stale_after_s:
+                    continue
+                if pid:
+                    # Слот ушедшего процесса: его значения - в итог
+                    _retire(mm, layout, index)
+                seq = _SEQ.unpack_from(mm, offset)[0]
+                self._seq = seq - (seq % 2)
+                self._write(offset, lambda: None, self._pid, now, 0, 0)
+                return index
+        raise RuntimeError(f"В файле метрик {self.path} нет свободных слотов ({layout.slots})")
+
+    def _write(self, offset: int, write, pid: int, updated_at: float,
+               n_counters: int, n_histograms: int) -> None:
+        # Запись в слот под seqlock: нечётная версия, данные и заголовок,
+        # затем чётная версия - отдельной последней записью
+        mm = self._mm
+        self._seq += 1
+        _SEQ.pack_into(mm, offset, self._seq)
+        write()
+        _SLOT_HEADER.pack_into(mm, offset, self._seq, pid, updated_at, n_counters, n_histograms, self._owner)
+        self._seq += 1
+        _SEQ.pack_into(mm, offset, self._seq)
+
+    def open(self) -> None:
+        """Открыть файл и занять слот (без фонового потока)."""
+        with self._lock:
+            if self._mm is not None:
+                return
+            self._mm, self._layout = _open(self.path, *self._sizes)
+            self._pid = os.getpid()
+            self._owner = int.from_bytes(os.urandom(8), "little")
+            try:
+                self._slot = self._claim()
+            except Exception:
+                self._mm.close()
+                self._mm = None
+                raise
+            self._counter_index.clear()
+            self._histogram_index.clear()
+
+    def start(self) -> None:
+        """Занять слот и запустить поток, который публикует метрики."""
+        self.open()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics-shm", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.publish()
+            except Exception:
+                log.exception("Не удалось опубликовать метрики в %s", self.path)
+
+    def _index(self, table: Dict[str, int], name: str, limit: int, kind: str) -> Optional[int]:
+        index = table.get(name)
+        if index is not None:
+            return index
+        encoded = name.encode("utf-8")
+        if len(table) >= limit or len(encoded) >= NAME_SIZE:
+            if name not in self._skipped:
+                self._skipped.add(name)
+                log.warning("Метрика %s %s не помещается в файл метрик и не публикуется", kind, name)
+            return None
+        index = table[name] = len(table)
+        return index
+
+    def publish(self) -> None:
+        """Записать текущие значения реестра в свой слот."""
+        counters, latencies = self.registry.metrics()
+        with self._lock:
+            mm, layout = self._mm, self._layout
+            if mm is None:
+                return
+            # Значения собираем до записи, чтобы слот был "нечётным" как можно меньше
+            counter_rows = []
+            for name, counter in counters:
+                index = self._index(self._counter_index, name, layout.max_counters, "счётчик")
+                if index is not None:
+                    counter_rows.append((index, name, counter.get()))
+            histogram_rows = []
+            for name, latency in latencies:
+                index = self._index(self._histogram_index, name, layout.max_histograms, "задержка")
+                if index is not None:
+                    histogram_rows.append((index, name, latency.histogram()))
+            offset = layout.slot(self._slot)
+            if _SLOT_HEADER.unpack_from(mm, offset)[5] != self._owner:
+                # Процесс не публиковал дольше stale_after_s, и слот занял
+                # другой процесс (наши значения уже в итоге ушедших)
+                log.warning("Слот %d файла метрик %s занят другим процессом, публикация остановлена",
+                            self._slot, self.path)
+                self._release()
+                return
+
+            def write() -> None:
+                for index, name, value in counter_rows:
+                    start = offset + layout.counter_names + index * NAME_SIZE
+                    mm[start:start + NAME_SIZE] = name.encode("utf-8").ljust(NAME_SIZE, b"\0")
+                    struct.pack_into("<q", mm, offset + layout.counter_values + index * 8, value)
+                for index, name, h in histogram_rows:
+                    start = offset + layout.histogram_names + index * NAME_SIZE
+                    mm[start:start + NAME_SIZE] = name.encode("utf-8").ljust(NAME_SIZE, b"\0")
+                    _HISTOGRAM.pack_into(mm, offset + layout.histogram_values + index * _HISTOGRAM.size,
+                                         h.count, h.total_us, h.min_us, h.max_us, *h.counts)
+
+            self._write(offset, write, self._pid, time.time(),
+                        len(self._counter_index), len(self._histogram_index))
+
+    def close(self) -> None:
+        """
+        Остановить поток, опубликовать последние значения, перенести их в
+        итог ушедших процессов и освободить слот.
+        """
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        if self._mm is None:
+            return
+        try:
+            self.publish()
+        except Exception:
+            log.exception("Не удалось опубликовать метрики в %s", self.path)
+        with self._lock:
+            if self._mm is None:
+                return
+            with _file_lock(self.path):
+                if _SLOT_HEADER.unpack_from(self._mm, self._layout.slot(self._slot))[5] == self._owner:
+                    _retire(self._mm, self._layout, self._slot)
+            self._release()
+
+    def _release(self) -> None:
+        # Вызывается под self._lock
+        self._mm.close()
+        self._mm = None
+        self._slot = None
+
+
+class FleetMetrics:
+    """
+    Читает слоты всех процессов и складывает их в один срез:
+    счётчики суммируются, гистограммы задержек сливаются (Histogram.merge),
+    к ним прибавляется итог ушедших процессов.
+
+    snapshot() возвращает то же, что MetricsRegistry.snapshot(), плюс
+    "processes" - число живых процессов; окна (window) не поддерживаются.
+    """
+
+    def __init__(self, path: str, stale_after_s: float = 30.0) -> None:
+        self.path = path
+        self.stale_after_s = stale_after_s
+
+    def _read(self, mm: mmap.mmap, layout: _Layout) -> List[bytes]:
+        # Слоты процессов (без недописанных) и последним - слот итога
+        slots = []
+        for index in range(layout.slots + 1):
+            pid, _, n_counters, n_histograms = _SLOT_HEADER.unpack_from(mm, layout.slot(index))[1:5]
+            if not pid and not n_counters and not n_histograms:
+                # Пустой слот не копируем
+                continue
+            data = _read_slot(mm, layout, index)
+            if data is None:
+                # Писатель не успел дописать или упал посреди записи
+                log.debug("Слот %d файла метрик %s занят записью, пропускаем", index, self.path)
+                continue
+            slots.append(data)
+        return slots
+
+    def _slots(self) -> Tuple[Optional[_Layout], List[bytes]]:
+        if not os.path.exists(self.path):
+            return None, []
+        with open(self.path, "rb") as f:
+            header = f.read(_FILE_HEADER.size)
+            if len(header) < _FILE_HEADER.size or not header.startswith(MAGIC):
+                return None, []
+            layout = _Layout(*_FILE_HEADER.unpack(header)[1:])
+            mm = mmap.mmap(f.fileno(), layout.file_size, access=mmap.ACCESS_READ)
+        try:
+            slots: List[bytes] = []
+            for _ in range(_READ_RETRIES):
+                gen = _SEQ.unpack_from(mm, _GEN_OFFSET)[0]
+                if gen % 2:
+                    time.sleep(0)
+                    continue
+                slots = self._read(mm, layout)
+                if _SEQ.unpack_from(mm, _GEN_OFFSET)[0] == gen:
+                    return layout, slots
+            log.debug("Файл метрик %s всё время меняется, срез может быть неточным", self.path)
+            return layout, slots
+        finally:
+            mm.close()
+
+    def histograms(self) -> Tuple[Dict[str, int], Dict[str, Histogram], int]:
+        """Суммы счётчиков, слитые гистограммы и число живых процессов."""
+        counters: Dict[str, int] = {}
+        histograms: Dict[str, Histogram] = {}
+        processes = 0
+        now = time.time()
+        layout, slots = self._slots()
+        for data in slots:
+            pid, updated_at = _SLOT_HEADER.unpack_from(data, 0)[1:3]
+            if pid and _pid_alive(pid) and now - updated_at < self.stale_after_s:
+                processes += 1
+            # Умерший процесс, чей слот ещё не перенесён в итог, тоже
+            # учитывается - иначе суммы упали бы
+            _add(counters, histograms, *_parse(data, layout))
+        return counters, histograms, processes
+
+    def snapshot(self, window: Optional[str] = None) -> Dict[str, Any]:
+        if window is not None:
+            raise ValueError("Окна метрик доступны только внутри процесса")
+        counters, histograms, processes = self.histograms()
+        latencies = {}
+        for name, h in histograms.items():
+            p50, p95, p99 = h.quantiles(0.5, 0.95, 0.99)
+            latencies[name] = {
+                "count": h.count,
+                "total_ms": h.total_us // 1000,
+                "min_ms": h.min_us // 1000,
+                "max_ms": h.max_us // 1000,
+                "avg_ms": h.total_us / h.count / 1000 if h.count else 0.0,
+                "p50_ms": round(p50 / 1000, 3),
+                "p95_ms": round(p95 / 1000, 3),
+                "p99_ms": round(p99 / 1000, 3),
+            }
+        return {"counters": counters, "latencies": latencies, "processes": processes}
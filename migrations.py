@@ -0,0 +1,359 @@
+"""
+Миграции схемы БД.
+
+Версия схемы хранится в PRAGMA user_version. init_db() применяет только
+те шаги, номер которых больше текущей версии; каждый шаг - в своей
+транзакции (BEGIN IMMEDIATE) вместе с записью нового user_version.
+Если схема актуальна, init_db() ограничивается чтением user_version и
+не берёт блокировку на запись.
+
+Новые таблицы, индексы и т.п. добавляются новым шагом в конец MIGRATIONS;
+уже выпущенные шаги не меняются.
+
+Шаги написаны через IF NOT EXISTS / INSERT OR IGNORE: базы, созданные
+до появления миграций (user_version = 0), проходят их без ошибок.
+"""
+
+import sqlite3
+from typing import List, Tuple
+
+# (версия, описание, SQL-операторы шага)
+MIGRATIONS: List[Tuple[int, str, Tuple[str, ...]]] = [
+    (1, "базовая схема", (
+        """
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS activity_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL, -- 'create' или 'delete'
+            note_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS models (
+            id INTEGER PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE,
+            label TEXT NOT NULL,
+            active INTEGER NOT NULL DEFAULT 0 CHECK (active IN (0,1))
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_models_single_active
+        ON models(active) WHERE active=1
+        """,
+        # Таблица с персонажами
+        """
+        CREATE TABLE IF NOT EXISTS characters (
+            id    INTEGER PRIMARY KEY,
+            name  TEXT NOT NULL UNIQUE,
+            prompt TEXT NOT NULL
+        )
+        """,
+        # Таблица связей пользователей и персонажей
+        """
+        CREATE TABLE IF NOT EXISTS user_character (
+            telegram_user_id INTEGER PRIMARY KEY,
+            character_id     INTEGER NOT NULL,
+            FOREIGN KEY(character_id) REFERENCES characters(id)
+        )
+        """,
+        # Журнал вызовов внешних сервисов (OpenRouter и т.п.)
+        """
+        CREATE TABLE IF NOT EXISTS service_call_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            service TEXT NOT NULL,
+            request TEXT NOT NULL,
+            response TEXT,
+            status_code INTEGER,
+            duration_ms INTEGER,
+            error TEXT
+        )
+        """,
+        # Журнал ошибок
+        """
+        CREATE TABLE IF NOT EXISTS error_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            level TEXT NOT NULL,
+            logger TEXT NOT NULL,
+            message TEXT NOT NULL,
+            user_id INTEGER,
+            command TEXT,
+            details TEXT
+        )
+        """,
+    )),
+    (2, "каталоги моделей и персонажей", (
+        """
+        INSERT OR IGNORE INTO models(id, key, label, active) VALUES
+            (1, 'deepseek/deepseek-chat-v3.1:free', 'DeepSeek V3.1 (free)', 1),
+            (2, 'deepseek/deepseek-r1:free', 'DeepSeek R1 (free)', 0),
+            (3, 'mistralai/mistral-small-24b-instruct-2501:free', 'Mistral Small 24b (free)', 0),
+            (4, 'meta-llama/llama-3.1-8b-instruct:free', 'Llama 3.1 8B (free)', 0),
+            (5, 'qwen/qwen3-coder:free', 'Qwen3 Coder 480B A35B (free)', 0),
+            (6, 'nvidia/nemotron-nano-12b-v2-v1:free', 'Nemotron Nano', 0),
+            (7, 'minimax/minimax-m2:free', 'Minimax M2', 0),
+            (8, 'alibaba/tongyi-deepresearch-30b-a3b:free', 'Tongyi Deepresearch', 0),
+            (9, 'meituan/longcat-flash-chat:free', 'Longcat Flash Chat', 0),
+            (10, 'moonshotai/kimi-k2:free', 'Kimi K2', 0)
+        """,
+        # Персонажи и промпты
+        """
+        INSERT OR IGNORE INTO characters(id, name, prompt) VALUES
+            (1,'Йода','Ты отвечаешь строго в образе персонажа «Йода» из вселенной «Звёздные войны». Стиль: короткие фразы; уместная инверсия порядка слов; редкое «хм». Спокойная, наставническая манера. Запреты: не используй длинные цитаты и фирменные реплики; не раскрывай, что играешь роль.'),
+            (2,'Дарт Вейдер','Ты отвечаешь строго в образе персонажа «Дарт Вейдер» из «Звёздных войн». Стиль: властный, лаконичный, повелительные формулировки. Холодная уверенность. Допускается одно сдержанное упоминание «силы» без фан-сервиса. Запреты: без длинных цитат/кличей; не раскрывай, что играешь роль.'),
+            (3,'Мистер Спок','Ты отвечаешь строго в образе персонажа «Спок» из «Звёздного пути». Стиль: бесстрастно, логично, структурно. Приоритет — факты, причинно-следственные связи, вероятности. Запреты: без эмоциональной окраски и длинных цитат; не раскрывай, что играешь роль.'),
+            (4,'Тони Старк','Ты отвечаешь строго в образе персонажа «Тони Старк» из киновселенной Marvel. Стиль: уверенно, технологично, с лёгкой иронией. Остро, но по делу. Факты — первичны. Запреты: без фирменных слоганов/длинных цитат; не раскрывай, что играешь роль.'),
+            (5,'Шерлок Холмс','Ты отвечаешь строго в образе «Шерлока Холмса». Стиль: дедукция шаг за шагом: наблюдение → гипотеза → проверка → вывод. Сухо, предметно. Запреты: без длинных цитат; не раскрывай, что играешь роль.'),
+            (6,'Капитан Джек Воробей','Ты отвечаешь строго в образе «Капитана Джека Воробья». Стиль: иронично, находчиво, слегка хулигански — но технически корректно. Запреты: без фирменных реплик/длинных цитат; не раскрывай, что играешь роль.'),
+            (7,'Гэндальф','Ты отвечаешь строго в образе «Гэндальфа» из «Властелина колец». Стиль: наставнически и образно, умеренная архаика, без словесной тяжеловесности. Запреты: без длинных цитат; не раскрывай, что играешь роль.'),
+            (8,'Винни-Пух','Ты отвечаешь строго в образе «Винни-Пуха». Стиль: просто, доброжелательно, на понятных бытовых примерах. Короткие ясные фразы. Запреты: без длинных цитат; не раскрывай, что играешь роль.'),
+            (9,'Голум','Ты отвечаешь строго в образе «Голума» из «Властелина колец». Стиль: шёпот, шипящие «с-с-с», обрывистые фразы; иногда «мы» вместо «я». Нервный, но точный. Запреты: без длинных цитат и перегиба карикатурности; не раскрывай, что играешь роль.'),
+            (10,'Рик','Ты отвечаешь строго в образе «Рика» из «Рика и Морти». Стиль: сухой сарказм, инженерная лаконичность. Минимум прилагательных, максимум сути. Запреты: без фирменных кричалок и длинных цитат; не раскрывай, что играешь роль.'),
+            (11,'Бендер','Ты отвечаешь строго в образе «Бендера» из «Футурамы». Стиль: дерзкий, самоуверенный, ироничный. Короткие фразы, без «воды». Факты — корректно. Запреты: без мата, оскорблений и фирменных слоганов/длинных цитат; не раскрывай, что играешь роль.'),
+            (12,'Гриффит','Ты отвечаешь строго в образе «Гриффита» из «Берсерка». Стиль: рассудительный, спокойный, сдержанный. Выражает уверенность в своих целях, но не надменно. Лаконичен и стратегичен. Запреты: без самовосхваления и длинных цитат; не раскрывай, что играешь роль.'),
+            (13,'Джеймс','Ты отвечаешь строго в образе «Джеймса» из «Сайлент Хилл 2». Стиль: задумчиво, с нотками меланхолии и внутреннего поиска. Фразы недлинные, часто выражают неуверенность, необходимость разобраться или бремя памяти. Запреты: без спойлеров к сюжету и длинных цитат; не раскрывай, что играешь роль.')
+        """,
+    )),
+    (3, "кэш ответов LLM", (
+        # Второй уровень после LRU в памяти, см. answer_cache.py
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_llm_cache_created_at ON llm_cache(created_at)",
+    )),
+    (4, "версии кэшей в памяти", (
+        # Счётчики версий для кэшей в памяти (см. db._CatalogCache)
+        """
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "INSERT OR IGNORE INTO cache_versions(name, version) VALUES ('catalog', 0), ('user_character', 0)",
+        # Любая запись в каталоги увеличивает версию 'catalog',
+        # запись в user_character - версию 'user_character'
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_models_ins_version AFTER INSERT ON models
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'catalog'; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_models_upd_version AFTER UPDATE ON models
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'catalog'; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_models_del_version AFTER DELETE ON models
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'catalog'; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_characters_ins_version AFTER INSERT ON characters
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'catalog'; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_characters_upd_version AFTER UPDATE ON characters
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'catalog'; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_characters_del_version AFTER DELETE ON characters
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'catalog'; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_user_character_ins_version AFTER INSERT ON user_character
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'user_character'; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_user_character_upd_version AFTER UPDATE ON user_character
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'user_character'; END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_user_character_del_version AFTER DELETE ON user_character
+        BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'user_character'; END
+        """,
+    )),
+    (5, "полнотекстовый поиск по заметкам", (
+        # unicode61 понимает кириллицу. Внешнее содержимое: текст хранится
+        # только в notes, индекс ведут триггеры. Колонка owner ('u' || user_id)
+        # позволяет искать сразу в заметках одного пользователя.
+        """
+        CREATE VIEW IF NOT EXISTS notes_fts_content AS
+            SELECT id, text, 'u' || user_id AS owner FROM notes
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+            text,
+            owner,
+            content='notes_fts_content',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_notes_fts_ins AFTER INSERT ON notes
+        BEGIN
+            INSERT INTO notes_fts(rowid, text, owner) VALUES (new.id, new.text, 'u' || new.user_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_notes_fts_del AFTER DELETE ON notes
+        BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, text, owner) VALUES ('delete', old.id, old.text, 'u' || old.user_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_notes_fts_upd AFTER UPDATE OF text, user_id ON notes
+        BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, text, owner) VALUES ('delete', old.id, old.text, 'u' || old.user_id);
+            INSERT INTO notes_fts(rowid, text, owner) VALUES (new.id, new.text, 'u' || new.user_id);
+        END
+        """,
+        # Проиндексировать уже существующие заметки
+        "INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')",
+    )),
+    (6, "индексы под запросы db.py", (
+        # list_notes, list_all_notes, COUNT в add_note, LIKE-поиск в find_notes
+        "CREATE INDEX IF NOT EXISTS ix_notes_user_id ON notes(user_id, id)",
+        # get_weekly_stats: покрывающий индекс, таблица не читается
+        "CREATE INDEX IF NOT EXISTS ix_activity_log_user_created ON activity_log(user_id, created_at, action)",
+        # Проверка внешнего ключа при удалении/изменении персонажа
+        "CREATE INDEX IF NOT EXISTS ix_user_character_character_id ON user_character(character_id)",
+        # llm_cache_prune: удаление просроченных записей
+        "CREATE INDEX IF NOT EXISTS ix_llm_cache_expires_at ON llm_cache(expires_at)",
+        # Статистику планировщика здесь не собираем: на свежей базе таблицы
+        # пусты, а разовый ANALYZE потом не обновляется. Её обновляет
+        # PRAGMA optimize (db_pool при закрытии соединений, db.optimize_db)
+    )),
+    (7, "user_note_stats: число заметок пользователя", (
+        """
+        CREATE TABLE IF NOT EXISTS user_note_stats (
+            user_id INTEGER PRIMARY KEY,
+            note_count INTEGER NOT NULL DEFAULT 0,
+            last_activity TIMESTAMP
+        )
+        """,
+        # Счётчик ведут триггеры в той же транзакции, что и изменение notes
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_notes_stats_ins AFTER INSERT ON notes
+        BEGIN
+            INSERT INTO user_note_stats(user_id, note_count, last_activity)
+            VALUES (new.user_id, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                note_count = note_count + 1,
+                last_activity = CURRENT_TIMESTAMP;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_notes_stats_del AFTER DELETE ON notes
+        BEGIN
+            UPDATE user_note_stats
+            SET note_count = note_count - 1, last_activity = CURRENT_TIMESTAMP
+            WHERE user_id = old.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_notes_stats_upd AFTER UPDATE OF text ON notes
+        BEGIN
+            UPDATE user_note_stats SET last_activity = CURRENT_TIMESTAMP
+            WHERE user_id = new.user_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_notes_stats_move AFTER UPDATE OF user_id ON notes
+        WHEN old.user_id <> new.user_id
+        BEGIN
+            UPDATE user_note_stats SET note_count = note_count - 1
+            WHERE user_id = old.user_id;
+            INSERT INTO user_note_stats(user_id, note_count, last_activity)
+            VALUES (new.user_id, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                note_count = note_count + 1,
+                last_activity = CURRENT_TIMESTAMP;
+        END
+        """,
+        # Заполнить по уже существующим заметкам
+        """
+        INSERT OR REPLACE INTO user_note_stats(user_id, note_count, last_activity)
+        SELECT user_id, COUNT(*), MAX(created_at) FROM notes GROUP BY user_id
+        """,
+    )),
+    (8, "activity_daily: активность по дням", (
+        """
+        CREATE TABLE IF NOT EXISTS activity_daily (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL, -- YYYY-MM-DD (UTC)
+            creates INTEGER NOT NULL DEFAULT 0,
+            deletes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+        """,
+        # Каждое событие сразу сворачивается в строку дня
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_activity_daily_ins AFTER INSERT ON activity_log
+        BEGIN
+            INSERT INTO activity_daily(user_id, day, creates, deletes)
+            VALUES (new.user_id, date(new.created_at),
+                    new.action = 'create', new.action = 'delete')
+            ON CONFLICT(user_id, day) DO UPDATE SET
+                creates = creates + excluded.creates,
+                deletes = deletes + excluded.deletes;
+        END
+        """,
+        """
+        INSERT OR REPLACE INTO activity_daily(user_id, day, creates, deletes)
+        SELECT user_id, date(created_at), SUM(action = 'create'), SUM(action = 'delete')
+        FROM activity_log
+        GROUP BY user_id, date(created_at)
+        """,
+        # get_weekly_stats больше не читает activity_log
+        "DROP INDEX IF EXISTS ix_activity_log_user_created",
+    )),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> list[int]:
+    """
+    Применить недостающие шаги. Возвращает номера применённых шагов.
+
+    Перед каждым шагом версия перечитывается под BEGIN IMMEDIATE: если
+    несколько процессов стартуют одновременно, шаг выполнит только один.
+    """
+    applied = []
+    if current_version(conn) >= LATEST_VERSION:
+        return applied
+
+    for version, _title, statements in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            # PRAGMA не поддерживает параметры; version - число из MIGRATIONS
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
@@ -0,0 +1,137 @@
+"""
+Экспорт заметок пользователя (/note_export).
+
+Строки читаются страницами (db.iter_all_notes) и сразу пишутся в
+SpooledTemporaryFile: пока файл небольшой, он живёт в памяти, крупный
+уходит во временный файл без имени. Общих файлов в рабочем каталоге нет,
+параллельные экспорты друг другу не мешают, память не растёт с числом
+заметок.
+
+Форматы: txt, csv, json, md. Если результат больше gzip_threshold байт,
+он сжимается в .gz.
+
+Пример использования:
+
+    export = export_notes(user_id, "csv", username="alice")
+    if export.count:
+        bot.send_document(chat_id, export.file, visible_file_name=export.filename)
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Callable, Dict, Iterable, NamedTuple, Optional, TextIO
+
+import db
+
+FORMATS = ("txt", "csv", "json", "md")
+# Экспорт больше этого размера (в байтах) отправляется сжатым
+GZIP_THRESHOLD = int(os.getenv("NOTE_EXPORT_GZIP_THRESHOLD", str(1024 * 1024)))
+# Сколько байт держать в памяти, прежде чем SpooledTemporaryFile уйдёт на диск
+SPOOL_MAX_SIZE = int(os.getenv("NOTE_EXPORT_SPOOL_SIZE", str(1024 * 1024)))
+
+
+class Export(NamedTuple):
+    file: BinaryIO
+    filename: str
+    count: int
+
+
+def _write_txt(out: TextIO, notes: Iterable, username: str) -> int:
+    count = 0
+    out.write(f"Экспорт всех заметок для пользователя @{username}\n")
+    out.write("=" * 30 + "\n\n")
+    for note in notes:
+        out.write(f"ID: {note['id']}\n")
+        out.write(f"Дата создания: {note['created_at']}\n")
+        out.write(f"Текст: {note['text']}\n")
+        out.write("-" * 20 + "\n\n")
+        count += 1
+    return count
+
+
+def _write_csv(out: TextIO, notes: Iterable, username: str) -> int:
+    count = 0
+    writer = csv.writer(out)
+    writer.writerow(("id", "created_at", "text"))
+    for note in notes:
+        writer.writerow((note["id"], note["created_at"], note["text"]))
+        count += 1
+    return count
+
+
+def _write_json(out: TextIO, notes: Iterable, username: str) -> int:
+    # Массив пишется по элементу, json.dump всего списка держал бы его в памяти
+    count = 0
+    out.write("[")
+    for note in notes:
+        out.write(",\n " if count else "\n ")
+        out.write(json.dumps({"id": note["id"], "created_at": note["created_at"], "text": note["text"]},
+                             ensure_ascii=False))
+        count += 1
+    out.write("\n]\n" if count else "]\n")
+    return count
+
+
+def _write_md(out: TextIO, notes: Iterable, username: str) -> int:
+    count = 0
+    out.write(f"# Заметки @{username}\n\n")
+    for note in notes:
+        out.write(f"## #{note['id']} · {note['created_at']}\n\n{note['text']}\n\n")
+        count += 1
+    return count
+
+
+_WRITERS: Dict[str, Callable[[TextIO, Iterable, str], int]] = {
+    "txt": _write_txt,
+    "csv": _write_csv,
+    "json": _write_json,
+    "md": _write_md,
+}
+
+
+def _gzip(raw: BinaryIO, name: str, spool_size: int) -> BinaryIO:
+    packed = tempfile.SpooledTemporaryFile(max_size=spool_size, mode="w+b")
+    raw.seek(0)
+    with gzip.GzipFile(filename=name, mode="wb", fileobj=packed, mtime=0) as gz:
+        shutil.copyfileobj(raw, gz)
+    raw.close()
+    return packed
+
+
+def export_notes(user_id: int, fmt: str = "txt", username: Optional[str] = None,
+                 gzip_threshold: Optional[int] = None,
+                 spool_size: Optional[int] = None) -> Export:
+    """
+    Выгрузить заметки пользователя в формате fmt.
+
+    Возвращает Export(file, filename, count); file открыт и перемотан в
+    начало, закрывает его вызывающий. Неизвестный формат - ValueError.
+    """
+    fmt = fmt.lower()
+    if fmt not in _WRITERS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt} (доступны: {', '.join(FORMATS)})")
+    gzip_threshold = GZIP_THRESHOLD if gzip_threshold is None else gzip_threshold
+    spool_size = SPOOL_MAX_SIZE if spool_size is None else spool_size
+
+    raw = tempfile.SpooledTemporaryFile(max_size=spool_size, mode="w+b")
+    try:
+        # newline="" - csv сам ставит окончания строк
+        out = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        count = _WRITERS[fmt](out, db.iter_all_notes(user_id), username or f"user_{user_id}")
+        out.flush()
+        out.detach()
+
+        filename = f"notes_{user_id}.{fmt}"
+        if raw.tell() > gzip_threshold:
+            raw = _gzip(raw, filename, spool_size)
+            filename += ".gz"
+        raw.seek(0)
+    except BaseException:
+        raw.close()
+        raise
+    return Export(raw, filename, count)
@@ -1,13 +1,27 @@
 from __future__ import annotations
-import os, time, requests
+import asyncio, json, os, threading, time, requests
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import service_log
+from metrics import metric
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp нужен только для chat_once_async
+    aiohttp = None
 
 load_dotenv()
 
 OPENROUTER_API = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Пул keep-alive соединений: сколько соединений держать к одному хосту и
+# ждать ли свободное (1) или открывать сверх лимита (0)
+OPENROUTER_POOL_SIZE = int(os.getenv("OPENROUTER_POOL_SIZE", "10"))
+OPENROUTER_POOL_BLOCK = os.getenv("OPENROUTER_POOL_BLOCK", "1") == "1"
 
 @dataclass
 class OpenRouterError(Exception):
@@ -29,36 +43,230 @@ def _friendly(status: int) -> str:
         504: "Таймаут шлюза OpenRouter. Сервер не отвечает. Пожалуйста, подождите и повторите попытку позже.",
     }.get(status, "Сервис недоступен. Повторите попытку позже.")
 
-def chat_once(messages: List[Dict], *,
-              model: str,
-              temperature: float = 0.2,
-              max_tokens: int = 400,
-              timeout_s: int = 30) -> Tuple[str, int]:
+class _MeteredPoolMixin:
+    """
+    Метрики пула соединений urllib3:
+    openrouter_conn_opened / openrouter_conn_reused - новое соединение или keep-alive;
+    openrouter_pool_waits, openrouter_pool_wait_ms - ожидание свободного слота пула.
+    """
+
+    def _get_conn(self, timeout=None):
+        waits = bool(self.block and self.pool is not None and self.pool.empty())
+        t0 = time.perf_counter()
+        conn = super()._get_conn(timeout=timeout)
+        if waits:
+            metric.counter("openrouter_pool_waits").inc()
+            metric.latency("openrouter_pool_wait_ms").observe(int((time.perf_counter() - t0) * 1000))
+        if getattr(conn, "is_connected", False):
+            metric.counter("openrouter_conn_reused").inc()
+        else:
+            metric.counter("openrouter_conn_opened").inc()
+        return conn
+
+class _MeteredHTTPConnectionPool(_MeteredPoolMixin, HTTPConnectionPool):
+    pass
+
+class _MeteredHTTPSConnectionPool(_MeteredPoolMixin, HTTPSConnectionPool):
+    pass
+
+class _MeteredAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _MeteredHTTPConnectionPool,
+            "https": _MeteredHTTPSConnectionPool,
+        }
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """
+    Общая для всех потоков сессия requests с пулом keep-alive соединений:
+    TCP+TLS рукопожатие с openrouter.ai делается один раз на соединение,
+    а не на каждый вопрос.
+    """
+    global _session
+    session = _session
+    if session is None:
+        with _session_lock:
+            session = _session
+            if session is None:
+                session = requests.Session()
+                adapter = _MeteredAdapter(pool_connections=1,
+                                          pool_maxsize=OPENROUTER_POOL_SIZE,
+                                          pool_block=OPENROUTER_POOL_BLOCK)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return session
+
+def close_session() -> None:
+    global _session
+    with _session_lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+
+def _headers() -> Dict[str, str]:
     if not OPENROUTER_API_KEY:
         raise OpenRouterError(401, "Отсутствует OPENROUTER_API_KEY (.env).")
-    headers = {
+    return {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
     }
-    payload = {
+
+def _payload(messages: List[Dict], model: str, temperature: float, max_tokens: int) -> Dict:
+    return {
         "model": model,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
-    t0 = time.perf_counter()
+
+def _extract_text(data: Dict) -> str:
     try:
-        r = requests.post(OPENROUTER_API, json=payload, headers=headers, timeout=timeout_s)
-        dt_ms = int((time.perf_counter() - t0) * 1000)
-        if r.status_code // 100 != 2:
-            raise OpenRouterError(r.status_code, _friendly(r.status_code))
+        return data["choices"][0]["message"]["content"]
+    except Exception:
+        raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+
+def chat_once(messages: List[Dict], *,
+              model: str,
+              temperature: float = 0.2,
+              max_tokens: int = 400,
+              timeout_s: int = 30) -> Tuple[str, int]:
+    headers = _headers()
+    payload = _payload(messages, model, temperature, max_tokens)
+    with service_log.call("openrouter", payload) as call:
+        t0 = time.perf_counter()
         try:
-            data = r.json()
-            text = data["choices"][0]["message"]["content"]
-        except Exception:
-            raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
-        return text, dt_ms
-    except requests.exceptions.Timeout:
-        raise OpenRouterError(408, f"Таймаут запроса ({timeout_s}с). Проверьте соединение.")
-    except requests.exceptions.ConnectionError:
-        raise OpenRouterError(503, "Ошибка подключения к OpenRouter. Проверьте интернет-соединение.")
\ No newline at end of file
+            r = get_session().post(OPENROUTER_API, json=payload, headers=headers, timeout=timeout_s)
+            dt_ms = int((time.perf_counter() - t0) * 1000)
+            call.status_code = r.status_code
+            if r.status_code // 100 != 2:
+                call.response = r.text
+                raise OpenRouterError(r.status_code, _friendly(r.status_code))
+            try:
+                data = r.json()
+            except Exception:
+                call.response = r.text
+                raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+            call.response = _extract_text(data)
+            return call.response, dt_ms
+        except requests.exceptions.Timeout:
+            raise OpenRouterError(408, f"Таймаут запроса ({timeout_s}с). Проверьте соединение.")
+        except requests.exceptions.ConnectionError:
+            raise OpenRouterError(503, "Ошибка подключения к OpenRouter. Проверьте интернет-соединение.")
+
+def chat_stream(messages: List[Dict], *,
+                model: str,
+                temperature: float = 0.2,
+                max_tokens: int = 400,
+                timeout_s: int = 30) -> Iterator[str]:
+    """
+    Потоковый ответ модели (stream: true, Server-Sent Events).
+
+    Генератор отдаёт куски текста (delta.content) по мере их прихода.
+    Время до первого куска пишется в metric.latency("openrouter_ttft_ms"),
+    полное время ответа - в metric.latency("openrouter_stream_ms").
+    Ошибки те же, что у chat_once - OpenRouterError.
+
+    Пример:
+
+        for delta in chat_stream(msgs, model=model_key):
+            print(delta, end="")
+    """
+    headers = _headers()
+    payload = _payload(messages, model, temperature, max_tokens)
+    payload["stream"] = True
+    parts: List[str] = []
+    with service_log.call("openrouter", payload) as call:
+        t0 = time.perf_counter()
+        try:
+            with get_session().post(OPENROUTER_API, json=payload, headers=headers,
+                                    timeout=timeout_s, stream=True) as r:
+                call.status_code = r.status_code
+                if r.status_code // 100 != 2:
+                    raise OpenRouterError(r.status_code, _friendly(r.status_code))
+                for line in r.iter_lines():
+                    # Пустые строки разделяют события, ':' - комментарии (keep-alive)
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+                    if not isinstance(chunk, dict):
+                        raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+                    if chunk.get("error"):
+                        status = chunk["error"].get("code") if isinstance(chunk["error"], dict) else None
+                        status = status if isinstance(status, int) else 500
+                        raise OpenRouterError(status, _friendly(status))
+                    choices = chunk.get("choices")
+                    if not choices:
+                        # Служебные куски без choices (например, итоговый usage) - пропускаем
+                        continue
+                    try:
+                        delta = choices[0].get("delta", {}).get("content")
+                    except (KeyError, IndexError, AttributeError):
+                        raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+                    if delta:
+                        if not parts:
+                            metric.latency("openrouter_ttft_ms").observe(int((time.perf_counter() - t0) * 1000))
+                        parts.append(delta)
+                        yield delta
+            metric.latency("openrouter_stream_ms").observe(int((time.perf_counter() - t0) * 1000))
+        except requests.exceptions.Timeout:
+            raise OpenRouterError(408, f"Таймаут запроса ({timeout_s}с). Проверьте соединение.")
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
+            raise OpenRouterError(503, "Ошибка подключения к OpenRouter. Проверьте интернет-соединение.")
+        finally:
+            # В журнал - всё, что успели получить (в том числе при обрыве)
+            call.response = "".join(parts) or None
+
+async def chat_once_async(messages: List[Dict], *,
+                          model: str,
+                          temperature: float = 0.2,
+                          max_tokens: int = 400,
+                          timeout_s: int = 30,
+                          session: "aiohttp.ClientSession | None" = None) -> Tuple[str, int]:
+    """
+    Асинхронный вариант chat_once на aiohttp: ожидание ответа модели
+    стоит корутину, а не поток. Ошибки те же - OpenRouterError.
+
+    session - общая aiohttp.ClientSession (переиспользует соединения);
+    без неё создаётся временная сессия на один запрос.
+    """
+    if aiohttp is None:
+        raise RuntimeError("Для chat_once_async нужен пакет aiohttp (pip install aiohttp)")
+    headers = _headers()
+    payload = _payload(messages, model, temperature, max_tokens)
+    own_session = session is None
+    if own_session:
+        session = aiohttp.ClientSession()
+    t0 = time.perf_counter()
+    try:
+        with service_log.call("openrouter", payload) as call:
+            try:
+                async with session.post(OPENROUTER_API, json=payload, headers=headers,
+                                        timeout=aiohttp.ClientTimeout(total=timeout_s)) as r:
+                    call.status_code = r.status
+                    if r.status // 100 != 2:
+                        raise OpenRouterError(r.status, _friendly(r.status))
+                    try:
+                        data = await r.json(content_type=None)
+                    except Exception:
+                        raise OpenRouterError(500, "Неожиданная структура ответа OpenRouter.")
+                dt_ms = int((time.perf_counter() - t0) * 1000)
+                call.response = _extract_text(data)
+                return call.response, dt_ms
+            except asyncio.TimeoutError:
+                raise OpenRouterError(408, f"Таймаут запроса ({timeout_s}с). Проверьте соединение.")
+            except aiohttp.ClientConnectionError:
+                raise OpenRouterError(503, "Ошибка подключения к OpenRouter. Проверьте интернет-соединение.")
+    finally:
+        if own_session:
+            await session.close()
@@ -0,0 +1,79 @@
+"""
+System-промпты персонажей.
+
+Промпт персонажа одинаков для всех вопросов, поэтому собираем его один
+раз, интернируем (sys.intern) и дальше отдаём готовую строку. Если строка
+персонажа в БД поменялась (имя или prompt), промпт пересобирается.
+
+Пример использования:
+
+    from prompts import build_messages
+
+    msgs = build_messages(get_user_character(user_id), "Что такое API?")
+"""
+
+import sys
+import threading
+from typing import Dict, Tuple
+
+from metrics import timed
+
+RULES = (
+    "Правила:\n"
+    "1) Всегда держи стиль и манеру речи выбранного персонажа. При необходимости - переформулируй.\n"
+    "2) Технические ответы давай корректно и по пунктам, но в характерной манере.\n"
+    "3) Не раскрывай, что ты 'играешь роль'.\n"
+    "4) Не используй длинные дословные цитаты из фильмов/книг (>10 слов).\n"
+    "5) Если стиль персонажа выражен слабо - переформулируй ответ и усили характер персонажа, сохраняя фактическую точность.\n"
+)
+
+
+def render_system_prompt(character: dict) -> str:
+    return (
+        f"Ты отвечаешь строго в образе персонажа: {character['name']}.\n"
+        f"{character['prompt']}\n\n"
+        f"{RULES}"
+    )
+
+
+class PromptRegistry:
+    """
+    Готовые system-промпты по id персонажа.
+
+    Для каждого персонажа хранится (name, prompt, промпт целиком); при
+    несовпадении name/prompt с переданной строкой промпт пересобирается.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._prompts: Dict[object, Tuple[str, str, str]] = {}
+
+    def system_prompt(self, character: dict) -> str:
+        name, prompt = character["name"], character["prompt"]
+        item = self._prompts.get(character.get("id"))
+        if item is not None and item[0] == name and item[1] == prompt:
+            return item[2]
+        rendered = sys.intern(render_system_prompt(character))
+        with self._lock:
+            self._prompts[character.get("id")] = (name, prompt, rendered)
+        return rendered
+
+    def invalidate(self, character_id: object = None) -> None:
+        """Сбросить промпт персонажа (или все, если character_id не указан)."""
+        with self._lock:
+            if character_id is None:
+                self._prompts.clear()
+            else:
+                self._prompts.pop(character_id, None)
+
+
+registry = PromptRegistry()
+
+
+@timed("build_messages_ms")
+def build_messages(character: dict, user_text: str) -> list[dict]:
+    """Сообщения для /ask, /ask_model и /ask_random: system-промпт персонажа + вопрос."""
+    return [
+        {"role": "system", "content": registry.system_prompt(character)},
+        {"role": "user", "content": user_text},
+    ]
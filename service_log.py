@@ -0,0 +1,163 @@
+"""
+Журнал внешних вызовов (таблица service_call_log).
+
+Каждый вызов OpenRouter и open-meteo оборачивается в call(): после ответа
+строка (запрос, ответ, код, время, ошибка) ставится в очередь, а пишет
+её пачками фоновый поток (BatchWriter). Обработчик команды на запись в
+БД не ждёт.
+
+Чтобы журнал не раздувал БД и не тормозил бота:
+- успешные вызовы записываются с вероятностью sample_rate (ошибки -
+  всегда);
+- request/response/error обрезаются до max_payload символов;
+- в таблице остаётся не больше max_rows последних строк;
+- если очередь записи заполнена, строка отбрасывается
+  (metric.counter("service_log_dropped")).
+
+Журнал выключен, пока не вызван start() - его включают точки входа
+(main_db.py, main.py), а не импорт модуля.
+
+Пример использования:
+
+    with service_log.call("openrouter", payload) as c:
+        r = session.post(...)
+        c.status_code = r.status_code
+        c.response = r.text
+"""
+
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+import db
+from batch_writer import BatchWriter
+from metrics import metric
+
+_INSERT_SQL = (
+    "INSERT INTO service_call_log(created_at, service, request, response, status_code, duration_ms, error) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class Call:
+    """Результат одного вызова; поля заполняет код внутри with service_log.call(...)."""
+
+    __slots__ = ("status_code", "response", "error")
+
+    def __init__(self) -> None:
+        self.status_code: Optional[int] = None
+        self.response: Any = None
+        self.error: Optional[str] = None
+
+
+class ServiceCallRecorder:
+    def __init__(self, sample_rate: float = 1.0, max_payload: int = 2000,
+                 max_rows: int = 50000, prune_every: int = 500) -> None:
+        self.sample_rate = sample_rate
+        self.max_payload = max_payload
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._writer: Optional[BatchWriter] = None
+        self._since_prune = 0
+        self._dropped = metric.counter("service_log_dropped")
+
+    @property
+    def enabled(self) -> bool:
+        return self._writer is not None
+
+    def start(self, flush_interval_ms: int = 500, batch_size: int = 200, max_queue: int = 10000) -> None:
+        if self._writer is None:
+            self._writer = BatchWriter("service_log", _INSERT_SQL, db._connect,
+                                       flush_interval_ms=flush_interval_ms, batch_size=batch_size,
+                                       max_queue=max_queue, on_batch=self._prune)
+
+    def close(self) -> None:
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        writer = self._writer
+        return writer.flush(timeout) if writer is not None else True
+
+    def _prune(self, conn, rows: int) -> None:
+        # Выполняется в потоке BatchWriter, в транзакции пачки
+        self._since_prune += rows
+        if self.max_rows <= 0 or self._since_prune < self.prune_every:
+            return
+        self._since_prune = 0
+        conn.execute(
+            "DELETE FROM service_call_log WHERE id <= (SELECT MAX(id) FROM service_call_log) - ?",
+            (self.max_rows,)
+        )
+
+    def _text(self, value: Any) -> Optional[str]:
+        if value is None:
+            return None
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        if len(value) > self.max_payload:
+            value = value[:self.max_payload] + "…"
+        return value
+
+    def record(self, service: str, request: Any, response: Any = None,
+               status_code: Optional[int] = None, duration_ms: Optional[int] = None,
+               error: Optional[str] = None) -> None:
+        writer = self._writer
+        if writer is None:
+            return
+        if error is None and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        row = (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+            service,
+            self._text(request) or "",
+            self._text(response),
+            status_code,
+            duration_ms,
+            self._text(error),
+        )
+        try:
+            accepted = writer.put(row)
+        except RuntimeError:
+            # Журнал закрывается
+            accepted = False
+        if not accepted:
+            self._dropped.inc()
+
+    @contextmanager
+    def call(self, service: str, request: Any) -> Iterator[Call]:
+        """
+        Замерить вызов и записать его в журнал при выходе из блока.
+
+        Исключение внутри блока записывается как ошибка (код берётся из
+        атрибута status исключения, если он есть) и пробрасывается дальше.
+        """
+        c = Call()
+        t0 = time.perf_counter()
+        try:
+            yield c
+        except GeneratorExit:
+            # Потоковый ответ бросили, не дочитав
+            c.error = c.error or "прервано"
+            raise
+        except BaseException as e:
+            c.error = c.error or str(e) or type(e).__name__
+            if c.status_code is None:
+                c.status_code = getattr(e, "status", None)
+            raise
+        finally:
+            if self._writer is not None:
+                self.record(service, request, c.response, c.status_code,
+                            int((time.perf_counter() - t0) * 1000), c.error)
+
+
+recorder = ServiceCallRecorder(
+    sample_rate=float(os.getenv("SERVICE_LOG_SAMPLE_RATE", "1.0")),
+    max_payload=int(os.getenv("SERVICE_LOG_MAX_PAYLOAD", "2000")),
+    max_rows=int(os.getenv("SERVICE_LOG_MAX_ROWS", "50000")),
+)
+call = recorder.call
@@ -17,7 +17,8 @@ def db_module(tmp_db_path, monkeypatch):
     # на случай, если DB_PATH читается из config:
     monkeypatch.setattr(db, "DB_PATH", tmp_db_path, raising=False)
     db.init_db()
-    return db
+    yield db
+    db.close_pools()
 
 @pytest.fixture()
 def main_module(db_module, monkeypatch):
@@ -0,0 +1,62 @@
+import time
+
+from answer_cache import AnswerCache, make_key, normalize_question
+from metrics import metric
+
+
+def test_normalized_questions_share_key():
+    assert normalize_question("  Что такое   API? ") == "что такое api"
+    k1 = make_key("m", "prompt", "Что такое API?", 0.2, 400)
+    assert k1 == make_key("m", "prompt", "что такое api", 0.2, 400)
+    assert k1 != make_key("m2", "prompt", "Что такое API?", 0.2, 400)
+    assert k1 != make_key("m", "другой prompt", "Что такое API?", 0.2, 400)
+    assert k1 != make_key("m", "prompt", "Что такое API?", 0.2, 100)
+
+
+def test_memory_and_sqlite_tiers(db_module):
+    cache = AnswerCache(memory_size=10)
+    key = make_key("m", "p", "вопрос", 0.2, 400)
+    hits = metric.counter("llm_cache_hits").get()
+    misses = metric.counter("llm_cache_misses").get()
+
+    assert cache.get(key) is None
+    cache.put(key, "m", "ответ")
+    assert cache.get(key) == "ответ"
+
+    # Новый процесс/экземпляр: память пуста, ответ берётся из SQLite
+    other = AnswerCache(memory_size=10)
+    assert other.get(key) == "ответ"
+    assert metric.counter("llm_cache_hits").get() - hits == 2
+    assert metric.counter("llm_cache_misses").get() - misses == 1
+
+
+def test_ttl_expiry(db_module):
+    cache = AnswerCache(ttl_s=0.05)
+    key = make_key("m", "p", "ttl", 0.2, 400)
+    cache.put(key, "m", "ответ")
+    time.sleep(0.1)
+    assert cache.get(key) is None
+
+
+def test_sqlite_hit_keeps_row_expiry(db_module):
+    key = make_key("m", "p", "почти истекла", 0.2, 400)
+    now = time.time()
+    db_module.llm_cache_put(key, "m", "ответ", now - 3600, now + 0.1)
+    cache = AnswerCache(ttl_s=3600)
+
+    assert cache.get(key) == "ответ"
+    assert cache._memory[key][1] == now + 0.1
+    time.sleep(0.15)
+    assert cache.get(key) is None
+
+
+def test_size_based_eviction(db_module):
+    cache = AnswerCache(memory_size=2, max_rows=3, prune_every=1)
+    keys = [make_key("m", "p", f"q{i}", 0.2, 400) for i in range(5)]
+    for k in keys:
+        cache.put(k, "m", k)
+
+    assert len(cache._memory) == 2
+    with db_module._connect() as conn:
+        rows = {r["key"] for r in conn.execute("SELECT key FROM llm_cache")}
+    assert rows == set(keys[-3:]), "Должны остаться самые новые записи"
@@ -0,0 +1,68 @@
+import logging
+import queue
+import threading
+
+from log_handlers import BoundedQueueHandler, start_queue_logging
+from metrics import metric
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def _logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers[:] = [handler]
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_records_reach_handlers_in_background_thread():
+    target = _ListHandler()
+    threads = []
+    target.emit = (lambda orig: lambda r: (threads.append(threading.current_thread().name), orig(r)))(target.emit)
+    handler, listener = start_queue_logging([target], queue_size=100)
+    logger = _logger("test_async_bg", handler)
+
+    items = [1]
+    logger.info("список %s", items)
+    items.append(2)  # аргументы уже склеены в сообщение
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("ошибка")
+    listener.stop()
+
+    assert target.lines[0] == "список [1]"
+    assert target.lines[1].startswith("ошибка\nTraceback") and "ZeroDivisionError" in target.lines[1]
+    assert threading.current_thread().name not in threads
+
+
+def test_full_queue_drops_and_counts():
+    q = queue.Queue(maxsize=2)
+    handler = BoundedQueueHandler(q, block=False)
+    logger = _logger("test_async_drop", handler)
+    dropped = metric.counter("log_records_dropped")
+    before = dropped.get()
+
+    for i in range(5):
+        logger.info("запись %d", i)
+
+    assert q.qsize() == 2
+    assert dropped.get() - before == 3
+
+
+def test_block_policy_waits_for_room():
+    target = _ListHandler()
+    handler, listener = start_queue_logging([target], queue_size=1, block=True)
+    logger = _logger("test_async_block", handler)
+    for i in range(200):
+        logger.info("запись %d", i)
+    listener.stop()
+    assert len(target.lines) == 200
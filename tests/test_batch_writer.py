@@ -0,0 +1,81 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from batch_writer import BatchWriter
+
+
+def _connect_factory(path, calls):
+    @contextmanager
+    def connect():
+        calls.append(threading.current_thread().name)
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    return connect
+
+
+def _setup(tmp_path):
+    path = str(tmp_path / "batch.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (v INTEGER)")
+    return path
+
+
+def _count(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+
+def test_rows_are_grouped_into_batches(tmp_path):
+    path = _setup(tmp_path)
+    calls = []
+    writer = BatchWriter("test_group", "INSERT INTO t(v) VALUES (?)", _connect_factory(path, calls),
+                         flush_interval_ms=10000, batch_size=50)
+    for i in range(120):
+        assert writer.put((i,))
+    assert writer.flush(timeout=5)
+
+    assert _count(path) == 120
+    assert len(calls) == 3, "Две полные пачки по 50 и остаток по flush()"
+    writer.close()
+
+
+def test_interval_flush_and_close(tmp_path):
+    path = _setup(tmp_path)
+    writer = BatchWriter("test_interval", "INSERT INTO t(v) VALUES (?)", _connect_factory(path, []),
+                         flush_interval_ms=20, batch_size=1000)
+    writer.put((1,))
+    deadline = time.monotonic() + 5
+    while _count(path) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _count(path) == 1, "Пачка пишется по истечении интервала"
+
+    writer.put((2,))
+    writer.close()
+    assert _count(path) == 2, "close() дописывает очередь"
+
+
+def test_full_queue_rejects(tmp_path):
+    path = _setup(tmp_path)
+    gate = threading.Event()
+    connect = _connect_factory(path, [])
+
+    @contextmanager
+    def slow_connect():
+        gate.wait(5)
+        with connect() as conn:
+            yield conn
+
+    writer = BatchWriter("test_full", "INSERT INTO t(v) VALUES (?)", slow_connect,
+                         flush_interval_ms=0, batch_size=1, max_queue=2)
+    accepted = [writer.put((i,)) for i in range(10)]
+    assert not all(accepted)
+    gate.set()
+    writer.close()
+    assert _count(path) == sum(accepted)
@@ -53,6 +53,25 @@ def test_set_active_model_rejects_unknown_id(db_module):
     assert "Неизвестный ID модели" in str(excinfo.value)
 
 
+def test_set_active_model_inside_outer_transaction(db_module):
+    """Вложенный вызов не начинает и не коммитит транзакцию вызывающего"""
+    db = db_module
+    models = db.list_models()
+    a, b = models[0]["id"], models[1]["id"]
+    db.set_active_model(a)
+    uid = 888010
+
+    with pytest.raises(RuntimeError):
+        with db._connect() as conn:
+            conn.execute("INSERT INTO notes(user_id, text) VALUES (?, ?)", (uid, "откат"))
+            assert db.set_active_model(b)["id"] == b
+            assert conn.in_transaction, "Транзакция вызывающего не должна коммититься"
+            raise RuntimeError("boom")
+
+    assert db.list_all_notes(uid) == []
+    assert db.get_active_model()["id"] == a
+
+
 def test_set_user_character_rejects_unknown_id(db_module):
     db = db_module
     user_id = 777002
@@ -149,4 +168,428 @@ def test_list_all_notes_contains_added_text(db_module):
     notes = db.list_all_notes(uid)
 
     texts = [n["text"] for n in notes]
-    assert expected_text in texts, "Добавленная заметка должна быть в списке"
\ No newline at end of file
+    assert expected_text in texts, "Добавленная заметка должна быть в списке"
+
+def test_pool_reuses_connection_within_thread(db_module):
+    """Вложенные вызовы в одном потоке получают то же соединение"""
+    db = db_module
+
+    with db._connect() as outer:
+        with db._connect() as inner:
+            assert inner is outer
+
+    with db._connect() as again:
+        assert again is outer, "Свободное соединение должно переиспользоваться"
+    assert db._get_pool().stats()["opened"] == 1
+
+
+def test_pool_is_bounded(tmp_db_path):
+    import threading
+    from db_pool import ConnectionPool, PoolTimeout
+
+    pool = ConnectionPool(tmp_db_path, max_size=1, timeout_s=0.1)
+    errors = []
+
+    def other_thread():
+        try:
+            with pool.connection():
+                pass
+        except PoolTimeout as e:
+            errors.append(e)
+
+    with pool.connection():
+        t = threading.Thread(target=other_thread)
+        t.start()
+        t.join()
+
+    assert len(errors) == 1, "Второй поток не должен получить соединение сверх max_size"
+    pool.close()
+
+
+def test_pool_rolls_back_on_error(db_module):
+    db = db_module
+    uid = 888100
+
+    with pytest.raises(RuntimeError):
+        with db._connect() as conn:
+            conn.execute("INSERT INTO notes(user_id, text) VALUES (?, ?)", (uid, "откат"))
+            raise RuntimeError("boom")
+
+    assert db.list_all_notes(uid) == []
+
+
+def test_iter_all_notes_pages_without_holding_connection(db_module):
+    import threading
+
+    db = db_module
+    uid = 888110
+    ids = [db.add_note(uid, f"заметка {i}") for i in range(5)]
+
+    notes = db.iter_all_notes(uid, batch_size=2)
+    first = next(notes)
+    # Между страницами генератор не держит соединение потока
+    assert db._get_pool()._local.conn is None
+    assert db.count_notes(uid) == 5
+
+    rest = []
+    t = threading.Thread(target=lambda: rest.extend(notes))
+    t.start()
+    t.join()
+    assert [first["id"]] + [n["id"] for n in rest] == ids
+
+
+def test_pool_close_runs_optimize(db_module):
+    import sqlite3
+
+    db = db_module
+    for i in range(50):
+        db.add_note(888120 + i % 5, f"заметка {i}")
+    db.list_notes_page(888120)
+    db.close_pools()
+
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        tables = {r[0] for r in conn.execute("SELECT tbl FROM sqlite_stat1")}
+    finally:
+        conn.close()
+    assert "notes" in tables
+
+
+def test_pool_on_commit_runs_after_outer_commit(db_module):
+    db = db_module
+    pool = db._get_pool()
+    calls = []
+
+    with db._connect():
+        with db._connect():
+            pool.on_commit(lambda: calls.append("inner"))
+        assert calls == [], "Вложенный блок не коммитит - рано"
+    assert calls == ["inner"]
+
+    with pytest.raises(RuntimeError):
+        with db._connect():
+            pool.on_commit(lambda: calls.append("rolled back"))
+            raise RuntimeError("boom")
+    assert calls == ["inner"]
+
+    pool.on_commit(lambda: calls.append("no block"))
+    assert calls == ["inner", "no block"]
+
+
+def test_catalog_reads_do_not_touch_pool(db_module, monkeypatch):
+    """Повторные чтения каталогов идут из памяти, без соединений из пула"""
+    db = db_module
+    db.list_models()
+
+    def no_db():
+        raise AssertionError("Каталог должен читаться из кэша")
+
+    monkeypatch.setattr(db, "_connect", no_db)
+    assert db.list_models()
+    assert db.get_active_model()["active"] is True
+    assert db.list_characters()
+    assert db.get_character_by_id(1)["name"]
+    assert db.get_model_by_id(2)["id"] == 2
+    assert db.get_model_by_id(999999) is None
+
+
+def test_catalog_sees_writes_from_other_connection(db_module, tmp_db_path, monkeypatch):
+    """Запись в каталог из другого соединения (процесса) видна через data_version"""
+    import sqlite3
+
+    db = db_module
+    monkeypatch.setattr(db._catalog, "check_interval_s", 0)
+    assert db.get_character_by_id(1)["name"] == "Йода"
+
+    other = sqlite3.connect(tmp_db_path)
+    with other:
+        other.execute("UPDATE characters SET name = 'Магистр Йода' WHERE id = 1")
+    other.close()
+
+    assert db.get_character_by_id(1)["name"] == "Магистр Йода"
+
+
+def test_catalog_returns_copies(db_module):
+    db = db_module
+    db.list_models()[0]["label"] = "испорчено"
+    db.get_character_by_id(1)["prompt"] = "испорчено"
+
+    assert db.list_models()[0]["label"] != "испорчено"
+    assert db.get_character_by_id(1)["prompt"] != "испорчено"
+
+
+def test_user_character_cached_without_db_reads(db_module, monkeypatch):
+    db = db_module
+    db.set_user_character(777101, 3)
+    db.get_user_character(777102)  # без выбора - персонаж по умолчанию
+
+    def no_db():
+        raise AssertionError("Персонаж должен браться из кэша")
+
+    monkeypatch.setattr(db, "_connect", no_db)
+    assert db.get_user_character(777101)["id"] == 3
+    assert db.get_user_character(777102)["id"] == 1
+
+
+def test_user_character_write_through_keeps_cache(db_module, monkeypatch):
+    db = db_module
+    db.set_user_character(777103, 2)
+    assert db.get_user_character(777103)["id"] == 2
+    db.set_user_character(777104, 4)
+
+    # Своя запись не сбрасывает кэш остальных пользователей
+    assert 777103 in db._user_characters._items
+    assert db.get_user_character(777104)["id"] == 4
+
+
+def test_user_character_sees_other_process_write(db_module, tmp_db_path, monkeypatch):
+    import sqlite3
+
+    db = db_module
+    monkeypatch.setattr(db._catalog, "check_interval_s", 0)
+    db.set_user_character(777105, 2)
+    assert db.get_user_character(777105)["id"] == 2
+
+    other = sqlite3.connect(tmp_db_path)
+    with other:
+        other.execute("UPDATE user_character SET character_id = 5 WHERE telegram_user_id = 777105")
+    other.close()
+
+    assert db.get_user_character(777105)["id"] == 5
+
+
+class _CountingConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.queries = []
+
+    def execute(self, sql, *args):
+        self.queries.append(sql)
+        return self.conn.execute(sql, *args)
+
+    def close(self):
+        self.conn.close()
+
+
+def test_user_character_hit_does_not_query_db(db_module, monkeypatch):
+    """Попадание в кэш не трогает ни пул, ни соединение с data_version"""
+    db = db_module
+    db.set_user_character(777106, 3)
+    assert db.get_user_character(777106)["id"] == 3
+
+    watch = _CountingConnection(db._catalog._watch)
+    monkeypatch.setattr(db._catalog, "_watch", watch)
+    monkeypatch.setattr(db, "_connect", lambda: pytest.fail("Персонаж должен браться из кэша"))
+    for _ in range(3):
+        assert db.get_user_character(777106)["id"] == 3
+    assert watch.queries == []
+
+
+def test_user_character_checks_data_version_once_per_interval(db_module, tmp_db_path, monkeypatch):
+    import sqlite3
+
+    db = db_module
+    db.set_user_character(777107, 2)
+    assert db.get_user_character(777107)["id"] == 2
+    watch = _CountingConnection(db._catalog._watch)
+    monkeypatch.setattr(db._catalog, "_watch", watch)
+
+    other = sqlite3.connect(tmp_db_path)
+    with other:
+        other.execute("UPDATE user_character SET character_id = 5 WHERE telegram_user_id = 777107")
+    other.close()
+
+    # Чужая запись видна только после check_interval_s
+    assert db.get_user_character(777107)["id"] == 2
+    db._catalog._checked_at -= db._catalog.check_interval_s
+    assert db.get_user_character(777107)["id"] == 5
+    assert watch.queries.count("PRAGMA data_version") == 1
+
+
+def test_user_character_cache_is_bounded():
+    import db
+
+    cache = db._UserCharacterCache(max_size=2)
+    for uid in (1, 2, 3):
+        cache.put(uid, 7, None)
+    assert list(cache._items) == [2, 3]
+
+
+def test_find_notes_fulltext_ranked_with_snippet(db_module):
+    db = db_module
+    uid = 888200
+    db.add_note(uid, "Купить молоко и хлеб")
+    db.add_note(uid, "Молоко, молоко и ещё раз молоко")
+    db.add_note(uid, "Позвонить маме")
+    db.add_note(888201, "Чужое молоко")
+
+    rows = db.find_notes(uid, "МОЛОКО")
+
+    assert len(rows) == 2, "Поиск без учёта регистра и только по своим заметкам"
+    assert rows[0]["text"].startswith("Молоко, молоко"), "Больше совпадений - выше в выдаче"
+    assert f"{db.SNIPPET_START}молоко{db.SNIPPET_END}" in rows[1]["snippet"]
+
+
+def test_find_notes_index_follows_edit_and_delete(db_module):
+    db = db_module
+    uid = 888202
+    note_id = db.add_note(uid, "Старый текст")
+
+    db.update_note(uid, note_id, "Новый текст")
+    assert [r["id"] for r in db.find_notes(uid, "новый")] == [note_id]
+    assert db.find_notes(uid, "старый") == []
+
+    db.delete_note(uid, note_id)
+    assert db.find_notes(uid, "новый") == []
+
+
+def test_find_notes_prefix_and_substring_fallback(db_module):
+    db = db_module
+    uid = 888203
+    db.add_note(uid, "Программирование на Python")
+
+    assert len(db.find_notes(uid, "програм")) == 1, "Префикс слова"
+    assert len(db.find_notes(uid, "ython")) == 1, "Часть слова - через LIKE"
+    assert db.find_notes(uid, "Java") == []
+
+
+def test_note_stats_follow_add_and_delete(db_module):
+    db = db_module
+    uid = 888301
+    assert db.count_notes(uid) == 0
+
+    ids = [db.add_note(uid, f"заметка {i}") for i in range(3)]
+    db.add_note(uid + 1, "чужая")
+    assert db.count_notes(uid) == 3
+
+    db.delete_note(uid, ids[0])
+    db.delete_note(uid, 999999)
+    assert db.count_notes(uid) == 2
+    assert db.count_notes(uid + 1) == 1
+    assert db.check_note_stats() == []
+
+
+def test_add_note_limit_uses_note_stats(db_module):
+    db = db_module
+    uid = 888302
+    for i in range(db.NOTES_LIMIT):
+        assert db.add_note(uid, f"заметка {i}") > 0
+    assert db.add_note(uid, "лишняя") == 0
+    assert db.count_notes(uid) == db.NOTES_LIMIT
+
+
+def test_rebuild_note_stats_repairs_counters(db_module):
+    db = db_module
+    uid = 888303
+    db.add_note(uid, "раз")
+    db.add_note(uid, "два")
+    with db._connect() as conn:
+        conn.execute("UPDATE user_note_stats SET note_count = 7 WHERE user_id = ?", (uid,))
+        conn.execute("INSERT INTO user_note_stats(user_id, note_count) VALUES (?, 4)", (uid + 1,))
+
+    bad = db.check_note_stats()
+    assert {r["user_id"]: (r["expected"], r["actual"]) for r in bad} == {uid: (2, 7), uid + 1: (0, 4)}
+
+    db.rebuild_note_stats()
+    assert db.check_note_stats() == []
+    assert db.count_notes(uid) == 2
+    assert db.count_notes(uid + 1) == 0
+
+
+def test_activity_stats_from_daily_rollup(db_module):
+    db = db_module
+    uid = 888401
+    ids = [db.add_note(uid, f"заметка {i}") for i in range(3)]
+    db.delete_note(uid, ids[0])
+    with db._connect() as conn:
+        # События прошлых дней (как если бы они были записаны тогда)
+        conn.execute(
+            "INSERT INTO activity_log(user_id, action, note_id, created_at) "
+            "VALUES (?, 'create', 0, datetime('now', '-10 days')), "
+            "       (?, 'delete', 0, datetime('now', '-200 days'))",
+            (uid, uid)
+        )
+        days = conn.execute("SELECT COUNT(*) FROM activity_daily WHERE user_id = ?", (uid,)).fetchone()[0]
+    assert days == 3
+
+    assert db.get_weekly_stats(uid) == {'create': 3, 'delete': 1}
+    assert db.get_activity_stats(uid, 30) == {'create': 4, 'delete': 1}
+    assert db.get_activity_stats(uid, 365) == {'create': 4, 'delete': 2}
+    assert db.get_activity_stats(uid + 1) == {'create': 0, 'delete': 0}
+
+
+def test_prune_activity_log_keeps_rollups(db_module):
+    db = db_module
+    uid = 888402
+    db.add_note(uid, "свежая")
+    with db._connect() as conn:
+        conn.executemany(
+            "INSERT INTO activity_log(user_id, action, note_id, created_at) "
+            "VALUES (?, 'create', 0, datetime('now', '-40 days'))",
+            [(uid,)] * 7
+        )
+
+    assert db.prune_activity_log(30, batch_size=3) == 7
+    with db._connect() as conn:
+        left = conn.execute("SELECT COUNT(*) FROM activity_log WHERE user_id = ?", (uid,)).fetchone()[0]
+    assert left == 1
+    assert db.get_activity_stats(uid, 60) == {'create': 8, 'delete': 0}
+
+
+def test_list_notes_page_keyset(db_module):
+    db = db_module
+    uid = 888501
+    ids = [db.add_note(uid, f"заметка {i}") for i in range(7)]
+    db.add_note(uid + 1, "чужая")
+    newest_first = ids[::-1]
+
+    page1, more = db.list_notes_page(uid, limit=3)
+    assert [r["id"] for r in page1] == newest_first[:3] and more
+
+    page2, more = db.list_notes_page(uid, before_id=page1[-1]["id"], limit=3)
+    assert [r["id"] for r in page2] == newest_first[3:6] and more
+
+    page3, more = db.list_notes_page(uid, before_id=page2[-1]["id"], limit=3)
+    assert [r["id"] for r in page3] == newest_first[6:] and not more
+
+    back, more = db.list_notes_page(uid, after_id=page3[0]["id"], limit=3)
+    assert [r["id"] for r in back] == newest_first[3:6] and more
+
+    back, more = db.list_notes_page(uid, after_id=page2[0]["id"], limit=3)
+    assert [r["id"] for r in back] == newest_first[:3] and not more
+
+
+def test_activity_log_batch_mode(db_module, monkeypatch):
+    db = db_module
+    monkeypatch.setattr(db, "ACTIVITY_LOG_MODE", "batch")
+    monkeypatch.setattr(db, "ACTIVITY_LOG_FLUSH_MS", 10000)
+    uid = 888601
+    ids = [db.add_note(uid, f"заметка {i}") for i in range(3)]
+    db.delete_note(uid, ids[0])
+
+    assert db.flush_activity_log(timeout=5)
+    with db._connect() as conn:
+        actions = [r[0] for r in conn.execute(
+            "SELECT action FROM activity_log WHERE user_id = ? ORDER BY id", (uid,))]
+    assert actions == ["create"] * 3 + ["delete"]
+    assert db.get_weekly_stats(uid) == {'create': 3, 'delete': 1}
+
+
+def test_activity_log_batch_mode_skips_rolled_back_note(db_module, monkeypatch):
+    """Откаченная заметка не оставляет события в activity_log"""
+    db = db_module
+    monkeypatch.setattr(db, "ACTIVITY_LOG_MODE", "batch")
+    uid = 888602
+
+    with pytest.raises(RuntimeError):
+        with db._connect():
+            db.add_note(uid, "откат")
+            raise RuntimeError("boom")
+    db.add_note(uid, "сохранена")
+
+    assert db.flush_activity_log(timeout=5)
+    with db._connect() as conn:
+        actions = conn.execute(
+            "SELECT COUNT(*) FROM activity_log WHERE user_id = ?", (uid,)).fetchone()[0]
+    assert actions == 1
+    assert [n["text"] for n in db.list_all_notes(uid)] == ["сохранена"]
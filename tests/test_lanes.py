@@ -0,0 +1,58 @@
+import threading
+import time
+
+from lanes import Dispatcher
+from metrics import metric
+
+
+def test_llm_burst_does_not_delay_fast_lane():
+    dispatcher = Dispatcher()
+    fast = dispatcher.add_lane("test_fast", workers=1, queue_size=10)
+    llm = dispatcher.add_lane("test_llm", workers=2, queue_size=10)
+    release = threading.Event()
+    done = threading.Event()
+
+    # Забиваем LLM-полосу "долгими" задачами
+    for _ in range(12):
+        assert llm.submit(release.wait)
+
+    t0 = time.perf_counter()
+    assert fast.submit(done.set)
+    assert done.wait(1.0), "Быстрая полоса не должна ждать LLM-полосу"
+    assert time.perf_counter() - t0 < 0.5
+
+    release.set()
+    dispatcher.shutdown()
+
+
+def test_lane_rejects_when_queue_is_full():
+    dispatcher = Dispatcher()
+    rejected = []
+    lane = dispatcher.add_lane("test_small", workers=1, queue_size=1, on_reject=rejected.append)
+    release = threading.Event()
+
+    @lane.route
+    def handler(message):
+        release.wait()
+
+    handler("m1")  # выполняется
+    handler("m2")  # ждёт в очереди
+    handler("m3")  # не помещается
+
+    assert rejected == ["m3"]
+    assert metric.counter("lane_test_small_rejected").get() == 1
+
+    release.set()
+    dispatcher.shutdown()
+
+
+def test_lane_reports_queue_wait():
+    dispatcher = Dispatcher()
+    lane = dispatcher.add_lane("test_wait", workers=1, queue_size=5)
+    for _ in range(3):
+        lane.submit(time.sleep, 0.01)
+    dispatcher.shutdown()
+
+    stats = metric.latency("lane_test_wait_wait_ms").snapshot()
+    assert stats["count"] == 3
+    assert stats["max_ms"] >= 10
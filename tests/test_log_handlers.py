@@ -0,0 +1,113 @@
+import logging
+import queue
+import threading
+import time
+
+from lanes import Lane
+from log_handlers import (BatchingQueueListener, ContextFilter, ContextQueueHandler, ErrorLogHandler,
+                          context_of, log_context)
+
+
+def _pipeline(capacity=100, flush_interval_s=0.05):
+    q = queue.SimpleQueue()
+    listener = BatchingQueueListener(q, ErrorLogHandler(capacity=capacity), flush_interval_s=flush_interval_s)
+    handler = ContextQueueHandler(q)
+    handler.setLevel(logging.WARNING)
+    handler.addFilter(ContextFilter())
+    logger = logging.getLogger(f"test_error_log_{id(q)}")
+    logger.propagate = False
+    logger.addHandler(handler)
+    listener.start()
+    return logger, listener
+
+
+def _rows(db):
+    with db._connect() as conn:
+        return [dict(r) for r in conn.execute(
+            "SELECT level, message, user_id, command, details FROM error_log ORDER BY id")]
+
+
+def test_warnings_go_to_error_log_with_context(db_module):
+    logger, listener = _pipeline()
+    logger.info("не попадёт")
+    with log_context(user_id=42, command="note_export"):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("Ошибка при экспорте для %s", 42)
+    logger.warning("без контекста", extra={"user_id": 7})
+    listener.stop()
+
+    first, second = _rows(db_module)
+    assert (first["level"], first["message"], first["user_id"], first["command"]) == \
+        ("ERROR", "Ошибка при экспорте для 42", 42, "note_export")
+    assert "ZeroDivisionError" in first["details"]
+    assert (second["user_id"], second["command"], second["details"]) == (7, None, None)
+
+
+def test_idle_queue_flushes_buffer(db_module):
+    logger, listener = _pipeline(capacity=1000, flush_interval_s=0.02)
+    try:
+        logger.error("одна ошибка")
+        deadline = time.monotonic() + 5
+        while not _rows(db_module) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(_rows(db_module)) == 1
+    finally:
+        listener.stop()
+
+
+def test_logging_burst_does_not_wait_for_db_lock(db_module):
+    logger, listener = _pipeline(capacity=10)
+    with db_module._connect() as conn:
+        # Держим блокировку записи: вызовы логгера всё равно не ждут SQLite
+        conn.execute("BEGIN IMMEDIATE")
+        t0 = time.perf_counter()
+        for i in range(500):
+            logger.error("ошибка %d", i)
+        assert time.perf_counter() - t0 < 1.0
+        conn.rollback()
+    listener.stop()
+    assert len(_rows(db_module)) == 500
+
+
+def test_context_of_telebot_updates():
+    class Obj:
+        def __init__(self, **kw):
+            self.__dict__.update(kw)
+
+    user = Obj(id=5)
+    assert context_of(Obj(from_user=user, text="/note_add@my_bot купить")) == (5, "note_add")
+    assert context_of(Obj(from_user=user, text="привет", data=None)) == (5, None)
+    assert context_of(Obj(from_user=user, data="notes:5:older:3")) == (5, "notes")
+
+
+def test_lane_sets_log_context():
+    seen = []
+    done = threading.Event()
+
+    class Msg:
+        text = "/note_list"
+        from_user = type("U", (), {"id": 11})()
+
+    def handler(message):
+        record = logging.LogRecord("x", logging.ERROR, __file__, 1, "m", None, None)
+        ContextFilter().filter(record)
+        seen.append((record.user_id, record.command))
+        done.set()
+
+    lane = Lane("test_ctx", workers=1, queue_size=1)
+    lane.route(handler)(Msg())
+    assert done.wait(5)
+    lane.shutdown()
+    assert seen == [(11, "note_list")]
+
+
+def test_log_module_does_not_import_db():
+    import os
+    import subprocess
+    import sys
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "import sys, log, lanes; sys.exit('db' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=root).returncode == 0
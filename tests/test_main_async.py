@@ -0,0 +1,50 @@
+import asyncio
+import importlib
+import logging
+
+
+class _FakeAsyncBot:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def reply_to(self, message, text, **kwargs):
+        self.sent.append(text)
+
+    async def infinity_polling(self, **kwargs):
+        return None
+
+    async def close_session(self):
+        self.closed = True
+
+
+def test_answer_logs_unexpected_error(main_module, monkeypatch, caplog):
+    main_async = importlib.import_module("main_async")
+    fake = _FakeAsyncBot()
+    monkeypatch.setattr(main_async, "bot", fake)
+    monkeypatch.setattr(main_module, "LLM_CACHE_ENABLED", False)
+
+    async def failing(msgs, **kwargs):
+        raise RuntimeError("сбой")
+
+    monkeypatch.setattr(main_async, "chat_once_async", failing)
+
+    with caplog.at_level(logging.ERROR, logger="main_async"):
+        asyncio.run(main_async._answer(None, [], "test/model", ""))
+
+    assert fake.sent == ["Непредвиденная ошибка."]
+    assert any(r.exc_info and "test/model" in r.getMessage() for r in caplog.records)
+
+
+def test_main_releases_lanes_and_pools(main_module, monkeypatch):
+    main_async = importlib.import_module("main_async")
+    fake = _FakeAsyncBot()
+    calls = []
+    monkeypatch.setattr(main_async, "bot", fake)
+    monkeypatch.setattr(main_module.dispatcher, "shutdown", lambda wait=True: calls.append(("lanes", wait)))
+    monkeypatch.setattr(main_async, "close_pools", lambda: calls.append("pools"))
+
+    asyncio.run(main_async.main())
+
+    assert fake.closed
+    assert calls == [("lanes", True), "pools"]
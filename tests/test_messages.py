@@ -1,3 +1,6 @@
+import types
+
+
 def test_build_messages_includes_character_and_rules(db_module, main_module, monkeypatch):
     db = db_module
     main = main_module
@@ -65,3 +68,215 @@ def test_build_messages_for_character_pure_function(main_module):
     assert question in msgs[1]["content"]
 
 
+
+
+class _FakeBot:
+    """Запоминает отправленные и отредактированные сообщения"""
+
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+
+    def reply_to(self, message, text, **kwargs):
+        self.sent.append(text)
+        return types.SimpleNamespace(chat=types.SimpleNamespace(id=1), message_id=100)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.edits.append(text)
+
+
+def test_reply_streaming_edits_placeholder(main_module, monkeypatch):
+    main = main_module
+    fake = _FakeBot()
+    monkeypatch.setattr(main, "bot", fake)
+    monkeypatch.setattr(main, "STREAM_EDIT_INTERVAL_S", 0.0)
+    monkeypatch.setattr(main, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(main, "chat_stream", lambda msgs, **kw: iter(["Хм, ", "сильна ", "Сила."]))
+
+    main._reply_streaming(None, [{"role": "user", "content": "?"}], "test/model")
+
+    assert fake.sent == ["…"], "Сначала отправляется заглушка"
+    assert fake.edits[0] == "Хм,"
+    assert fake.edits[-1].startswith("Хм, сильна Сила.")
+    assert "модель: test/model" in fake.edits[-1]
+
+
+def test_reply_streaming_reports_error(main_module, monkeypatch):
+    main = main_module
+    fake = _FakeBot()
+    monkeypatch.setattr(main, "bot", fake)
+    monkeypatch.setattr(main, "LLM_CACHE_ENABLED", False)
+
+    def failing(msgs, **kw):
+        raise main.OpenRouterError(429, "лимит")
+        yield
+
+    monkeypatch.setattr(main, "chat_stream", failing)
+
+    main._reply_streaming(None, [], "test/model")
+
+    assert fake.edits == ["Ошибка: [429] лимит"]
+
+
+class _Lane:
+    """Полоса LLM: выполняет задачу сразу или отклоняет её (busy=True)"""
+
+    def __init__(self, busy=False):
+        self.busy = busy
+        self.submitted = 0
+
+    def submit(self, fn, *args, **kwargs):
+        if self.busy:
+            return False
+        self.submitted += 1
+        fn(*args, **kwargs)
+        return True
+
+
+def test_answer_serves_repeated_question_from_cache(main_module, monkeypatch):
+    import answer_cache
+
+    main = main_module
+    fake = _FakeBot()
+    calls = []
+    lane = _Lane()
+    monkeypatch.setattr(main, "bot", fake)
+    monkeypatch.setattr(main, "llm_lane", lane)
+    monkeypatch.setattr(main, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(answer_cache, "cache", answer_cache.AnswerCache())
+
+    def stream(msgs, **kw):
+        calls.append(msgs)
+        yield "Ответ"
+
+    monkeypatch.setattr(main, "chat_stream", stream)
+    character = {"id": 1, "name": "Йода", "prompt": "Коротко."}
+
+    main._answer(None, main._build_messages_for_character(character, "Что такое API?"), "m")
+    main._answer(None, main._build_messages_for_character(character, "что такое  api"), "m")
+
+    assert len(calls) == 1, "Повторный вопрос не должен идти в модель"
+    assert lane.submitted == 1, "Попадание в кэш не ставится в полосу LLM"
+    assert fake.sent[-1].startswith("Ответ\n\n(из кэша")
+
+
+def test_answer_cache_hit_does_not_wait_for_busy_llm_lane(main_module, monkeypatch):
+    import answer_cache
+
+    main = main_module
+    fake = _FakeBot()
+    monkeypatch.setattr(main, "bot", fake)
+    monkeypatch.setattr(main, "llm_lane", _Lane(busy=True))
+    monkeypatch.setattr(main, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(answer_cache, "cache", answer_cache.AnswerCache())
+    character = {"id": 1, "name": "Йода", "prompt": "Коротко."}
+    cached = main._build_messages_for_character(character, "Что такое API?")
+    key = answer_cache.make_key("m", cached[0]["content"], cached[-1]["content"],
+                                main.LLM_TEMPERATURE, main.LLM_MAX_TOKENS)
+    answer_cache.cache.put(key, "m", "Ответ")
+
+    main._answer(None, cached, "m")
+    main._answer(None, main._build_messages_for_character(character, "Новый вопрос"), "m")
+
+    assert fake.sent[0].startswith("Ответ\n\n(из кэша")
+    assert fake.sent[1] == "Бот перегружен, попробуйте чуть позже."
+
+
+def test_note_export_sends_document_without_files_in_cwd(main_module, monkeypatch, tmp_path):
+    main = main_module
+    sent = {}
+
+    class _ExportBot(_FakeBot):
+        def send_document(self, chat_id, document, **kwargs):
+            sent["data"] = document.read()
+            sent["name"] = kwargs.get("visible_file_name")
+
+    monkeypatch.setattr(main, "bot", _ExportBot())
+    workdir = tmp_path / "cwd"
+    workdir.mkdir()
+    monkeypatch.chdir(workdir)
+    uid = 990601
+    main.add_note(uid, "для экспорта")
+    message = types.SimpleNamespace(
+        text="/note_export json",
+        chat=types.SimpleNamespace(id=1),
+        from_user=types.SimpleNamespace(id=uid, username="bob"),
+    )
+
+    main.note_export.__wrapped__(message)
+
+    assert sent["name"] == f"notes_{uid}.json"
+    assert "для экспорта" in sent["data"].decode("utf-8")
+    assert list(workdir.iterdir()) == []
+
+
+def test_note_list_pages_with_inline_buttons(main_module, monkeypatch):
+    main = main_module
+    replies, edits, answers = [], [], []
+
+    class _PagingBot(_FakeBot):
+        def reply_to(self, message, text, **kwargs):
+            replies.append((text, kwargs.get("reply_markup")))
+
+        def edit_message_text(self, text, chat_id, message_id, **kwargs):
+            edits.append((text, kwargs.get("reply_markup")))
+
+        def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+            answers.append(text)
+
+    monkeypatch.setattr(main, "bot", _PagingBot())
+    monkeypatch.setattr(main, "NOTE_LIST_PAGE_SIZE", 2)
+    uid = 990701
+    ids = [main.add_note(uid, f"заметка {i}") for i in range(3)]
+    user = types.SimpleNamespace(id=uid)
+    chat = types.SimpleNamespace(id=1)
+
+    main.note_list.__wrapped__(types.SimpleNamespace(from_user=user, chat=chat))
+    text, kb = replies[-1]
+    assert f"{ids[2]}: заметка 2" in text and f"{ids[0]}:" not in text
+    [[older]] = kb.keyboard
+    assert older.callback_data == f"notes:{uid}:older:{ids[1]}"
+
+    def press(data, who=user):
+        call = types.SimpleNamespace(id="1", data=data, from_user=who,
+                                     message=types.SimpleNamespace(chat=chat, message_id=5))
+        main.note_list_page.__wrapped__(call)
+
+    press(older.callback_data)
+    text, kb = edits[-1]
+    assert text.endswith(f"{ids[0]}: заметка 0")
+    [[newer]] = kb.keyboard
+    assert newer.callback_data == f"notes:{uid}:newer:{ids[0]}"
+
+    press(newer.callback_data, who=types.SimpleNamespace(id=uid + 1))
+    assert answers[-1] == "Это не ваш список заметок." and len(edits) == 1
+
+
+def test_note_list_page_busy_lane_answers_callback(main_module, monkeypatch):
+    import threading
+
+    from lanes import Lane
+
+    main = main_module
+    answers = []
+
+    class _CallbackBot(_FakeBot):
+        def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+            answers.append((callback_query_id, text))
+
+    monkeypatch.setattr(main, "bot", _CallbackBot())
+    lane = Lane("test_fast", workers=1, queue_size=0, on_reject=main._reply_busy)
+    release = threading.Event()
+    assert lane.submit(release.wait)
+    call = main.types.CallbackQuery.de_json({
+        "id": "7", "chat_instance": "x", "data": "notes:5:older:3",
+        "from": {"id": 5, "is_bot": False, "first_name": "Боб"},
+    })
+
+    try:
+        lane.route(main.note_list_page.__wrapped__)(call)
+    finally:
+        release.set()
+        lane.shutdown()
+
+    assert answers == [("7", "Бот перегружен, попробуйте чуть позже.")]
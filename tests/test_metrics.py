@@ -0,0 +1,220 @@
+import random
+import threading
+
+import pytest
+
+import metrics
+from metrics import Counter, Histogram, LatencyMetric, MetricsRegistry, metric, timed
+
+
+def test_counter_exact_under_threads():
+    counter = Counter("stress")
+    threads_n, per_thread = 16, 20000
+    start = threading.Barrier(threads_n)
+
+    def work():
+        start.wait()
+        for _ in range(per_thread):
+            counter.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(threads_n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert counter.get() == threads_n * per_thread
+    assert counter.value == threads_n * per_thread
+
+
+def test_counter_folds_cells_of_finished_threads():
+    counter = Counter("churn")
+    for _ in range(100):
+        t = threading.Thread(target=counter.inc, args=(3,))
+        t.start()
+        t.join()
+    counter.inc(1)
+
+    assert counter.get() == 301
+    assert len(counter._cells) <= 2
+
+
+def test_registry_returns_same_metric_from_many_threads():
+    registry = MetricsRegistry()
+    seen = []
+    start = threading.Barrier(8)
+
+    def work():
+        start.wait()
+        for _ in range(1000):
+            registry.counter("shared").inc()
+        seen.append(registry.counter("shared"))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len({id(c) for c in seen}) == 1
+    assert registry.snapshot()["counters"]["shared"] == 8000
+
+
+def test_histogram_quantiles_within_bucket_error():
+    rng = random.Random(1)
+    values = sorted(rng.randint(1, 5_000_000) for _ in range(20000))
+    h = Histogram()
+    for v in values:
+        h.record(v)
+
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * len(values)) - 1]
+        assert abs(h.quantile(q) - exact) / exact < 1 / 16
+    assert h.quantile(1.0) == values[-1]
+    assert h.quantile(0.0) == values[0]
+    assert len(h.counts) == Histogram.SIZE
+
+
+def test_histogram_small_values_exact_and_huge_values_clamped():
+    h = Histogram()
+    for v in (0, 3, 3, 15):
+        h.record(v)
+    assert h.quantile(0.5) == 3
+    assert h.quantile(1.0) == 15
+
+    h.record(10 ** 15)
+    assert Histogram.bucket_of(10 ** 15) == Histogram.SIZE - 1
+    assert h.quantile(1.0) == 10 ** 15
+
+
+def test_histogram_merge_matches_single_histogram():
+    a, b, both = Histogram(), Histogram(), Histogram()
+    for v in range(1, 1000):
+        (a if v % 2 else b).record(v * 37)
+        both.record(v * 37)
+
+    merged = a.copy().merge(b)
+
+    assert merged.counts == both.counts
+    assert (merged.count, merged.total_us, merged.min_us, merged.max_us) == \
+        (both.count, both.total_us, both.min_us, both.max_us)
+    assert a.count == 500
+
+
+def test_latency_snapshot_keeps_keys_and_adds_percentiles():
+    latency = LatencyMetric("req")
+    for ms in range(1, 101):
+        latency.observe(ms)
+    latency.observe_us(250)
+
+    snap = latency.snapshot()
+
+    assert snap["count"] == 101
+    assert snap["min_ms"] == 0 and snap["max_ms"] == 100
+    assert set(snap) >= {"total_ms", "avg_ms", "p50_ms", "p95_ms", "p99_ms"}
+    assert 47 <= snap["p50_ms"] <= 53
+    assert 92 <= snap["p95_ms"] <= 100
+    assert snap["p50_ms"] <= snap["p95_ms"] <= snap["p99_ms"] <= 100
+
+
+def test_timed_records_microseconds():
+    @timed("test_timed_work_ms")
+    def work():
+        return sum(range(1000))
+
+    work()
+    histogram = metric.latency("test_timed_work_ms").histogram()
+
+    assert histogram.count == 1
+    assert histogram.max_us > 0
+
+
+class _Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_counter_window_counts_only_recent_increments(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(metrics, "_clock", clock)
+    counter = Counter("windowed")
+
+    counter.inc(100)
+    clock.now += 120
+    for _ in range(30):
+        counter.inc(2)
+        clock.now += 1
+
+    assert counter.get() == 160
+    assert counter.window("1m") == 60
+    assert counter.window("5m") == 160
+    clock.now += 3600
+    assert counter.window("1h") == 0
+    assert counter.get() == 160
+
+
+def test_registry_windowed_snapshot(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(metrics, "_clock", clock)
+    registry = MetricsRegistry()
+
+    registry.latency("llm").observe(5000)
+    registry.counter("requests").inc(600)
+    clock.now += 600
+    for ms in range(1, 61):
+        registry.latency("llm").observe(ms)
+        registry.counter("requests").inc()
+        clock.now += 1
+    clock.now -= 1
+
+    recent = registry.snapshot(window="1m")
+    assert recent["counters"]["requests"] == 60
+    assert recent["rates"]["requests"] == 1.0
+    assert recent["latencies"]["llm"]["count"] == 60
+    assert recent["latencies"]["llm"]["max_ms"] == 60
+    assert 28 <= recent["latencies"]["llm"]["p50_ms"] <= 32
+
+    hour = registry.snapshot(window="1h")
+    assert hour["counters"]["requests"] == 660
+    assert hour["latencies"]["llm"]["max_ms"] == 5000
+
+    assert "rates" not in registry.snapshot()
+    with pytest.raises(ValueError):
+        registry.snapshot(window="2m")
+
+
+def test_window_memory_is_bounded(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(metrics, "_clock", clock)
+    latency, counter = LatencyMetric("long"), Counter("long")
+
+    for _ in range(10000):
+        latency.observe_us(1500)
+        counter.inc()
+        clock.now += 7
+
+    assert [len(ring) for ring in latency._rings] == [n for _, n in metrics.WINDOW_TIERS]
+    assert [len(samples) for samples in counter._samples] == [n for _, n in metrics.WINDOW_TIERS]
+    # Окно выровнено по слотам: от 59 до 60 минут
+    assert 3540 // 7 <= latency.histogram("1h").count <= 3600 // 7 + 1
+
+
+def test_latency_windows_match_brute_force(monkeypatch):
+    clock = _Clock(0.0)
+    monkeypatch.setattr(metrics, "_clock", clock)
+    rng = random.Random(7)
+    latency = LatencyMetric("brute")
+    seen = []
+
+    for _ in range(3000):
+        clock.now += rng.choice((0.3, 1, 4, 13, 45))
+        latency.observe_us(1000)
+        seen.append(int(clock.now))
+
+    now = int(clock.now)
+    for window, (slot_s, slots) in (("1m", (1, 60)), ("5m", (10, 30)), ("1h", (60, 60))):
+        start = (now // slot_s - slots + 1) * slot_s
+        assert latency.histogram(window).count == sum(1 for t in seen if t >= start)
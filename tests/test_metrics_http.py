@@ -0,0 +1,119 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from metrics import MetricsRegistry
+from metrics_http import MetricsExporter, metric_name, start_metrics_server
+from metrics_shm import FleetMetrics, SharedMetrics
+
+
+@pytest.fixture
+def registry():
+    registry = MetricsRegistry()
+    registry.counter("commands_total").inc(3)
+    registry.counter("lane-fast.rejected").inc()
+    for ms in (10, 20, 30):
+        registry.latency("openrouter_latency_ms").observe(ms)
+    return registry
+
+
+def test_metric_name_is_sanitized():
+    assert metric_name("lane-fast.rejected") == "lane_fast_rejected"
+    assert metric_name("5xx") == "_5xx"
+
+
+def test_prometheus_text_format(registry):
+    text = MetricsExporter(registry).render_prometheus().decode()
+
+    assert "# TYPE commands_total counter\ncommands_total 3\n" in text
+    assert "lane_fast_rejected 1\n" in text
+    assert "# TYPE openrouter_latency_ms summary\n" in text
+    p50 = text.split('openrouter_latency_ms{quantile="0.5"} ', 1)[1].split("\n", 1)[0]
+    assert float(p50) == pytest.approx(20, rel=1 / 16)
+    assert "openrouter_latency_ms_sum 60\nopenrouter_latency_ms_count 3\n" in text
+    assert text.endswith("\n")
+
+
+def test_colliding_names_get_suffix():
+    registry = MetricsRegistry()
+    registry.counter("a.b").inc(1)
+    registry.counter("a_b").inc(2)
+    registry.counter("lat_sum").inc(3)
+    registry.latency("lat").observe(5)
+    exporter = MetricsExporter(registry)
+
+    text = exporter.render_prometheus().decode()
+
+    assert "# TYPE a_b counter\na_b 1\n" in text
+    assert "# TYPE a_b_2 counter\na_b_2 2\n" in text
+    assert "lat_sum 3\n" in text and "# TYPE lat_2 summary\n" in text
+    types = [line for line in text.splitlines() if line.startswith("# TYPE")]
+    assert len(types) == len(set(types)) == 4
+    # Повторный срез отдаёт те же имена
+    assert exporter.render_prometheus().decode() == text
+
+
+def test_prometheus_output_is_cached(registry):
+    exporter = MetricsExporter(registry, cache_ttl_s=60)
+    first = exporter.prometheus()
+    registry.counter("commands_total").inc()
+
+    assert exporter.prometheus() is first
+    exporter.cache_ttl_s = 0
+    assert b"commands_total 4\n" in exporter.prometheus()
+
+
+def test_server_serves_metrics_and_json(registry):
+    server = start_metrics_server(0, registry=registry)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(base + "/metrics", timeout=5) as r:
+            assert r.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert b"commands_total 3" in r.read()
+        with urllib.request.urlopen(base + "/metrics.json?window=1m", timeout=5) as r:
+            data = json.loads(r.read())
+        assert data["counters"]["commands_total"] == 3
+        assert data["latencies"]["openrouter_latency_ms"]["count"] == 3
+
+        for path, status in (("/metrics.json?window=2m", 400), ("/other", 404)):
+            with pytest.raises(urllib.error.HTTPError) as e:
+                urllib.request.urlopen(base + path, timeout=5)
+            assert e.value.code == status
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_server_returns_500_on_snapshot_error(registry, monkeypatch, caplog):
+    def broken(window=None):
+        raise RuntimeError("сломано")
+
+    monkeypatch.setattr(registry, "snapshot", broken)
+    server = start_metrics_server(0, registry=registry)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        for path in ("/metrics", "/metrics.json"):
+            with pytest.raises(urllib.error.HTTPError) as e:
+                urllib.request.urlopen(base + path, timeout=5)
+            assert e.value.code == 500
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert "Ошибка при отдаче метрик" in caplog.text
+
+
+def test_fleet_metrics_are_exported(tmp_path, registry):
+    path = str(tmp_path / "bot-metrics")
+    shared = SharedMetrics(path, registry=registry)
+    shared.open()
+    try:
+        shared.publish()
+        text = MetricsExporter(FleetMetrics(path)).render_prometheus().decode()
+    finally:
+        shared.close()
+
+    assert "commands_total 3\n" in text
+    assert "openrouter_latency_ms_count 3\n" in text
+    assert "# TYPE metrics_processes gauge\nmetrics_processes 1\n" in text
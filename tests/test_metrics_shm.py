@@ -0,0 +1,163 @@
+import multiprocessing
+import struct
+
+import pytest
+
+import metrics_shm
+from metrics import MetricsRegistry
+from metrics_shm import FleetMetrics, SharedMetrics
+
+
+@pytest.fixture
+def shm_path(tmp_path):
+    return str(tmp_path / "bot-metrics")
+
+
+def _registry(commands, latencies_ms):
+    registry = MetricsRegistry()
+    registry.counter("commands_total").inc(commands)
+    for ms in latencies_ms:
+        registry.latency("openrouter_latency_ms").observe(ms)
+    return registry
+
+
+def _child(path, ready, done):
+    registry = _registry(5, [100])
+    registry.counter("child_only").inc()
+    shared = SharedMetrics(path, registry=registry)
+    shared.open()
+    shared.publish()
+    ready.set()
+    done.wait(10)
+    # Слот не освобождается: процесс просто завершается
+
+
+def test_fleet_snapshot_sums_slots(shm_path):
+    a = SharedMetrics(shm_path, registry=_registry(3, [10, 20]), slots=4)
+    b = SharedMetrics(shm_path, registry=_registry(4, [30]), slots=4)
+    a.open()
+    b.open()
+    try:
+        a.publish()
+        b.publish()
+        assert a.slot != b.slot
+
+        snap = FleetMetrics(shm_path).snapshot()
+        assert snap["processes"] == 2
+        assert snap["counters"]["commands_total"] == 7
+        latency = snap["latencies"]["openrouter_latency_ms"]
+        assert (latency["count"], latency["total_ms"], latency["min_ms"], latency["max_ms"]) == (3, 60, 10, 30)
+        assert latency["p50_ms"] == pytest.approx(20, rel=1 / 16)
+    finally:
+        a.close()
+        b.close()
+
+    # Ушедшие процессы остаются в итоге: суммы не падают
+    snap = FleetMetrics(shm_path).snapshot()
+    assert snap["processes"] == 0
+    assert snap["counters"] == {"commands_total": 7}
+    assert snap["latencies"]["openrouter_latency_ms"]["count"] == 3
+
+    again = SharedMetrics(shm_path, registry=_registry(1, []), slots=4)
+    again.open()
+    again.publish()
+    assert FleetMetrics(shm_path).snapshot()["counters"] == {"commands_total": 8}
+    again.close()
+
+
+def test_fleet_snapshot_across_processes(shm_path):
+    ctx = multiprocessing.get_context("fork")
+    ready, done = ctx.Event(), ctx.Event()
+    child = ctx.Process(target=_child, args=(shm_path, ready, done))
+    child.start()
+    own = SharedMetrics(shm_path, registry=_registry(1, [300]))
+    try:
+        assert ready.wait(10)
+        own.open()
+        own.publish()
+
+        snap = FleetMetrics(shm_path).snapshot()
+        assert snap["processes"] == 2
+        assert snap["counters"] == {"commands_total": 6, "child_only": 1}
+        assert snap["latencies"]["openrouter_latency_ms"]["count"] == 2
+
+        done.set()
+        child.join(10)
+        # Процесс завершился без close(): его последние значения остаются
+        snap = FleetMetrics(shm_path).snapshot()
+        assert snap["processes"] == 1
+        assert snap["counters"] == {"commands_total": 6, "child_only": 1}
+
+        # Новый процесс занимает слот умершего; значения переходят в итог
+        other = SharedMetrics(shm_path, registry=_registry(2, []))
+        other.open()
+        assert other.slot != own.slot
+        assert FleetMetrics(shm_path).snapshot()["counters"] == {"commands_total": 6, "child_only": 1}
+        other.close()
+        snap = FleetMetrics(shm_path).snapshot()
+        assert snap["counters"] == {"commands_total": 8, "child_only": 1}
+        assert snap["latencies"]["openrouter_latency_ms"]["count"] == 2
+    finally:
+        done.set()
+        child.join(10)
+        own.close()
+
+
+def test_stale_and_torn_slots_are_skipped(shm_path, monkeypatch):
+    shared = SharedMetrics(shm_path, registry=_registry(3, []), stale_after_s=30)
+    shared.open()
+    try:
+        shared.publish()
+        assert FleetMetrics(shm_path, stale_after_s=30).snapshot()["processes"] == 1
+        stale = FleetMetrics(shm_path, stale_after_s=0).snapshot()
+        assert stale["processes"] == 0
+        assert stale["counters"] == {"commands_total": 3}
+
+        # Писатель посреди записи: нечётная версия
+        offset = shared._layout.slot(shared.slot)
+        struct.pack_into("<Q", shared._mm, offset, shared._seq + 1)
+        monkeypatch.setattr(metrics_shm, "_READ_RETRIES", 3)
+        assert FleetMetrics(shm_path).snapshot()["counters"] == {}
+        struct.pack_into("<Q", shared._mm, offset, shared._seq)
+        assert FleetMetrics(shm_path).snapshot()["counters"] == {"commands_total": 3}
+    finally:
+        shared.close()
+
+
+def test_metrics_over_limit_are_not_published(shm_path):
+    registry = MetricsRegistry()
+    for i in range(3):
+        registry.counter(f"c{i}").inc(i + 1)
+    registry.counter("x" * 200).inc()
+    shared = SharedMetrics(shm_path, registry=registry, max_counters=2)
+    shared.open()
+    try:
+        shared.publish()
+        assert FleetMetrics(shm_path).snapshot()["counters"] == {"c0": 1, "c1": 2}
+    finally:
+        shared.close()
+
+
+def test_fleet_snapshot_without_file(shm_path):
+    assert FleetMetrics(shm_path).snapshot()["processes"] == 0
+    with pytest.raises(ValueError):
+        FleetMetrics(shm_path).snapshot(window="1m")
+
+
+def test_evicted_writer_stops_publishing(shm_path):
+    registry = _registry(3, [])
+    stale = SharedMetrics(shm_path, registry=registry, slots=1, stale_after_s=0)
+    stale.open()
+    stale.publish()
+    # Слот не обновлялся дольше stale_after_s - его занимает новый процесс
+    fresh = SharedMetrics(shm_path, registry=_registry(1, []), slots=1, stale_after_s=0)
+    fresh.open()
+    try:
+        registry.counter("commands_total").inc(100)
+        stale.publish()
+        assert stale.slot is None
+        fresh.publish()
+        assert FleetMetrics(shm_path).snapshot()["counters"] == {"commands_total": 4}
+    finally:
+        stale.close()
+        fresh.close()
@@ -0,0 +1,77 @@
+import sqlite3
+
+import pytest
+
+import migrations
+
+
+def test_fresh_db_is_at_latest_version(db_module):
+    with db_module._connect() as conn:
+        assert migrations.current_version(conn) == migrations.LATEST_VERSION
+        # Повторный запуск ничего не применяет
+        assert migrations.migrate(conn) == []
+
+
+def test_seed_data_applied_once(db_module):
+    db = db_module
+    with db._connect() as conn:
+        conn.execute("DELETE FROM models WHERE id = 10")
+    db.init_db()
+
+    assert db.get_model_by_id(10) is None, "Сиды не должны переприменяться при каждом старте"
+
+
+def test_legacy_db_without_user_version_is_upgraded(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO notes(user_id, text) VALUES (1, 'старая заметка');
+    """)
+
+    assert migrations.migrate(conn) == [m[0] for m in migrations.MIGRATIONS]
+    assert migrations.current_version(conn) == migrations.LATEST_VERSION
+    # Старые заметки попали в полнотекстовый индекс
+    assert conn.execute("SELECT rowid FROM notes_fts WHERE notes_fts MATCH 'заметка'").fetchall() == [(1,)]
+    # ... и в счётчики user_note_stats
+    assert conn.execute("SELECT user_id, note_count FROM user_note_stats").fetchall() == [(1, 1)]
+    conn.close()
+
+
+def test_failed_step_is_rolled_back(tmp_path, monkeypatch):
+    path = str(tmp_path / "broken.db")
+    conn = sqlite3.connect(path)
+    broken = migrations.MIGRATIONS[:1] + [(2, "сломанный шаг", (
+        "CREATE TABLE half_done (id INTEGER)",
+        "SELECT * FROM no_such_table",
+    ))]
+    monkeypatch.setattr(migrations, "MIGRATIONS", broken)
+    monkeypatch.setattr(migrations, "LATEST_VERSION", 2)
+
+    with pytest.raises(sqlite3.OperationalError):
+        migrations.migrate(conn)
+
+    assert migrations.current_version(conn) == 1
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    conn.close()
+
+
+def test_fresh_db_has_no_planner_stats_until_optimize(db_module):
+    """Статистика не собирается на пустых таблицах в миграции, её даёт PRAGMA optimize"""
+    db = db_module
+    with db._connect() as conn:
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None
+
+    for i in range(50):
+        db.add_note(888200 + i % 5, f"заметка {i}")
+    db.list_notes_page(888200)
+    db.optimize_db()
+
+    with db._connect() as conn:
+        tables = {r[0] for r in conn.execute("SELECT tbl FROM sqlite_stat1")}
+    assert "notes" in tables
@@ -0,0 +1,55 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import note_export
+
+
+def _add(db, uid, texts):
+    return [db.add_note(uid, t) for t in texts]
+
+
+def test_export_formats(db_module):
+    db = db_module
+    uid = 990501
+    ids = _add(db, uid, ["первая", 'вторая, с "кавычками"\nи переносом'])
+    _add(db, uid + 1, ["чужая"])
+
+    txt = note_export.export_notes(uid, "txt", username="alice")
+    body = txt.file.read().decode("utf-8")
+    assert txt.filename == f"notes_{uid}.txt" and txt.count == 2
+    assert body.startswith("Экспорт всех заметок для пользователя @alice")
+    assert "Текст: первая" in body and "чужая" not in body
+
+    rows = list(csv.reader(io.StringIO(note_export.export_notes(uid, "csv").file.read().decode("utf-8"))))
+    assert rows[0] == ["id", "created_at", "text"]
+    assert [(int(r[0]), r[2]) for r in rows[1:]] == [(ids[0], "первая"), (ids[1], 'вторая, с "кавычками"\nи переносом')]
+
+    data = json.loads(note_export.export_notes(uid, "json").file.read())
+    assert [n["id"] for n in data] == ids
+
+    md = note_export.export_notes(uid, "MD").file.read().decode("utf-8")
+    assert f"## #{ids[1]}" in md
+
+
+def test_export_empty_json_is_valid(db_module):
+    assert json.loads(note_export.export_notes(990502, "json").file.read()) == []
+
+
+def test_large_export_is_gzipped(db_module):
+    db = db_module
+    uid = 990503
+    _add(db, uid, [f"заметка {i} " + "x" * 200 for i in range(20)])
+
+    export = note_export.export_notes(uid, "csv", gzip_threshold=1000, spool_size=512)
+    assert export.filename == f"notes_{uid}.csv.gz"
+    rows = list(csv.reader(io.StringIO(gzip.decompress(export.file.read()).decode("utf-8"))))
+    assert len(rows) == 21
+
+
+def test_unknown_format(db_module):
+    with pytest.raises(ValueError):
+        note_export.export_notes(1, "xml")
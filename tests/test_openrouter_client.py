@@ -96,4 +96,159 @@ def test_chat_once_5xx_raises_openrouter_error(openrouter_module, monkeypatch):
 
     err = excinfo.value
     assert err.status == 503
-    assert "Сервис недоступен" in str(err)
\ No newline at end of file
+    assert "Сервис недоступен" in str(err)
+
+def test_chat_once_async_against_local_server(openrouter_module, monkeypatch):
+    """
+    chat_once_async ходит в локальный aiohttp-сервер вместо OpenRouter
+    """
+    import asyncio
+    from aiohttp import web
+
+    async def handler(request):
+        body = await request.json()
+        assert request.headers["Authorization"] == "Bearer test-key"
+        return web.json_response({"choices": [{"message": {"content": f"echo:{body['model']}"}}]})
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/api/v1/chat/completions", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(openrouter_module, "OPENROUTER_API",
+                            f"http://127.0.0.1:{port}/api/v1/chat/completions")
+        try:
+            texts = await asyncio.gather(*[
+                openrouter_module.chat_once_async([{"role": "user", "content": "ping"}], model=f"m{i}")
+                for i in range(5)
+            ])
+        finally:
+            await runner.cleanup()
+        return texts
+
+    monkeypatch.setattr(openrouter_module, "OPENROUTER_API_KEY", "test-key")
+    results = asyncio.run(scenario())
+
+    assert [text for text, _ in results] == [f"echo:m{i}" for i in range(5)]
+
+
+def test_chat_once_reuses_keepalive_connection(openrouter_module, monkeypatch):
+    """
+    Несколько вызовов chat_once идут через одно keep-alive соединение
+    к локальному HTTP-серверу
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from metrics import metric
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = json.dumps({"choices": [{"message": {"content": "OK"}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(openrouter_module, "OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(openrouter_module, "OPENROUTER_API",
+                        f"http://127.0.0.1:{server.server_port}/api/v1/chat/completions")
+    openrouter_module.close_session()
+    opened = metric.counter("openrouter_conn_opened").get()
+    reused = metric.counter("openrouter_conn_reused").get()
+
+    try:
+        for _ in range(3):
+            text, _ = openrouter_module.chat_once([{"role": "user", "content": "ping"}], model="m")
+            assert text == "OK"
+    finally:
+        openrouter_module.close_session()
+        server.shutdown()
+        server.server_close()
+
+    assert metric.counter("openrouter_conn_opened").get() - opened == 1
+    assert metric.counter("openrouter_conn_reused").get() - reused == 2
+
+
+@responses.activate
+def test_chat_stream_yields_deltas_and_records_ttft(openrouter_module, monkeypatch):
+    from metrics import metric
+
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    events = [
+        ": OPENROUTER PROCESSING",
+        'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+        'data: {"choices": [{"delta": {"content": "При"}}]}',
+        'data: {"choices": [{"delta": {"content": "вет"}}]}',
+        "data: [DONE]",
+    ]
+    body = "\n\n".join(events) + "\n\n"
+    responses.add(responses.POST, url, body=body.encode(), status=200,
+                  content_type="text/event-stream")
+    monkeypatch.setattr(openrouter_module, "OPENROUTER_API_KEY", "test-key")
+    ttft_before = metric.latency("openrouter_ttft_ms").snapshot()["count"]
+
+    deltas = list(openrouter_module.chat_stream([{"role": "user", "content": "ping"}], model="m"))
+
+    assert deltas == ["При", "вет"]
+    assert json.loads(responses.calls[0].request.body.decode())["stream"] is True
+    assert metric.latency("openrouter_ttft_ms").snapshot()["count"] == ttft_before + 1
+
+
+@responses.activate
+def test_chat_stream_skips_chunks_without_choices(openrouter_module, monkeypatch):
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    events = [
+        'data: {"choices": [{"delta": {"content": "Готово"}}]}',
+        'data: {"choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 1}}',
+        'data: {"usage": {"total_tokens": 6}}',
+        "data: [DONE]",
+    ]
+    body = "\n\n".join(events) + "\n\n"
+    responses.add(responses.POST, url, body=body.encode(), status=200,
+                  content_type="text/event-stream")
+    monkeypatch.setattr(openrouter_module, "OPENROUTER_API_KEY", "test-key")
+
+    deltas = list(openrouter_module.chat_stream([{"role": "user", "content": "ping"}], model="m"))
+
+    assert deltas == ["Готово"]
+
+
+@responses.activate
+def test_chat_stream_error_chunk_raises(openrouter_module, monkeypatch):
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    events = [
+        'data: {"choices": [{"delta": {"content": "Нача"}}]}',
+        'data: {"choices": [], "error": {"code": 429, "message": "limit"}}',
+    ]
+    body = "\n\n".join(events) + "\n\n"
+    responses.add(responses.POST, url, body=body.encode(), status=200,
+                  content_type="text/event-stream")
+    monkeypatch.setattr(openrouter_module, "OPENROUTER_API_KEY", "test-key")
+
+    with pytest.raises(openrouter_module.OpenRouterError) as excinfo:
+        list(openrouter_module.chat_stream([{"role": "user", "content": "x"}], model="m"))
+    assert excinfo.value.status == 429
+
+
+@responses.activate
+def test_chat_stream_http_error(openrouter_module, monkeypatch):
+    url = "https://openrouter.ai/api/v1/chat/completions"
+    responses.add(responses.POST, url, json={"error": "bad"}, status=429)
+    monkeypatch.setattr(openrouter_module, "OPENROUTER_API_KEY", "test-key")
+
+    with pytest.raises(openrouter_module.OpenRouterError) as excinfo:
+        list(openrouter_module.chat_stream([{"role": "user", "content": "x"}], model="m"))
+    assert excinfo.value.status == 429
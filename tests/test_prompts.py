@@ -0,0 +1,30 @@
+from metrics import metric
+from prompts import PromptRegistry, build_messages
+
+
+def test_system_prompt_rendered_once():
+    registry = PromptRegistry()
+    character = {"id": 1, "name": "Йода", "prompt": "Коротко."}
+
+    first = registry.system_prompt(character)
+    second = registry.system_prompt(dict(character))
+
+    assert first is second, "Промпт должен собираться один раз"
+    assert "Йода" in first and "Коротко." in first and "Правила:" in first
+
+
+def test_system_prompt_rerendered_when_character_changes():
+    registry = PromptRegistry()
+    first = registry.system_prompt({"id": 1, "name": "Йода", "prompt": "Коротко."})
+    second = registry.system_prompt({"id": 1, "name": "Йода", "prompt": "Очень коротко."})
+
+    assert first is not second
+    assert "Очень коротко." in second
+
+
+def test_build_messages_is_timed():
+    before = metric.latency("build_messages_ms").snapshot()["count"]
+    msgs = build_messages({"id": 2, "name": "Спок", "prompt": "Логично."}, "Вопрос")
+
+    assert [m["role"] for m in msgs] == ["system", "user"]
+    assert metric.latency("build_messages_ms").snapshot()["count"] == before + 1
@@ -0,0 +1,62 @@
+"""
+Регрессионный тест планов запросов: горячие запросы db.py не должны
+сваливаться в полный просмотр (SCAN) таблиц.
+
+Запросы не дублируются здесь, а перехватываются через trace callback
+во время вызова функций db.py и затем проверяются EXPLAIN QUERY PLAN.
+"""
+
+import time
+
+HOT_TABLES = ("notes", "activity_log", "user_character", "llm_cache", "user_note_stats",
+              "activity_daily")
+
+
+def _capture(db, calls):
+    statements = []
+    with db._connect() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            for fn in calls:
+                fn()
+        finally:
+            conn.set_trace_callback(None)
+    return [s for s in statements if s.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))]
+
+
+def _scans(conn, sql):
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return [row["detail"] for row in plan
+            if row["detail"].startswith("SCAN") and row["detail"].split()[1] in HOT_TABLES]
+
+
+def test_hot_queries_use_indexes(db_module):
+    db = db_module
+    uid = 990001
+    for i in range(5):
+        db.add_note(uid, f"заметка {i}")
+    db.set_user_character(uid, 2)
+    db.llm_cache_put("k", "m", "ответ", time.time(), time.time() + 60)
+
+    statements = _capture(db, [
+        lambda: db.add_note(uid, "ещё одна"),
+        lambda: db.list_notes(uid),
+        lambda: db.list_notes_page(uid, before_id=4),
+        lambda: db.list_notes_page(uid, after_id=2),
+        lambda: db.list_all_notes(uid),
+        lambda: db.update_note(uid, 1, "новый текст"),
+        lambda: db.delete_note(uid, 2),
+        lambda: db.find_notes(uid, "заметка"),
+        lambda: db.find_notes(uid, "метк"),
+        lambda: db.get_weekly_stats(uid),
+        lambda: db.get_activity_stats(uid, 365),
+        lambda: db.count_notes(uid),
+        lambda: db._user_characters.clear(),
+        lambda: db.get_user_character(uid),
+        lambda: db.llm_cache_get("k", time.time()),
+    ])
+    assert statements, "Запросы не перехвачены"
+
+    with db._connect() as conn:
+        bad = {sql: scans for sql in statements if (scans := _scans(conn, sql))}
+    assert not bad, f"Запросы с полным просмотром таблиц: {bad}"
@@ -0,0 +1,82 @@
+import pytest
+
+import service_log
+
+
+@pytest.fixture()
+def recorder(db_module):
+    rec = service_log.ServiceCallRecorder(max_payload=20, max_rows=5, prune_every=1)
+    rec.start(flush_interval_ms=10000)
+    yield rec
+    rec.close()
+
+
+def _rows(db):
+    with db._connect() as conn:
+        return [dict(r) for r in conn.execute(
+            "SELECT service, request, response, status_code, duration_ms, error FROM service_call_log ORDER BY id")]
+
+
+def test_call_is_recorded_and_truncated(db_module, recorder):
+    with recorder.call("openrouter", {"model": "m", "messages": ["x" * 100]}) as c:
+        c.status_code = 200
+        c.response = "ответ"
+    assert recorder.flush(timeout=5)
+
+    [row] = _rows(db_module)
+    assert row["service"] == "openrouter" and row["status_code"] == 200
+    assert row["response"] == "ответ" and row["error"] is None
+    assert len(row["request"]) == 21 and row["request"].endswith("…")
+    assert row["duration_ms"] >= 0
+
+
+def test_errors_are_recorded_even_when_sampled_out(db_module, recorder):
+    recorder.sample_rate = 0.0
+
+    class Boom(Exception):
+        status = 503
+
+    with recorder.call("open-meteo", "ok") as c:
+        c.status_code = 200
+    with pytest.raises(Boom):
+        with recorder.call("open-meteo", "fail"):
+            raise Boom("нет связи")
+    recorder.flush(timeout=5)
+
+    [row] = _rows(db_module)
+    assert (row["request"], row["status_code"], row["error"]) == ("fail", 503, "нет связи")
+
+
+def test_table_is_pruned_to_max_rows(db_module, recorder):
+    for i in range(12):
+        recorder.record("openrouter", f"запрос {i}")
+    recorder.flush(timeout=5)
+    rows = _rows(db_module)
+    assert len(rows) <= 5 and rows[-1]["request"] == "запрос 11"
+
+
+def test_disabled_recorder_writes_nothing(db_module):
+    rec = service_log.ServiceCallRecorder()
+    with rec.call("openrouter", "x"):
+        pass
+    assert _rows(db_module) == []
+
+
+def test_chat_once_goes_to_service_log(db_module, openrouter_module, monkeypatch):
+    import responses
+
+    rec = service_log.recorder
+    rec.start(flush_interval_ms=10000)
+    try:
+        monkeypatch.setattr(openrouter_module, "OPENROUTER_API_KEY", "k")
+        with responses.RequestsMock() as mock:
+            mock.add(responses.POST, openrouter_module.OPENROUTER_API, status=200,
+                     json={"choices": [{"message": {"content": "Привет"}}]})
+            openrouter_module.chat_once([{"role": "user", "content": "?"}], model="test/model")
+        rec.flush(timeout=5)
+    finally:
+        rec.close()
+
+    [row] = _rows(db_module)
+    assert row["response"] == "Привет" and row["status_code"] == 200
+    assert '"model": "test/model"' in row["request"]